@@ -0,0 +1,95 @@
+# benchmark of the startup time of the pbs package and the pstat script
+#
+# Each command is run in a fresh python process (best of --repeat) with a
+# fake 'qstat' first on the PATH, whose '--version' takes --version-delay
+# seconds, as on a loaded cluster. Importing pbs or a backend, or a pstat
+# run that does not query the scheduler, should not run 'qstat --version':
+# the version is read from config.json.
+#
+# usage (from the repository root, after 'make'):
+#   python examples/bench_startup.py
+#   python examples/bench_startup.py --no-version   # config.json without "version"
+#
+# With --no-version, the first JobDB writes the version it queries to
+# config.json, so later runs do not query it again.
+
+import os
+import sys
+import json
+import stat
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+parser = argparse.ArgumentParser(description='Benchmark pbs import and pstat startup')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs of each command')
+parser.add_argument('--version-delay', type=float, default=0.5,
+                    help="Seconds taken by 'qstat --version' (default 0.5)")
+parser.add_argument('--no-version', default=False, action='store_true',
+                    help='Leave "version" out of config.json')
+args = parser.parse_args()
+
+# scratch $HOME with config.json, and a bin directory with the fake qstat
+tmpdir = tempfile.mkdtemp(prefix="bench_startup.")
+os.mkdir(os.path.join(tmpdir, ".pbs"))
+config = {"software" : "torque"}
+if not args.no_version:
+    config["version"] = "6.1.2"
+with open(os.path.join(tmpdir, ".pbs", "config.json"), "w") as f:
+    json.dump(config, f)
+bindir = os.path.join(tmpdir, "bin")
+os.mkdir(bindir)
+calls = os.path.join(tmpdir, "version_calls")
+with open(os.path.join(bindir, "qstat"), "w") as f:
+    f.write("#!/bin/sh\n"
+            + "if [ \"$1\" = \"--version\" ]; then\n"
+            + "  echo >> " + calls + "\n"
+            + "  sleep " + str(args.version_delay) + "\n"
+            + "  echo \"Version: 6.1.2\"\n"
+            + "fi\n")
+os.chmod(os.path.join(bindir, "qstat"), stat.S_IRWXU)
+
+env = dict(os.environ, HOME=tmpdir, PATH=bindir + os.pathsep + os.environ["PATH"],
+           PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+def best(cmd):
+    """Best wall time of 'repeat' runs of the command 'cmd' (a list)"""
+    times = []
+    with open(os.devnull, "w") as devnull:
+        for _ in range(args.repeat):
+            start = time.time()
+            subprocess.call(cmd, env=env, cwd=tmpdir, stdout=devnull, stderr=devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+def version_calls():
+    """Number of 'qstat --version' calls since the last call"""
+    if not os.path.exists(calls):
+        return 0
+    with open(calls) as f:
+        count = len(f.readlines())
+    os.remove(calls)
+    return count
+
+pstat = os.path.join(ROOT, "scripts", "pstat")
+commands = [("import pbs", [sys.executable, "-c", "import pbs"]),
+            ("import pbs.misc_torque", [sys.executable, "-c", "import pbs.misc_torque"]),
+            ("import pbs.misc_slurm", [sys.executable, "-c", "import pbs.misc_slurm"]),
+            ("pstat --help", [sys.executable, pstat, "--help"]),
+            ("pstat --key jobid 1", [sys.executable, pstat, "--key", "jobid", "1"])]
+
+try:
+    print "'qstat --version' takes", args.version_delay, "s"
+    for name, cmd in commands:
+        seconds = best(cmd)
+        print "%-24s %.3f s, %d 'qstat --version' calls in %d runs" % (
+            name, seconds, version_calls(), args.repeat)
+    if args.no_version:
+        with open(os.path.join(tmpdir, ".pbs", "config.json")) as f:
+            print "config.json afterwards:", json.load(f)
+finally:
+    shutil.rmtree(tmpdir)
@@ -0,0 +1,211 @@
+# benchmark and check of the scheduler status parsers against recorded outputs
+#
+# The records in examples/fixtures are copied, with new jobids, until the
+# queue holds about --jobs records, and served by fake scheduler commands. Each parser
+# is timed (best of --repeat) on the whole queue, and the jobs of the first
+# copy are checked against the values the records give. "USER" in the
+# records is replaced by the current user. The Torque "text" ('qstat -f') and
+# "xml" ('qstat -x') parsers must give the same status for the same queue.
+# Times are taken as UTC, as in the records.
+#
+# usage (from the repository root, after 'make'):
+#   python examples/bench_status_parsers.py
+#   python examples/bench_status_parsers.py --jobs 3000 --baseline
+#
+# --baseline also times querying each of the user's jobs with its own
+# scontrol process, as misc_slurm did before it used 'scontrol show job -o'.
+#
+# Exits with status 1 if a parser returned a wrong value.
+
+import os
+import re
+import sys
+import time
+import stat
+import shutil
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+from pbs import misc
+from pbs import misc_slurm
+from pbs import misc_torque
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+parser = argparse.ArgumentParser(description='Benchmark the scheduler status parsers')
+parser.add_argument('-n', '--jobs', type=int, default=3000, help='Number of scheduler records in the queue (default 3000)')
+parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed runs of each parser')
+parser.add_argument('--baseline', default=False, action='store_true',
+                    help='Also time one scontrol process per job')
+args = parser.parse_args()
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+user = misc.getlogin()
+failures = []
+
+def epoch(text):
+    """Local time "YYYY-mm-ddTHH:MM:SS" as int seconds since the epoch"""
+    return int(time.mktime(datetime.datetime.strptime(text, "%Y-%m-%dT%H:%M:%S").timetuple()))
+
+def check(name, status, expected):
+    """Compare the fields in the dict 'expected' {jobid: {key: value}} with 'status'"""
+    for jobid, fields in sorted(expected.items()):
+        if fields is None:
+            if jobid in status:
+                failures.append(name + ": " + jobid + " should not be listed")
+            continue
+        if jobid not in status:
+            failures.append(name + ": " + jobid + " not found")
+            continue
+        for key, value in sorted(fields.items()):
+            if status[jobid].get(key) != value:
+                failures.append(name + ": " + jobid + " " + key + " = " + repr(status[jobid].get(key))
+                                + ", expected " + repr(value))
+
+def replicate(lines, copies, renumber):
+    """Return the text of 'copies' copies of 'lines', renumber(line, copy) giving
+       the line of each copy"""
+    return "".join([renumber(line, k) for k in range(copies) for line in lines])
+
+def fake_command(bindir, name, body):
+    """Write the shell script 'name' in 'bindir'"""
+    path = os.path.join(bindir, name)
+    with open(path, "w") as f:
+        f.write("#!/bin/sh\n" + body)
+    os.chmod(path, stat.S_IRWXU)
+
+def best(func):
+    """Best wall time of 'repeat' calls of func(), and its last result"""
+    times = []
+    for _ in range(args.repeat):
+        start = time.time()
+        result = func()
+        times.append(time.time() - start)
+    return min(times), result
+
+def calls(bindir):
+    """Number of fake commands run since the last call"""
+    path = os.path.join(bindir, "calls")
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        count = len(f.readlines())
+    os.remove(path)
+    return count
+
+tmpdir = tempfile.mkdtemp(prefix="bench_status_parsers.")
+os.environ["PATH"] = tmpdir + os.pathsep + os.environ["PATH"]
+
+try:
+    ### Slurm: 'scontrol show job -o' ###
+    with open(os.path.join(FIXTURES, "scontrol_show_job.txt")) as f:
+        lines = [line.replace("USER", user) for line in f]
+    copies = max(1, args.jobs/len(lines))
+    data = os.path.join(tmpdir, "scontrol.txt")
+    with open(data, "w") as f:
+        f.write(replicate(lines, copies, lambda line, k: re.sub(
+            r"JobId=([0-9]+)", lambda m: "JobId=" + str(int(m.group(1)) + 100*k), line)))
+    fake_command(tmpdir, "scontrol",
+                 "echo \"$@\" >> " + tmpdir + "/calls\n"
+                 + "if [ -n \"$4\" ]; then grep \"^JobId=$4 \" " + data + "; else cat " + data + "; fi\n")
+
+    seconds, status = best(misc_slurm.job_status)
+    print "slurm job_status(): %d jobs in %.3f s, %.1f scontrol calls per run" % (
+        len(status), seconds, calls(tmpdir)/float(args.repeat))
+    check("slurm", status, {
+        "1001" : {"jobname" : "relax", "jobstatus" : "R", "nodes" : 2, "procs" : 32,
+                  "walltime" : 86400, "elapsedtime" : 3723, "cluster" : "flux",
+                  "starttime" : epoch("2026-10-18T09:10:00")},
+        "1002" : {"jobname" : "band", "jobstatus" : "Q", "nodes" : 1, "procs" : 16,
+                  "walltime" : 14400, "starttime" : None},
+        "1003_1" : {"jobname" : "sweep", "jobstatus" : "R", "walltime" : 1800,
+                    "elapsedtime" : 300},
+        "1003_2" : {"jobstatus" : "Q"}, "1003_4" : {"jobstatus" : "Q"}, "1003_5" : None,
+        "1005" : {"jobstatus" : "C", "elapsedtime" : 1200},
+        "1006" : None,
+        "1007" : {"jobname" : "scan T=300 K", "jobstatus" : "R", "procs" : 32},
+        "1008" : {"jobname" : "phonon", "jobstatus" : "R", "walltime" : 86400, "nodes" : 2}})
+    check("slurm", {"count" : {"jobs" : len(status)}}, {"count" : {"jobs" : 9*copies}})
+    rundir = misc_slurm.job_rundir(["1001", "1007", "1008"])
+    if rundir != {"1001" : "/home/" + user + "/calc/relax", "1007" : "/home/" + user + "/calc/scan T=300 K",
+                  "1008" : "/home/" + user + "/calc/phonon"}:
+        failures.append("slurm rundir: " + repr(rundir))
+
+    seconds, status = best(lambda: misc_slurm.job_status(["1001", "1003_2", "1105"]))
+    print "slurm job_status(3 jobids): %d jobs in %.3f s" % (len(status), seconds)
+    calls(tmpdir)
+    check("slurm jobid", status, {"1001" : {"jobstatus" : "R"}, "1003_2" : {"jobstatus" : "Q"},
+                                  "1105" : {"jobstatus" : "C"}, "1002" : None})
+
+    if args.baseline:
+        jobid = [l.split()[0].split("=")[1] for l in open(data) if "UserId=" + user + "(" in l]
+        seconds, _ = best(lambda: [subprocess.check_output(["scontrol", "show", "job", "-o", j])
+                                   for j in jobid])
+        print "slurm baseline, one scontrol per job: %d processes in %.3f s" % (len(jobid), seconds)
+        calls(tmpdir)
+
+    ### Torque: 'qstat -f' and 'qstat -x' ###
+    with open(os.path.join(FIXTURES, "qstat_f.txt")) as f:
+        records = [r + "\n\n" for r in f.read().replace("USER", user).split("\n\n") if r.strip()]
+    with open(os.path.join(FIXTURES, "qstat_x.xml")) as f:
+        xml = f.read().replace("USER", user)
+    elements = re.findall(r"<Job>.*?</Job>", xml)
+    copies = max(1, args.jobs/len(records))
+    renumber = lambda text, k: re.sub(r"(Job Id: |<Job_Id>)([0-9]+)",
+                                      lambda m: m.group(1) + str(int(m.group(2)) + 100*k), text)
+    with open(os.path.join(tmpdir, "qstat_f.txt"), "w") as f:
+        f.write(replicate(records, copies, renumber))
+    with open(os.path.join(tmpdir, "qstat_x.xml"), "w") as f:
+        f.write('<?xml version="1.0"?>\n<Data>' + replicate(elements, copies, renumber) + "</Data>\n")
+    fake_command(tmpdir, "qstat",
+                 "echo \"$@\" >> " + tmpdir + "/calls\n"
+                 + "case \"$*\" in\n"
+                 + "  --version) echo \"Version: 6.1.2\" ;;\n"
+                 + "  *-x*UNKNOWN*) echo \"qstat: Unknown Job Id Error UNKNOWN.mgmt.flux\" >&2; exit 153 ;;\n"
+                 + "  *-x*DOWN*) echo \"qstat: cannot connect to server mgmt.flux (errno=111)\" >&2; exit 2 ;;\n"
+                 + "  -x*) cat " + tmpdir + "/qstat_x.xml ;;\n"
+                 + "  -u*) awk -v RS= -v ORS='\\n\\n' '/Job_Owner = " + user + "@/' "
+                 + tmpdir + "/qstat_f.txt ;;\n"
+                 + "  *) cat " + tmpdir + "/qstat_f.txt ;;\n"
+                 + "esac\n")
+    misc.getversion("torque")
+    calls(tmpdir)
+
+    results = dict()
+    for name in ["text", "xml"]:
+        seconds, results[name] = best(lambda: misc_torque.job_status(parser=name))   #pylint: disable=cell-var-from-loop
+        print "torque job_status(parser=%s): %d jobs in %.3f s, %.1f qstat calls per run" % (
+            name, len(results[name]), seconds, calls(tmpdir)/float(args.repeat))
+    check("torque xml", results["xml"], {
+        "2001" : {"jobname" : "relax", "jobstatus" : "R", "nodes" : 2, "procs" : 32,
+                  "walltime" : 86400, "starttime" : epoch("2026-10-18T09:10:00")},
+        "2002" : {"jobname" : "band", "jobstatus" : "Q", "procs" : 16, "starttime" : None},
+        "2003[1]" : {"jobstatus" : "R", "walltime" : 1800}, "2003[2]" : {"jobstatus" : "Q"},
+        "2004" : {"jobstatus" : "C", "completiontime" : epoch("2026-10-18T08:50:00")},
+        "2005" : None})
+    check("torque xml", {"count" : {"jobs" : len(results["xml"])}}, {"count" : {"jobs" : 5*copies}})
+    for jobid, status in sorted(results["text"].items()):
+        status["qstatstr"] = status["qstatstr"].rstrip("\n") + "\n"
+        check("torque xml vs text", results["xml"], {jobid : dict(
+            [(key, status.get(key)) for key in ["jobname", "jobstatus", "procs", "walltime", "starttime",
+                                                "completiontime", "qstatstr"]])})
+    if set(results["text"]) != set(results["xml"]):
+        failures.append("torque xml vs text: different jobs")
+
+    check("torque unknown jobid", misc_torque.job_status("UNKNOWN", parser="xml"), {"UNKNOWN" : None})
+    try:
+        misc_torque.job_status("DOWN", parser="xml")
+        failures.append("torque qstat failure: no PBSError")
+    except misc.PBSError:
+        pass
+finally:
+    shutil.rmtree(tmpdir)
+
+if failures:
+    print "FAILED:"
+    print "\n".join(["  " + f for f in failures])
+    sys.exit(1)
+print "OK"
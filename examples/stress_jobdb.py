@@ -0,0 +1,104 @@
+# stress test for concurrent writes to one JobDB database
+#
+# Forks N writer processes, which all start at the same moment, like the jobs
+# of a large array finishing together. Each writer opens its own pbs.JobDB,
+# adds records with add() and marks records 'Complete' with complete_job().
+# Afterwards every record and every completion mark must be in the database.
+#
+# usage (from the repository root, after 'make'):
+#   python examples/stress_jobdb.py                  # 40 writers, rollback journal
+#   python examples/stress_jobdb.py --wal            # WAL journaling
+#   python examples/stress_jobdb.py --retries 1 --busy-timeout 0
+#                                                    # no retries: marks get lost
+#
+# The scheduler is not used. Exits with status 1 if a write was lost.
+
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+
+import pbs
+
+parser = argparse.ArgumentParser(description='Fork writers against one JobDB database')
+parser.add_argument('-n', '--writers', type=int, default=40, help='Number of writer processes')
+parser.add_argument('-j', '--jobs', type=int, default=5, help='Records written by each writer')
+parser.add_argument('--wal', default=False, action='store_true', help='Use WAL journaling')
+parser.add_argument('--busy-timeout', type=float, default=1.0,
+                    help='Seconds to wait for the database lock (default 1.0)')
+parser.add_argument('--retries', type=int, default=10,
+                    help='JobDB.write_retries (default 10, 1 disables retries)')
+args = parser.parse_args()
+
+# the database and config.json are created in $HOME/.pbs, so use a scratch $HOME
+tmpdir = tempfile.mkdtemp(prefix="stress_jobdb.")
+os.environ["HOME"] = tmpdir
+os.mkdir(os.path.join(tmpdir, ".pbs"))
+with open(os.path.join(tmpdir, ".pbs", "config.json"), "w") as f:
+    json.dump({"software" : "other", "version" : "0"}, f)
+
+def open_db():
+    """Open the test database with the requested concurrency options"""
+    db = pbs.JobDB(wal=args.wal, busy_timeout=args.busy_timeout)
+    db.write_retries = args.retries
+    return db
+
+def jobid(writer, i, kind):
+    """jobid of record 'i' of 'writer', "a" added or "c" completed"""
+    return "{0}{1:04d}{2:04d}".format(9 if kind == "a" else 8, writer, i)
+
+# records that the writers will mark 'Complete'
+db = open_db()
+for w in range(args.writers):
+    for i in range(args.jobs):
+        db.add(pbs.jobdb.job_status_dict(jobid=jobid(w, i, "c"), jobname="stress",
+                                          jobstatus="R", auto=1, qsubstr="#!/bin/sh\n"))
+journal_mode = db.journal_mode
+db.close()
+
+start = time.time() + 1.0
+pids = []
+for w in range(args.writers):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            time.sleep(max(0.0, start - time.time()))
+            db = open_db()
+            for i in range(args.jobs):
+                db.add(pbs.jobdb.job_status_dict(jobid=jobid(w, i, "a"), jobname="stress",
+                                                  jobstatus="R", auto=1,
+                                                  qsubstr="#!/bin/sh\n# " + str(w) + "\n"))
+                db.complete_job(jobid(w, i, "c"))
+            db.close()
+        except Exception as e:  #pylint: disable=broad-except
+            print "writer", w, "failed:", e
+            code = 1
+        os._exit(code)  #pylint: disable=protected-access
+    pids.append(pid)
+
+failed_writers = 0
+for pid in pids:
+    failed_writers += os.waitpid(pid, 0)[1] != 0
+elapsed = time.time() - start
+
+db = open_db()
+db.curs.execute("SELECT count(*) FROM jobs WHERE jobid LIKE '9%'")
+added = db.curs.fetchone()[0]
+db.curs.execute("SELECT count(*) FROM jobs WHERE jobid LIKE '8%' AND taskstatus='Complete'")
+completed = db.curs.fetchone()[0]
+db.close()
+shutil.rmtree(tmpdir)
+
+expected = args.writers*args.jobs
+print "journal mode:", journal_mode, "  busy timeout:", args.busy_timeout, "s  retries:", args.retries
+print "writers:", args.writers, "  failed writers:", failed_writers, "  time: %.2f s" % elapsed
+print "records added:", added, "of", expected
+print "completion marks:", completed, "of", expected
+if added != expected or completed != expected:
+    print "FAILED: writes were lost"
+    sys.exit(1)
+print "OK"
@@ -3,6 +3,8 @@ from job import *
 from jobdb import *
 from misc import *
 from templates import *
+from workflow import *
+from bundle import *
 __version__ = "VERSION_ID (git sha COMMIT_ID)"
 __all__ = dir()
 
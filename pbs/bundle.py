@@ -0,0 +1,229 @@
+""" Bundling many short commands into a few jobs
+
+pbs.submit_tasks() packs commands ("tasks") into as few copies of a Job as
+fit in its walltime, and stores them in the JobDB 'tasks' table. Each job
+runs a bundled worker ("python -m pbs.bundle BUNDLE SLOTS WALLTIME") which
+runs its tasks, at most nodes*ppn task procs at a time, and records their
+status in the jobs database in batches, so 'pstat' shows the status of each
+task without one database write per task.
+
+Bundle jobs are 'auto' jobs: the worker marks its job 'Complete' once every
+task of the bundle ran. If the job ends first (the worker does not start
+tasks that would not finish within the walltime), 'taskmaster' continues it
+and the next job runs the remaining tasks.
+"""
+### External ###
+import os
+import sys
+import copy
+import time
+import heapq
+import signal
+import subprocess
+import collections
+
+### Local ###
+import jobdb
+import misc
+from job import submit_many
+
+# number of finished tasks, and seconds, after which a worker records task
+# status (config.json "task_batch_size" and "task_batch_interval")
+BATCH_SIZE = 100
+BATCH_INTERVAL = 30.0
+
+# seconds between checks for finished tasks
+POLL_INTERVAL = 0.5
+
+
+def _pack(tasks, slots, walltime):
+    """Split the list 'tasks' (dicts with "procs" and "walltime", in seconds)
+       into as few bundles as possible, each expected to finish within
+       'walltime' seconds on 'slots' slots.
+
+       A bundle fits if its work (sum of procs*walltime) divided by 'slots',
+       plus its longest task walltime, is at most 'walltime': the worker,
+       starting tasks as slots free up, then finishes in time. Tasks are
+       assigned longest first to the least loaded bundle, and keep their
+       order within a bundle. A task that does not fit even alone gets a
+       bundle of its own (submit_tasks() refuses such tasks).
+    """
+    total = sum([t["procs"]*t["walltime"] for t in tasks])
+    count = max(1, int(total/(slots*walltime)))
+    order = sorted(range(len(tasks)), key=lambda i: -tasks[i]["procs"]*tasks[i]["walltime"])
+    while True:
+        bundles = [[] for _ in range(count)]
+        work = [0.0]*count
+        longest = [0.0]*count
+        heap = [(0.0, b) for b in range(count)]
+        for i in order:
+            _, b = heapq.heappop(heap)  #pylint: disable=invalid-name
+            bundles[b].append(i)
+            work[b] += tasks[i]["procs"]*tasks[i]["walltime"]
+            longest[b] = max(longest[b], tasks[i]["walltime"])
+            heapq.heappush(heap, (work[b], b))
+        if count >= len(tasks) or not [b for b in range(count)
+                                       if work[b]/slots + longest[b] > walltime]:
+            return [[tasks[i] for i in sorted(b)] for b in bundles if b]
+        count += 1
+
+
+def submit_tasks(commands, job, procs=1, walltime="0:10:00", concurrency=None,    #pylint: disable=too-many-arguments
+                 dbpath=None, configpath=None):
+    """Run the shell commands in the list 'commands' as tasks bundled into as
+       few copies of Job 'job' as fit in its walltime.
+
+       Each task needs 'procs' of the job's nodes*ppn slots, and is expected
+       to run for 'walltime' ("[[HH:]MM:]SS"). Tasks run from the current
+       directory, with output in "task<id>.out". The bundle jobs are named
+       after 'job' and the bundle id, submitted as 'auto' jobs with at most
+       'concurrency' submissions at a time (see submit_many()), and added
+       to the JobDB database.
+
+       Returns the list of jobids of the bundle jobs.
+
+       Raises PBSError if a task does not fit in 'job', or if any submission
+       failed. The tasks of bundles that were not submitted are removed from
+       the database, and the PBSError's 'failed' attribute is the list of
+       their Job.
+    """
+    slots = job.nodes*job.ppn
+    job_walltime = misc.seconds(job.walltime)
+    task_walltime = misc.seconds(walltime)
+    if procs > slots:
+        raise misc.PBSError(job.name, "Tasks need " + str(procs) + " procs, but the job has "
+                            + str(slots))
+    if procs*task_walltime/slots + task_walltime > job_walltime:
+        raise misc.PBSError(job.name, "Tasks need " + str(procs) + " procs for walltime "
+                            + walltime + ", which does not fit in a job of " + str(slots)
+                            + " procs and walltime " + job.walltime)
+
+    tasks = [{"command" : command, "rundir" : os.getcwd(), "procs" : procs,
+              "walltime" : int(task_walltime)} for command in commands]
+    db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
+    try:
+        bundles = db.add_tasks(_pack(tasks, slots, job_walltime))
+        jobs = []
+        for bundle in bundles:
+            bundle_job = copy.copy(job)
+            bundle_job.name = job.name + "_" + str(bundle)
+            bundle_job.auto = True
+            bundle_job.command = _worker_command(bundle, slots, job_walltime, dbpath)
+            jobs.append(bundle_job)
+
+        try:
+            jobids = submit_many(jobs, concurrency, dbpath=dbpath, configpath=configpath)
+        except misc.PBSError as e:  #pylint: disable=invalid-name
+            db.delete_tasks([b for b, jobid in zip(bundles, e.results) if jobid is None])
+            db.set_bundle_jobid(dict([(b, jobid) for b, jobid in zip(bundles, e.results)
+                                      if jobid is not None]))
+            raise
+        db.set_bundle_jobid(dict(zip(bundles, jobids)))
+    finally:
+        db.close()
+    return jobids
+
+
+def _worker_command(bundle, slots, walltime, dbpath=None):
+    """Return the command of a job running the worker of bundle 'bundle'"""
+    cmd = "python -m pbs.bundle {0} {1} {2}".format(bundle, slots, int(walltime))
+    if dbpath is not None:
+        cmd += " " + os.path.abspath(dbpath)
+    return cmd
+
+
+def _terminate(signum, frame):   #pylint: disable=unused-argument
+    """SIGTERM handler, so that the worker records task status before the
+       scheduler kills it"""
+    raise SystemExit(1)
+
+
+def run_worker(bundle, slots, walltime=None, dbpath=None):     #pylint: disable=too-many-locals, too-many-branches, too-many-statements
+    """Run the tasks of bundle 'bundle' that have not run, oldest first, using
+       at most 'slots' procs at a time, and record their status in the jobs
+       database every "task_batch_size" finished tasks or
+       "task_batch_interval" seconds (config.json).
+
+       Tasks that would not finish within 'walltime' seconds of the start of
+       the worker are not started. If the worker is terminated, running tasks
+       are killed and left 'Queued', to run again.
+
+       When no task of the bundle is left to run, the job running the worker
+       is marked 'Complete'. Raises JobDBError or EligibilityError if it can
+       not be, as pbs.complete_job() does.
+    """
+    db = jobdb.JobDB(dbpath=dbpath)     #pylint: disable=invalid-name
+    misc_pbs = misc.get_backend(db.config["software"])
+    jobid = misc_pbs.job_id()
+    batch_size = db.config.get("task_batch_size", BATCH_SIZE)
+    batch_interval = db.config.get("task_batch_interval", BATCH_INTERVAL)
+
+    begin = time.time()
+    todo = collections.deque([t for t in db.select_tasks(bundle=bundle)
+                              if t["status"] in ("Queued", "Running")])
+    running = dict()
+    changed = collections.OrderedDict()
+    finished = 0
+    recorded = time.time()
+    used = 0
+
+    signal.signal(signal.SIGTERM, _terminate)
+    try:
+        while todo or running:
+            while (todo and (used + todo[0]["procs"] <= slots or not running)
+                   and (walltime is None or time.time() - begin + todo[0]["walltime"] <= walltime)):
+                task = todo.popleft()
+                # in its own process group, to be killed with its children, but in
+                # the job's session, which the scheduler kills with the job
+                with open(os.path.join(task["rundir"], "task" + str(task["id"]) + ".out"),
+                          "w") as out:
+                    proc = subprocess.Popen(task["command"], shell=True, cwd=task["rundir"],
+                                            stdout=out, stderr=subprocess.STDOUT,
+                                            preexec_fn=os.setpgrp)
+                record = {"id" : task["id"], "jobid" : jobid, "status" : "Running",
+                          "exit_status" : None, "starttime" : int(time.time()),
+                          "completiontime" : None}
+                running[task["id"]] = (proc, task["procs"], record)
+                changed[task["id"]] = record
+                used += task["procs"]
+            if not running:
+                # the remaining tasks would not finish within the walltime
+                break
+
+            time.sleep(POLL_INTERVAL)
+            for task_id, (proc, procs, record) in running.items():
+                if proc.poll() is None:
+                    continue
+                del running[task_id]
+                used -= procs
+                record["status"] = "Complete" if proc.returncode == 0 else "Error"
+                record["exit_status"] = proc.returncode
+                record["completiontime"] = int(time.time())
+                changed[task_id] = record
+                finished += 1
+            if finished >= batch_size or time.time() - recorded >= batch_interval:
+                db.update_tasks(changed.values())
+                changed.clear()
+                finished = 0
+                recorded = time.time()
+    finally:
+        for proc, procs, record in running.values():
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            record.update(status="Queued", starttime=None)
+            changed[record["id"]] = record
+        if changed:
+            db.update_tasks(changed.values())
+
+    try:
+        if jobid is not None and not todo:
+            db.complete_job(jobid)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    run_worker(int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3]),
+               sys.argv[4] if len(sys.argv) > 4 else None)
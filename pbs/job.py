@@ -5,6 +5,8 @@ import re
 import os
 import sys
 import StringIO
+import copy
+import collections
 
 ### Local ###
 import jobdb
@@ -47,22 +49,23 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
                  pmem=None, qos=None, queue=None, exetime=None, message="a", email=None,
                  priority="0", command=None, auto=False, substr=None, software=None):
 
-        if substr != None:
-            self.read(substr)
-            return
-
         # Determines the software and loads the appropriate package
         if software is None:
             software = misc.getsoftware()
         self.software = software
 
         global misc_pbs
-        if self.software.strip() == "torque":
-		misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
-	elif self.software.strip() == "slurm":
-		misc_pbs = __import__("pbs.misc_slurm", globals(), locals(), [], -1).misc_slurm
-	else:
-		misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
+        misc_pbs = misc.get_backend(self.software.strip())
+
+        # array job index range ("0-9"), set by submit_array()
+        self.array = None
+
+        # jobID
+        self.jobID = None   #pylint: disable=invalid-name
+
+        if substr != None:
+            self.read(substr)
+            return
 
         # Declares a name for the job. The name specified may be up to and including
         # 15 characters in length. It must consist of printable, non white space characters
@@ -127,11 +130,6 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
 
         #self.date_time
 
-        ##################################
-        # Submission status:
-
-        # jobID
-        self.jobID = None   #pylint: disable=invalid-name
 
     #
 
@@ -145,6 +143,8 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
             ###    auto
             jobstr = "#!/bin/sh\n"
             jobstr += "#SBATCH -J {0}\n".format(self.name)
+            if self.array is not None:
+                jobstr += misc_pbs.array_directive(self.array)
             if self.account is not None:
                 jobstr += "#SBATCH -A {0}\n".format(self.account)
             jobstr += "#SBATCH -t {0}\n".format(self.walltime)
@@ -175,6 +175,8 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
             jobstr = "#!/bin/sh\n"
             jobstr += "#PBS -S /bin/sh\n"
             jobstr += "#PBS -N {0}\n".format(self.name)
+            if self.array is not None:
+                jobstr += misc_pbs.array_directive(self.array)
             if self.exetime is not None:
                 jobstr += "#PBS -a {0}\n".format(self.exetime)
             if self.account is not None:
@@ -221,22 +223,38 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
            Raises PBSError if error submitting the job.
 
         """
+        substr = self.sub_string()
         try:
-            self.jobID = misc_pbs.submit(substr=self.sub_string())
+            self.jobID = misc_pbs.submit(substr=substr)
         except misc.PBSError as e:  #pylint: disable=invalid-name
             raise e
 
         if add:
             db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
-            status = jobdb.job_status_dict(jobid=self.jobID, jobname=self.name,
-                                           rundir=os.getcwd(), jobstatus="?",
-                                           auto=self.auto, qsubstr=self.sub_string(),
-                                           walltime=misc.seconds(self.walltime),
-                                           nodes=self.nodes, procs=self.nodes*self.ppn)
-            db.add(status)
+            db.add(self.status_dict(substr))
             db.close()
 
 
+    def status_dict(self, substr=None):
+        """Return the pbs.jobdb.job_status_dict() record of this submitted Job.
+           'substr' is its submit script, sub_string() if not given."""
+        if substr is None:
+            substr = self.sub_string()
+        return jobdb.job_status_dict(jobid=self.jobID, jobname=self.name,
+                                     rundir=os.getcwd(), jobstatus="?",
+                                     auto=self.auto, qsubstr=substr,
+                                     walltime=misc.seconds(self.walltime),
+                                     nodes=self.nodes, procs=self.nodes*self.ppn)
+
+
+    def array_key(self):
+        """Jobs with equal array_key() have the same submit script header, apart
+           from the job name, and can be submitted as one array job"""
+        return (self.software, self.account, self.nodes, self.ppn, self.walltime, self.pmem,
+                self.qos, self.queue, self.exetime, self.message, self.email, self.priority,
+                self.auto)
+
+
     def read(self, qsubstr):    #pylint: disable=too-many-branches, too-many-statements
         """Set this Job object from string representing a PBS submit script.
 
@@ -252,6 +270,7 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
         s = StringIO.StringIO(qsubstr)  #pylint: disable=invalid-name
 
         self.pmem = None
+        self.array = None
         self.email = None
         self.message = "a"
         self.priority = "0"
@@ -300,6 +319,10 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
                     self.exetime = m.group(1)
                     optional["exetime"] = self.exetime
 
+                m = re.search(r"-t\s+(.*)\s", line)  #pylint: disable=invalid-name
+                if m:
+                    self.array = m.group(1)
+
                 m = re.search(r"\s-l\s", line)   #pylint: disable=invalid-name
                 if m:
                     m = re.search(r"walltime=([0-9:]+)", line)   #pylint: disable=invalid-name
@@ -391,8 +414,121 @@ class Job(object):  #pylint: disable=too-many-instance-attributes
     # end def
 
 
+def submit_array(jobs, add=True, dbpath=None, configpath=None, max_array_size=None):
+    """Submit a list of Job as array jobs.
+
+       Jobs with the same submit script header, apart from the job name (see
+       Job.array_key()), are submitted together as array jobs (Torque '-t',
+       Slurm '--array') of at most 'max_array_size' elements, each named after
+       its first job. Array element i runs the command of the i-th job of its
+       array. By default, 'max_array_size' is the backend's MAX_ARRAY_SIZE,
+       set from the "max_array_size" config.json value when the JobDB is
+       opened (before submitting, if 'add').
+
+       Each Job's jobID is set to its array element's jobid ("123[4]" with
+       Torque, "123_4" with Slurm). If 'add', one record per Job is added to
+       the JobDB database in one transaction, with the Job's own submit script.
+
+       Returns the list of jobids, in the order of 'jobs'.
+
+       Raises PBSError if error submitting an array job. The jobs of arrays
+       submitted before the error are still added to the database.
+    """
+    db = None   #pylint: disable=invalid-name
+    if add:
+        db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
+    if max_array_size is None:
+        max_array_size = getattr(misc_pbs, "MAX_ARRAY_SIZE", None) or len(jobs)
+    max_array_size = max(1, max_array_size)
+
+    groups = collections.OrderedDict()
+    for job in jobs:
+        groups.setdefault(job.array_key(), []).append(job)
+    arrays = [group[i:i+max_array_size] for group in groups.values()
+              for i in range(0, len(group), max_array_size)]
+
+    status = []
+    try:
+        for group in arrays:
+            array = copy.copy(group[0])
+            array.array = "0-" + str(len(group) - 1)
+            array.command = _array_command(group)
+            jobid = misc_pbs.submit(substr=array.sub_string())
+            for i, job in enumerate(group):
+                job.jobID = misc_pbs.array_jobid(jobid, i)
+                if add:
+                    status.append(job.status_dict())
+    finally:
+        if db is not None:
+            if status:
+                db.add_many(status)
+            db.close()
+
+    return [job.jobID for job in jobs]
+
+
+def submit_many(jobs, concurrency=None, add=True, dbpath=None, configpath=None):
+    """Submit a list of Job, with at most 'concurrency' submissions running at
+       the same time (default: the "concurrency" config.json value, see
+       pbs.misc.fan_out()).
 
+       If 'add', the records of the submitted jobs are added to the JobDB
+       database in one transaction, also when some submissions failed.
 
+       Returns the list of jobids, in the order of 'jobs'.
 
+       Raises PBSError if any submission failed. Its 'failed' attribute is the
+       list of Job that were not submitted and its 'results' attribute the
+       list of jobids (None for failed submissions).
+    """
+    substr = [job.sub_string() for job in jobs]
+
+    def _submit(i):
+        """Submit jobs[i]"""
+        jobs[i].jobID = misc_pbs.submit(substr=substr[i])
+        return jobs[i].jobID
+
+    error = None
+    try:
+        jobids = misc.fan_out(_submit, range(len(jobs)), concurrency)
+    except misc.PBSError as e:  #pylint: disable=invalid-name
+        jobids = e.results
+        error = misc.PBSError(", ".join([jobs[i].name for i in e.failed]),
+                              "\n".join([getattr(x, "msg", str(x)) for x in e.errors]))
+        error.failed = [jobs[i] for i in e.failed]
+        error.results = jobids
+
+    if add:
+        status = [job.status_dict(substr[i]) for i, job in enumerate(jobs)
+                  if jobids[i] is not None]
+        if status:
+            db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
+            db.add_many(status)
+            db.close()
 
+    if error is not None:
+        raise error
+    return jobids
 
+
+def enqueue(jobs, dbpath=None, configpath=None):
+    """Add a list of Job to the JobDB 'pending' table instead of submitting them.
+
+       They are submitted from the current directory by JobDB.drain() (run by
+       'taskmaster'), as fast as the "max_queued" config.json limit allows.
+
+       Returns the list of pending ids.
+    """
+    db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
+    ids = db.enqueue([job.status_dict() for job in jobs])
+    db.close()
+    return ids
+
+
+def _array_command(group):
+    """Return the command of an array job running group[i].command for array index i"""
+    cmd = ["case \"${" + misc_pbs.ARRAY_INDEX_VAR + "}\" in"]
+    for i, job in enumerate(group):
+        cmd += [str(i) + ")", job.command, ";;"]
+    cmd += ["esac"]
+    return "\n".join(cmd)
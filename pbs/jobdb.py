@@ -5,14 +5,20 @@ global pbs_misc
 import sqlite3
 import os
 import sys
-import socket
+import errno
 import time
 import re
+import random
+import functools
+import collections
+import zlib
+import hashlib
 # import subprocess
 # import datetime
 import json
 
 import misc
+from status_cache import StatusCache
 
 class JobDBError(Exception):
     """ Custom error class for JobDBs"""
@@ -38,15 +44,62 @@ class EligibilityError(Exception):
 # columns in database (see job_status_dict()):
 # username, hostname, jobid, jobname, rundir, jobstatus, auto, taskstatus,
 # continuation_jobid, qsubstr, qstatstr, nodes, proc, walltime, starttime,
-# completiontime, elapsedtime
+# completiontime, elapsedtime, series_id, series_index, cluster, jobid_num,
+# array_index
+#
+# series_id is the jobid of the first job in a series of continued auto jobs,
+# and series_index the position of the job in that series (starting at 0).
+# cluster is misc.cluster_name(hostname), used to select the jobs of this cluster.
+# jobid_num and array_index are misc.parse_jobid(jobid), used to select by range.
+#
+# The large text fields (TEXT_KEYS: the submit script and the qstat output) are
+# not stored in the jobs table, but zlib-compressed in the 'job_text' table, and
+# only loaded when needed (see JobDB.select_text()). Submit scripts are stored
+# once in the 'scripts' table, keyed by script_hash(qsubstr), and job_text rows
+# reference them, so continuations and similar jobs share one copy.
+#
+# Jobs waiting to be submitted (see JobDB.enqueue() and JobDB.drain()) are in
+# the 'pending' table until they are submitted and added to the jobs table.
+#
+# The jobs of workflows (see JobDB.add_workflow() and JobDB.submit_workflow())
+# are in the 'workflow_nodes' table, with the jobid of their job once
+# submitted, and their dependencies in the 'workflow_edges' table.
+#
+# Commands bundled into jobs by pbs.submit_tasks() are in the 'tasks' table,
+# with their status as recorded by the bundled worker running them.
+TEXT_KEYS = ("qsubstr", "qstatstr")
 
 # allowed values (not checked at this time):
 # taskstatus = ["Incomplete","Complete","Continued","Check","Error:.*","Aborted"]
 # jobstatus = ["C","Q","R","E","W","H","M"]
 # auto=[1,0]
 
-def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-arguments, too-many-locals
-                    hostname=socket.gethostname(),
+# Maximum number of jobids passed to one scheduler call by JobDB.update(),
+# to stay well below argv length limits
+POLL_CHUNK_SIZE = 500
+
+# claim tokens (see _claim_token()) of the jobs this process is submitting
+_ACTIVE_CLAIMS = set()
+
+# compiled patterns used by regexp(), least recently used first
+_REGEXP_CACHE = collections.OrderedDict()
+_REGEXP_CACHE_SIZE = 64
+
+# Recursive query that rebuilds series from continuation_jobid: (series_id,
+# jobid, series_index) for every job reachable from a first job, i.e. a job
+# which is not the continuation of another job.
+SERIES_CTE = """WITH RECURSIVE
+    chain(series_id, jobid, series_index) AS (
+        SELECT jobid, jobid, 0 FROM jobs AS root
+            WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE jobs.continuation_jobid=root.jobid)
+        UNION ALL
+        SELECT chain.series_id, child.jobid, chain.series_index+1 FROM chain
+            JOIN jobs AS parent ON parent.jobid=chain.jobid
+            JOIN jobs AS child ON child.jobid=parent.continuation_jobid)
+"""
+
+def job_status_dict(username=None,        #pylint: disable=too-many-arguments, too-many-locals
+                    hostname=None,
                     jobid="-",
                     jobname="-",
                     rundir="-",
@@ -61,11 +114,24 @@ def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-a
                     walltime=None,
                     elapsedtime=None,
                     starttime=None,
-                    completiontime=None):
+                    completiontime=None,
+                    series_id=None,
+                    series_index=0,
+                    cluster=None,
+                    jobid_num=None,
+                    array_index=None):
     """Return a dict() with job_status fields.
 
        This is used to add records to the JobDB database through JobDB().add().
+       If series_id is None, JobDB().add() starts a new series with this job.
+       If cluster is None, JobDB().add() sets it from hostname, and if jobid_num
+       is None, JobDB().add() sets jobid_num and array_index from jobid.
+       If username or hostname are None, the current user and host are used.
     """
+    if username is None:
+        username = misc.getlogin()
+    if hostname is None:
+        hostname = misc.gethostname()
 
     creationtime = int(time.time())
     modifytime = creationtime
@@ -97,6 +163,16 @@ def job_status_dict(username=misc.getlogin(),        #pylint: disable=too-many-a
     status["completiontime"] = completiontime
     status["modifytime"] = modifytime
 
+    # series of continued jobs:
+    status["series_id"] = series_id
+    status["series_index"] = series_index
+
+    status["cluster"] = cluster
+
+    # integer, parsed from jobid:
+    status["jobid_num"] = jobid_num
+    status["array_index"] = array_index
+
     return status
 
 
@@ -135,25 +211,37 @@ def job_status_type_dict():
     status["completiontime"] = "integer"
     status["modifytime"] = "integer"
 
+    status["series_index"] = "integer"
+
+    status["jobid_num"] = "integer"
+    status["array_index"] = "integer"
+
     return status
 
 
 def sql_create_str():
-    """Returns a string for SQL CREATE TABLE"""
+    """Returns a string for SQL CREATE TABLE (excluding TEXT_KEYS)"""
     status_type = job_status_type_dict()
     s = "("    #pylint: disable=invalid-name
     for k in status_type.keys():
+        if k in TEXT_KEYS:
+            continue
         s += k + " " + status_type[k] + ", "  #pylint: disable=invalid-name
     return s[:-2] + ")"
 
 
 def sql_insert_str(job_status):
-    """ Accepts job_status dict, Returns strings and tuple used for SQL INSERT INTO."""
+    """ Accepts job_status dict, Returns strings and tuple used for SQL INSERT INTO.
+
+        TEXT_KEYS are skipped, see JobDB._add_text().
+    """
     job_status["auto"] = int(bool(job_status["auto"]))
     colstr = "("
     questionstr = "("
     val = []
     for k in job_status.keys():
+        if k in TEXT_KEYS:
+            continue
         colstr = colstr + k + ", "
         questionstr = questionstr + "?, "
         val.append(job_status[k])
@@ -161,6 +249,134 @@ def sql_insert_str(job_status):
     questionstr = questionstr[:-2] + ")"
     return colstr, questionstr, tuple(val)
 
+def _with_directive(qsubstr, directive):
+    """Return the submit script 'qsubstr' with the line 'directive' inserted
+       after its "#!" line, if any"""
+    if qsubstr.startswith("#!"):
+        first, sep, rest = qsubstr.partition("\n")
+        return first + sep + directive + rest
+    return directive + qsubstr
+
+
+def _presubmitted(jobs):
+    """Return the jobids of the continuations pre-submitted by JobDB.continue_job()
+       for the jobs in the list 'jobs' (sqlite3.Row), which would start when they end"""
+    return [job["continuation_jobid"] for job in jobs
+            if job["taskstatus"] == "Incomplete" and job["continuation_jobid"] != "-"]
+
+
+def _topological_levels(nodes, parents):
+    """Return the list 'nodes' as a list of levels: lists of nodes whose
+       parents (parents[node], a list of nodes) are all in earlier levels.
+
+       Raises JobDBError if a parent is not in 'nodes' or the nodes depend on
+       each other in a cycle.
+    """
+    children = collections.OrderedDict((node, []) for node in nodes)
+    waiting = dict()
+    for node, node_parents in parents.iteritems():
+        for parent in [node] + node_parents:
+            if parent not in children:
+                raise JobDBError("Unknown workflow job: " + str(parent))
+        for parent in node_parents:
+            children[parent].append(node)
+        waiting[node] = len(node_parents)
+
+    levels = []
+    count = 0
+    level = [node for node in children if not waiting.get(node)]
+    while level:
+        levels.append(level)
+        count += len(level)
+        following = []
+        for node in level:
+            for child in children[node]:
+                waiting[child] -= 1
+                if waiting[child] == 0:
+                    following.append(child)
+        level = following
+    if count < len(children):
+        raise JobDBError("Workflow jobs depend on each other in a cycle: "
+                         + ", ".join([str(node) for node in children if waiting.get(node)]))
+    return levels
+
+
+def _submit_rows(rows, key, substr, jobids, errors, concurrency=None):  #pylint: disable=too-many-arguments
+    """Submit the jobs 'rows' (sqlite3.Row with a 'rundir'), the script of
+       each being substr(row), from their rundir, with at most 'concurrency'
+       submissions at a time (default misc.CONCURRENCY).
+
+       Sets jobids[row[key]] to the jobid of each submitted job, and
+       errors[row[key]] to the error message of each failed submission.
+    """
+    try:
+        result = misc.fan_out(lambda r: misc_pbs.submit(substr=substr(r), cwd=r["rundir"]),
+                              rows, concurrency)
+    except misc.PBSError as e:  #pylint: disable=invalid-name
+        result = e.results
+        for r, err in zip(e.failed, e.errors):  #pylint: disable=invalid-name
+            errors[r[key]] = err.msg if isinstance(err, misc.PBSError) else str(err)
+    for r, jobid in zip(rows, result):  #pylint: disable=invalid-name
+        if jobid is not None:
+            jobids[r[key]] = jobid
+
+
+def _submitter_died(submitter):
+    """Return True if the process that claimed jobs with the token 'submitter'
+       ("hostname:pid:time") ran on this host and no longer exists"""
+    host, pid = submitter.split(":")[:2]
+    if host != misc.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except OSError as e:    #pylint: disable=invalid-name
+        return e.errno == errno.ESRCH
+    return False
+
+
+def _claim_token():
+    """Return a new token "hostname:pid:time" marking jobs claimed by this
+       process, which is in _ACTIVE_CLAIMS until the claim is released"""
+    token = misc.gethostname() + ":" + str(os.getpid()) + ":" + repr(time.time())
+    _ACTIVE_CLAIMS.add(token)
+    return token
+
+
+def _claim_abandoned(token):
+    """Return True if the jobs claimed with 'token' will not be finished by
+       the process that claimed them: it ran on this host and died, or it is
+       this process and the claim was released without finishing them (e.g.
+       the database write failed)"""
+    host, pid = token.split(":")[:2]
+    if host == misc.gethostname() and int(pid) == os.getpid():
+        return token not in _ACTIVE_CLAIMS
+    return _submitter_died(token)
+
+
+def script_hash(qsubstr):
+    """Returns the key of a submit script in the 'scripts' table (a sha1 hex digest)."""
+    if qsubstr is None:
+        return None
+    if isinstance(qsubstr, unicode):
+        qsubstr = qsubstr.encode("utf-8")
+    return hashlib.sha1(qsubstr).hexdigest()
+
+
+def compress(text):
+    """Compress a string for storage in the job_text table. None is kept as None."""
+    if text is None:
+        return None
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    return sqlite3.Binary(zlib.compress(text))
+
+
+def decompress(blob):
+    """Inverse of compress()"""
+    if blob is None:
+        return None
+    return zlib.decompress(blob).decode("utf-8")
+
 
 def sql_iter(curs, arraysize=1000):
     """ Iterate over the results of a SELECT statement """
@@ -173,14 +389,318 @@ def sql_iter(curs, arraysize=1000):
                 yield r
 
 
+def _jobid_range(min_jobid, max_jobid):
+    """Return the numeric (min, max) of a range of jobids, for 'jobid_num BETWEEN ? AND ?'"""
+    jobid_range = (misc.parse_jobid(min_jobid)[0], misc.parse_jobid(max_jobid)[0])
+    if None in jobid_range:
+        raise JobDBError("Error in pbs.JobDB. Invalid jobid range: '" + str(min_jobid)
+                         + "' to '" + str(max_jobid) + "'.")
+    return jobid_range
+
+
+def _cluster_range(cluster):
+    """Return (min, max) so that 'min <= c < max' selects clusters c starting with 'cluster'"""
+    cluster = unicode(cluster)
+    if cluster:
+        return (cluster, cluster[:-1] + unichr(ord(cluster[-1]) + 1))
+    return (u"", u"\uffff")
+
+
 def regexp(pattern, string):
-    """ Regexp to bool wrapper"""
-    return re.match(pattern, string) is not None
+    """ Regexp to bool wrapper
+
+        Compiled patterns are kept in a bounded LRU cache, because sqlite calls
+        this once per row.
+    """
+    try:
+        compiled = _REGEXP_CACHE.pop(pattern)
+    except KeyError:
+        compiled = re.compile(pattern)
+        if len(_REGEXP_CACHE) >= _REGEXP_CACHE_SIZE:
+            _REGEXP_CACHE.popitem(last=False)
+    _REGEXP_CACHE[pattern] = compiled
+    if string is None:
+        return False
+    if not isinstance(string, basestring):
+        string = str(string)
+    return compiled.match(string) is not None
+
+
+def _retry_locked(func):
+    """Decorator for JobDB methods that write to the database.
+
+       If the write fails because another process holds the database lock
+       (even after waiting 'busy_timeout'), the transaction is rolled back and
+       the method is retried up to JobDB.write_retries times, sleeping a random
+       (jittered, exponentially growing) amount of time between attempts.
+
+       Decorated methods must not have side effects outside the database.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):     #pylint: disable=missing-docstring
+        attempt = 0
+        while True:
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:   #pylint: disable=invalid-name
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                self.conn.rollback()
+                attempt += 1
+                if attempt >= self.write_retries:
+                    raise
+                time.sleep(random.uniform(0.0, min(5.0, 0.1*2**attempt)))
+    return wrapper
+
+
+def _series_drift(curs):
+    """Return (jobid, series_id, series_index) for each record whose stored
+       series_id or series_index differs from its continuation_jobid chain."""
+    curs.execute(SERIES_CTE + "SELECT jobs.jobid, chain.series_id, chain.series_index \
+                  FROM jobs JOIN chain ON jobs.jobid=chain.jobid \
+                  WHERE jobs.series_id IS NOT chain.series_id \
+                  OR jobs.series_index IS NOT chain.series_index")
+    return [tuple(r) for r in curs.fetchall()]
+
+
+def _add_column(curs, name):
+    """Add column 'name' to the jobs table, with type from job_status_type_dict(),
+       unless it already exists."""
+    curs.execute("PRAGMA table_info(jobs)")
+    if name not in [r[1] for r in curs.fetchall()]:
+        curs.execute("ALTER TABLE jobs ADD COLUMN " + name + " "
+                     + job_status_type_dict()[name])
+
+
+def _dedup_scripts(curs, schema="main"):
+    """Move submit scripts from 'schema'.job_text to the content-addressed
+       'schema'.scripts table, storing each distinct script once.
+
+       Returns the number of bytes of compressed scripts removed.
+    """
+    curs.execute("CREATE TABLE IF NOT EXISTS " + schema + ".scripts\
+                  (hash text PRIMARY KEY, qsubstr blob)")
+    curs.execute("PRAGMA " + schema + ".table_info(job_text)")
+    if "qsubstr" not in [r[1] for r in curs.fetchall()]:
+        return 0
+
+    conn = curs.connection
+    conn.commit()
+    conn.isolation_level = None
+    try:
+        curs.execute("BEGIN")
+        curs.execute("SELECT jobid, qsubstr, qstatstr FROM " + schema + ".job_text")
+        text = []
+        scripts = dict()
+        before = 0
+        for r in curs.fetchall():   #pylint: disable=invalid-name
+            key = None
+            if r[1] is not None:
+                before += len(r[1])
+                key = script_hash(decompress(r[1]))
+                scripts.setdefault(key, r[1])
+            text.append((r[0], key, r[2]))
+        after = sum([len(v) for v in scripts.values()])
+
+        curs.execute("CREATE TABLE " + schema + ".job_text_new\
+                      (jobid text PRIMARY KEY, script_hash text, qstatstr blob)")
+        curs.executemany("INSERT INTO " + schema + ".job_text_new VALUES (?, ?, ?)", text)
+        curs.executemany("INSERT OR IGNORE INTO " + schema + ".scripts VALUES (?, ?)",
+                         scripts.items())
+        curs.execute("DROP TABLE " + schema + ".job_text")
+        curs.execute("ALTER TABLE " + schema + ".job_text_new RENAME TO job_text")
+        curs.execute("CREATE INDEX IF NOT EXISTS " + schema + ".job_text_script_hash\
+                      ON job_text (script_hash)")
+        curs.execute("COMMIT")
+    except:
+        curs.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = ""
+    return before - after
+
+
+def _schema_v1(curs):
+    """Make jobid a unique key and index the columns used to select jobs.
+
+       Duplicate jobids (which select_job() already refuses) would prevent
+       creating the unique index, so only the most recently added record for
+       each duplicated jobid is kept in the jobs table. The older records are
+       moved to the 'jobs_duplicates' table, from which they can be restored
+       by hand.
+    """
+    curs.execute("SELECT jobid, COUNT(*) FROM jobs GROUP BY jobid HAVING COUNT(*) > 1")
+    duplicates = curs.fetchall()
+    if duplicates:
+        curs.execute("CREATE TABLE IF NOT EXISTS jobs_duplicates AS SELECT * FROM jobs WHERE 0")
+        curs.execute("INSERT INTO jobs_duplicates SELECT * FROM jobs\
+                      WHERE rowid NOT IN (SELECT MAX(rowid) FROM jobs GROUP BY jobid)")
+        curs.execute("DELETE FROM jobs\
+                      WHERE rowid NOT IN (SELECT MAX(rowid) FROM jobs GROUP BY jobid)")
+    for r in duplicates:    #pylint: disable=invalid-name
+        print "Moved", r[1] - 1, "duplicate record(s) for jobid:", r[0], \
+              "to the 'jobs_duplicates' table"
+
+    curs.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_jobid ON jobs (jobid)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_continuation_jobid ON jobs (continuation_jobid)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (taskstatus, jobstatus, auto)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_hostname ON jobs (hostname)")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_modifytime ON jobs (modifytime)")
+
+
+def _schema_v2(curs):
+    """Store series_id and series_index with each record, and backfill them
+       from the continuation_jobid chains."""
+    _add_column(curs, "series_id")
+    _add_column(curs, "series_index")
+    curs.executemany("UPDATE jobs SET series_id=?, series_index=? WHERE jobid=?",
+                     [(sid, index, jobid) for jobid, sid, index in _series_drift(curs)])
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_series ON jobs (series_id, series_index)")
+
+
+def _schema_v3(curs):
+    """Store the cluster name with each record, derived from hostname."""
+    _add_column(curs, "cluster")
+    curs.connection.create_function("CLUSTER_NAME", 1, misc.cluster_name)
+    curs.execute("UPDATE jobs SET cluster=CLUSTER_NAME(hostname)\
+                  WHERE cluster IS NULL AND hostname IS NOT NULL")
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_cluster ON jobs (cluster)")
+
+
+def _schema_v4(curs):
+    """Store the jobid as an integer and array index, for indexed range queries."""
+    _add_column(curs, "jobid_num")
+    _add_column(curs, "array_index")
+    curs.execute("SELECT jobid FROM jobs WHERE jobid_num IS NULL")
+    curs.executemany("UPDATE jobs SET jobid_num=?, array_index=? WHERE jobid=?",
+                     [misc.parse_jobid(r[0]) + (r[0], ) for r in curs.fetchall()])
+    curs.execute("CREATE INDEX IF NOT EXISTS jobs_jobid_num ON jobs (jobid_num, array_index)")
+
+
+def _schema_v5(curs):
+    """Request incremental vacuum, so archive() can return free pages gradually.
+
+       On an existing database this only takes effect after one full VACUUM,
+       which can take long and blocks every other process, so it is not run
+       here but by JobDB.vacuum() ('pstat --vacuum').
+    """
+    curs.execute("PRAGMA auto_vacuum")
+    if curs.fetchone()[0] != 2:
+        curs.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+
+def _schema_v6(curs):
+    """Move qsubstr and qstatstr from the jobs table to the compressed job_text table.
+
+       The jobs table is rebuilt without them in a single transaction.
+    """
+    curs.execute("CREATE TABLE IF NOT EXISTS job_text\
+                  (jobid text PRIMARY KEY, qsubstr blob, qstatstr blob)")
+    curs.execute("PRAGMA table_info(jobs)")
+    columns = [r[1] for r in curs.fetchall()]
+    if "qsubstr" not in columns:
+        return
+
+    conn = curs.connection
+    conn.commit()
+    conn.isolation_level = None
+    try:
+        curs.execute("BEGIN")
+        curs.execute("SELECT jobid, qsubstr, qstatstr FROM jobs")
+        curs.executemany("INSERT OR REPLACE INTO job_text VALUES (?, ?, ?)",
+                         [(r[0], compress(r[1]), compress(r[2])) for r in curs.fetchall()])
+
+        curs.execute("SELECT sql FROM sqlite_master WHERE type='index' AND tbl_name='jobs'\
+                      AND sql IS NOT NULL")
+        indexes = [r[0] for r in curs.fetchall()]
+        status_type = job_status_type_dict()
+        keep = [c for c in columns if c not in TEXT_KEYS]
+        curs.execute("CREATE TABLE jobs_new ("
+                     + ", ".join([c + " " + status_type[c] for c in keep]) + ")")
+        curs.execute("INSERT INTO jobs_new SELECT " + ", ".join(keep) + " FROM jobs")
+        curs.execute("DROP TABLE jobs")
+        curs.execute("ALTER TABLE jobs_new RENAME TO jobs")
+        for sql in indexes:
+            curs.execute(sql)
+        curs.execute("COMMIT")
+    except:
+        curs.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = ""
+
+    curs.execute("PRAGMA incremental_vacuum")
+    curs.fetchall()
+
+
+def _schema_v7(curs):
+    """Store each distinct submit script once, in the 'scripts' table."""
+    reclaimed = _dedup_scripts(curs)
+    if reclaimed:
+        print "Deduplicated submit scripts in the jobs database:", reclaimed, "bytes reclaimed"
+    curs.execute("PRAGMA incremental_vacuum")
+    curs.fetchall()
+
+
+def _schema_v8(curs):
+    """Add the 'pending' table of jobs waiting to be submitted by JobDB.drain().
+
+       status is 'Pending', or 'Submitting' while claimed by the drainer
+       'drainer'; message is the error of the last failed submission.
+    """
+    curs.execute("CREATE TABLE IF NOT EXISTS pending\
+                  (id integer PRIMARY KEY AUTOINCREMENT, jobname text, rundir text,\
+                   auto integer, nodes integer, procs integer, walltime integer,\
+                   script_hash text, creationtime integer, status text, drainer text,\
+                   message text)")
+
+
+def _schema_v9(curs):
+    """Add the 'workflow_nodes' and 'workflow_edges' tables of the workflows
+       submitted by JobDB.submit_workflow().
+
+       A node is a job of the workflow; status is 'Pending', 'Submitting' while
+       claimed by the process 'submitter', or 'Submitted' once jobid is set;
+       message is the error of the last failed submission. An edge (parent,
+       child) makes the child's job wait for the parent's.
+    """
+    curs.execute("CREATE TABLE IF NOT EXISTS workflow_nodes\
+                  (workflow text, node text, jobname text, rundir text, auto integer,\
+                   nodes integer, procs integer, walltime integer, script_hash text,\
+                   status text, submitter text, jobid text, message text,\
+                   PRIMARY KEY (workflow, node))")
+    curs.execute("CREATE TABLE IF NOT EXISTS workflow_edges\
+                  (workflow text, parent text, child text, PRIMARY KEY (workflow, child, parent))")
+
+
+def _schema_v10(curs):
+    """Add the 'tasks' table of the commands run by bundled workers (see
+       pbs.bundle).
+
+       bundle is the id of the first task of the bundle, and jobid the job
+       that last ran the task. status is 'Queued', 'Running', 'Complete' or
+       'Error' (exit_status not 0). walltime is the expected run time.
+    """
+    curs.execute("CREATE TABLE IF NOT EXISTS tasks\
+                  (id integer PRIMARY KEY AUTOINCREMENT, bundle integer, jobid text,\
+                   command text, rundir text, procs integer, walltime integer, status text,\
+                   exit_status integer, starttime integer, completiontime integer)")
+    curs.execute("CREATE INDEX IF NOT EXISTS tasks_bundle ON tasks (bundle, status)")
+    curs.execute("CREATE INDEX IF NOT EXISTS tasks_jobid ON tasks (jobid)")
+
+
+# SCHEMA_MIGRATIONS[i] upgrades a jobs database from schema version i to i+1.
+# The version is stored in the database file with 'PRAGMA user_version'.
+# Migrations must be safe to re-run on a database where they were partially applied.
+SCHEMA_MIGRATIONS = [_schema_v1, _schema_v2, _schema_v3, _schema_v4, _schema_v5,
+                     _schema_v6, _schema_v7, _schema_v8, _schema_v9, _schema_v10]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
 
 class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-public-methods
     """A PBS Job Database object"""
 
-    def __init__(self, dbpath=None, configpath=None):
+    def __init__(self, dbpath=None, configpath=None, wal=None, busy_timeout=None,    #pylint: disable=too-many-arguments
+                 include_archive=False):
         """Construct a PBS Job Database object.
 
            Usually this is called without arguments (pbs.JobDB()) to open or create a
@@ -202,39 +722,69 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
            Else:
              configpath: path to a pbs config file.
 
+           wal, busy_timeout: concurrency options, see connect().
+
+           include_archive: If True, the select_* and print_all() methods also
+             find records moved to the archive database by archive(). The
+             archive database is "jobs_archive.db" next to the jobs database.
 
         """
 
         self.conn = None
         self.curs = None
 
+        # number of attempts made by methods that write to the database
+        self.write_retries = 10
+
         self.username = misc.getlogin()
-        self.hostname = socket.gethostname()
-        self.connect(dbpath, configpath)
+        self.hostname = misc.gethostname()
+        self.connect(dbpath, configpath, wal=wal, busy_timeout=busy_timeout)
+
+        # tables or views read by the select_* methods
+        self.table = "jobs"
+        self.text_table = "job_text"
+        self.scripts_table = "scripts"
+        self.archive_attached = False
+        if include_archive:
+            self.attach_archive()
+            self.table = "all_jobs"
+            self.text_table = "all_job_text"
+            self.scripts_table = "all_scripts"
 
         global misc_pbs
 
-        if self.config["software"] == "torque":
-            # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-            misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
-        elif self.config["software"] == "slurm":
-            # import misc_slurm as misc
-            # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-            misc_pbs = __import__("pbs.misc_slurm", globals(), locals(), [], -1).misc_slurm
-        else:
-            # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-            misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
+        misc.CONCURRENCY = self.config.get("concurrency", misc.CONCURRENCY)
+        misc.COMMAND_TIMEOUT = self.config.get("command_timeout", misc.COMMAND_TIMEOUT)
+
+        misc_pbs = misc.get_backend(self.config["software"])   #pylint: disable=redefined-outer-name
+        if hasattr(misc_pbs, "configure"):
+            misc_pbs.configure(self.config)
+
+        # dependency kind with which continue_job() pre-submits the next job of
+        # running auto jobs, or None. Always "afterany": an auto job that is
+        # continued usually ends at its walltime, with a non-zero exit status,
+        # which would leave an "afterok" continuation waiting forever.
+        self.presubmit = None
+        if self.config.get("presubmit") and hasattr(misc_pbs, "dependency_directive"):
+            self.presubmit = "afterany"
 
         # list of dict() from misc.job_status for jobs not tracked in database:
         # refreshed upon update()
         self.untracked = []
 
 
-    def connect(self, dbpath=None, configpath=None):    #pylint: disable=too-many-branches, too-many-statements
+    def connect(self, dbpath=None, configpath=None, wal=None, busy_timeout=None):    #pylint: disable=too-many-branches, too-many-statements, too-many-arguments
         """Open a connection to the jobs database.
 
            dbpath: path to a JobDB database file.
            configpath: path to a pbs config file.
+           wal: If True, use write-ahead-log journaling so that readers and a
+            writer do not block each other. This is ignored if the filesystem
+            does not support it. If not given, use "wal" from the config file
+            (default False, because WAL is unsafe on network filesystems).
+           busy_timeout: Seconds to wait for another process to release the
+            database lock before raising an error. If not given, use
+            "busy_timeout" from the config file (default 30.0).
 
            If dbpath is not given:
            If PBS_JOB_DB environment variable exists, set dbpath to "$PBS_JOB_DB/jobs.db" file.
@@ -298,21 +848,80 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         else:
             with open(configpath) as my_json:
                 self.config = json.load(my_json)
+            if "version" not in self.config:
+                self.config["version"] = misc.getversion(self.config["software"])
+                with open(configpath, "w") as my_json:
+                    json.dump(self.config, my_json, indent=0)
+
+        # the scheduler version is only queried when config.json is written
+        misc.VERSION[self.config["software"]] = self.config["version"]
+
+        self.dbpath = dbpath
+
+        # scheduler status snapshot shared with other processes on this cluster,
+        # see update(). $HOME may be shared by several clusters, so each has
+        # its own file.
+        cache_name = re.sub(r"[^A-Za-z0-9_.-]", "_", misc.cluster_name(self.hostname))
+        self.status_cache = StatusCache(os.path.join(os.path.dirname(dbpath),
+                                                     "status_cache_" + cache_name + ".json"),
+                                        ttl=self.config.get("status_ttl", 15.0),
+                                        stale=self.config.get("status_stale", 120.0))
+
+        if wal is None:
+            wal = self.config.get("wal", False)
+        if busy_timeout is None:
+            busy_timeout = self.config.get("busy_timeout", 30.0)
 
         if not os.path.isfile(dbpath):
             print "Creating Database:", dbpath
-            self.conn = sqlite3.connect(dbpath)
+            self.conn = sqlite3.connect(dbpath, timeout=busy_timeout)
             self.conn.row_factory = sqlite3.Row
             self.conn.create_function("REGEXP", 2, regexp)
+            self.conn.create_function("DECOMPRESS", 1, decompress)
             self.curs = self.conn.cursor()
+            # takes effect at once, before the first table is created
+            self.curs.execute("PRAGMA auto_vacuum = INCREMENTAL")
             self.curs.execute("CREATE TABLE jobs " + sql_create_str())
             self.conn.commit()
         else:
-            self.conn = sqlite3.connect(dbpath)
+            self.conn = sqlite3.connect(dbpath, timeout=busy_timeout)
             self.conn.row_factory = sqlite3.Row
             self.conn.create_function("REGEXP", 2, regexp)
+            self.conn.create_function("DECOMPRESS", 1, decompress)
             self.curs = self.conn.cursor()
 
+        # the journal mode is stored in the database file; if WAL is not
+        # supported sqlite keeps the current mode
+        if wal:
+            self.curs.execute("PRAGMA journal_mode=WAL")
+        else:
+            self.curs.execute("PRAGMA journal_mode")
+        self.journal_mode = self.curs.fetchone()[0].lower()
+
+        self.migrate()
+
+
+    def migrate(self):
+        """Upgrade the jobs database schema to SCHEMA_VERSION.
+
+           Called by connect(). The current schema version is read from
+           'PRAGMA user_version' and each missing step in SCHEMA_MIGRATIONS is
+           applied and recorded in turn, so upgrades are incremental.
+
+           Raises JobDBError if the database was written by a newer version of pbs.
+        """
+        self.curs.execute("PRAGMA user_version")
+        version = self.curs.fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise JobDBError("Error in pbs.JobDB.migrate(). Database schema version "
+                             + str(version) + " is newer than the supported version "
+                             + str(SCHEMA_VERSION) + ".")
+
+        for v in range(version, SCHEMA_VERSION):    #pylint: disable=invalid-name
+            SCHEMA_MIGRATIONS[v](self.curs)
+            self.curs.execute("PRAGMA user_version = {0}".format(v + 1))
+            self.conn.commit()
+
 
     def close(self):
         """Close the connection to the jobs database."""
@@ -320,6 +929,129 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         self.conn.close()
 
 
+    def attach_archive(self):
+        """Attach the archive database (created if necessary) as 'archive'.
+
+           The archive jobs table is given any columns the jobs table has gained
+           since it was created, and the temporary view 'all_jobs' combines both.
+        """
+        if self.archive_attached:
+            return
+        root, ext = os.path.splitext(self.dbpath)
+        self.conn.commit()
+        self.curs.execute("ATTACH DATABASE ? AS archive", (root + "_archive" + ext, ))
+        self.curs.execute("CREATE TABLE IF NOT EXISTS archive.jobs " + sql_create_str())
+
+        self.curs.execute("PRAGMA main.table_info(jobs)")
+        columns = [r[1] for r in self.curs.fetchall()]
+        self.curs.execute("PRAGMA archive.table_info(jobs)")
+        archive_columns = [r[1] for r in self.curs.fetchall()]
+        for name in columns:
+            if name not in archive_columns:
+                self.curs.execute("ALTER TABLE archive.jobs ADD COLUMN " + name + " "
+                                  + job_status_type_dict()[name])
+
+        self.curs.execute("CREATE UNIQUE INDEX IF NOT EXISTS archive.jobs_jobid ON jobs (jobid)")
+        self.curs.execute("CREATE INDEX IF NOT EXISTS archive.jobs_series\
+                           ON jobs (series_id, series_index)")
+        self.curs.execute("CREATE INDEX IF NOT EXISTS archive.jobs_jobid_num\
+                           ON jobs (jobid_num, array_index)")
+        self.curs.execute("CREATE INDEX IF NOT EXISTS archive.jobs_modifytime ON jobs (modifytime)")
+        self.curs.execute("CREATE TABLE IF NOT EXISTS archive.job_text\
+                           (jobid text PRIMARY KEY, script_hash text, qstatstr blob)")
+        reclaimed = _dedup_scripts(self.curs, "archive")
+        if reclaimed:
+            print "Deduplicated submit scripts in the archive database:", reclaimed, \
+                  "bytes reclaimed"
+        self.curs.execute("CREATE INDEX IF NOT EXISTS archive.job_text_script_hash\
+                           ON job_text (script_hash)")
+
+        colstr = ", ".join(columns)
+        self.curs.execute("CREATE TEMP VIEW IF NOT EXISTS all_jobs AS SELECT " + colstr
+                          + " FROM main.jobs UNION ALL SELECT " + colstr + " FROM archive.jobs")
+        self.curs.execute("CREATE TEMP VIEW IF NOT EXISTS all_job_text AS SELECT * FROM\
+                           main.job_text UNION ALL SELECT * FROM archive.job_text")
+        self.curs.execute("CREATE TEMP VIEW IF NOT EXISTS all_scripts AS SELECT * FROM\
+                           main.scripts UNION ALL SELECT * FROM archive.scripts")
+        self.conn.commit()
+        self.archive_attached = True
+
+
+    def vacuum(self):
+        """Rebuild the jobs database file with a full VACUUM, returning all free
+           pages to the filesystem and enabling the incremental vacuum used by
+           archive() on databases created before it was supported.
+
+           This rewrites the whole file and blocks every other process using
+           the database while it runs.
+
+           Returns (size before, size after) of the database file, in bytes.
+        """
+        before = os.path.getsize(self.dbpath)
+        self.conn.commit()
+        self.curs.execute("PRAGMA main.auto_vacuum = INCREMENTAL")
+        self.curs.execute("VACUUM")
+        return (before, os.path.getsize(self.dbpath))
+
+
+    def archive(self, older_than="0", vacuum_pages=1000):
+        """Move finished series of jobs to the archive database.
+
+           A series is finished if every job in it has taskstatus 'Complete',
+           'Aborted' or 'Continued'. Series are moved wholesale, and only if
+           none of their jobs were modified within 'older_than'.
+
+           Args:
+             older_than: "[[[DD:]HH:]MM:]SS" string
+             vacuum_pages: Maximum number of free pages returned to the
+               filesystem by an incremental vacuum afterwards. Databases
+               created before incremental vacuum was supported need one
+               vacuum() first.
+
+           Returns:
+             the number of records archived
+        """
+        self.attach_archive()
+        count = self._archive_series(int(time.time() - misc.seconds(older_than)))
+        self.curs.execute("PRAGMA main.incremental_vacuum({0})".format(int(vacuum_pages)))
+        self.curs.fetchall()
+        return count
+
+
+    @_retry_locked
+    def _archive_series(self, maxtime):
+        """Move finished series last modified before 'maxtime' to the archive, in
+           one transaction. Returns the number of records moved."""
+        self.curs.execute("CREATE TEMP TABLE IF NOT EXISTS archive_series (series_id text)")
+        self.curs.execute("DELETE FROM archive_series")
+        self.curs.execute("INSERT INTO archive_series SELECT series_id FROM main.jobs\
+                           GROUP BY series_id HAVING MAX(modifytime) < ? AND\
+                           SUM(taskstatus NOT IN ('Complete', 'Aborted', 'Continued')) = 0",
+                          (maxtime, ))
+
+        self.curs.execute("PRAGMA main.table_info(jobs)")
+        colstr = ", ".join([r[1] for r in self.curs.fetchall()])
+        self.curs.execute("INSERT INTO archive.jobs (" + colstr + ") SELECT " + colstr
+                          + " FROM main.jobs WHERE series_id IN (SELECT series_id FROM\
+                          archive_series)")
+        self.curs.execute("INSERT OR REPLACE INTO archive.job_text SELECT * FROM main.job_text\
+                           WHERE jobid IN (SELECT jobid FROM main.jobs WHERE series_id IN\
+                           (SELECT series_id FROM archive_series))")
+        self.curs.execute("INSERT OR IGNORE INTO archive.scripts SELECT * FROM main.scripts\
+                           WHERE hash IN (SELECT script_hash FROM main.job_text WHERE jobid IN\
+                           (SELECT jobid FROM main.jobs WHERE series_id IN\
+                           (SELECT series_id FROM archive_series)))")
+        self.curs.execute("DELETE FROM main.job_text WHERE jobid IN (SELECT jobid FROM main.jobs\
+                           WHERE series_id IN (SELECT series_id FROM archive_series))")
+        self.curs.execute("DELETE FROM main.jobs WHERE series_id IN\
+                           (SELECT series_id FROM archive_series)")
+        count = self.curs.rowcount
+        self._prune_scripts()
+        self.conn.commit()
+        return count
+
+
+    @_retry_locked
     def add(self, job_status):
         """Add a record to the jobs database.
 
@@ -327,17 +1059,610 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
            'job_status' using pbs.jobdb.job_status_dict().
 
         """
+        self._insert(job_status)
+        self.conn.commit()
+
+
+    @_retry_locked
+    def add_many(self, job_status):
+        """Add several records to the jobs database, in one transaction, with one
+           executemany() per table.
+
+           Accepts 'job_status', a list of dictionaries as for add().
+        """
+        self._insert_many(job_status)
+        self.conn.commit()
+
+
+    def _insert_many(self, job_status):
+        """Insert the records in the list 'job_status' (see add_many()). Does not commit."""
+        rows = collections.OrderedDict()
+        scripts = collections.OrderedDict()
+        text = []
+        for status in job_status:
+            self._set_keys(status)
+            (colstr, questionstr, valtuple) = sql_insert_str(status)
+            rows.setdefault((colstr, questionstr), []).append(valtuple)
+            key = script_hash(status["qsubstr"])
+            if key is not None and key not in scripts:
+                scripts[key] = status["qsubstr"]
+            text.append((status["jobid"], key, compress(status["qstatstr"])))
+
+        for (colstr, questionstr), values in rows.iteritems():
+            self.curs.executemany("INSERT INTO jobs {0} VALUES {1}".format(colstr, questionstr),
+                                  values)
+        self.curs.executemany("INSERT OR IGNORE INTO scripts VALUES (?, ?)",
+                              [(key, compress(qsubstr)) for key, qsubstr in scripts.iteritems()])
+        self.curs.executemany("INSERT OR REPLACE INTO job_text VALUES (?, ?, ?)", text)
+
+
+    def _set_keys(self, job_status):     #pylint: disable=no-self-use
+        """Set the series_id, cluster, jobid_num and array_index of 'job_status'
+           if they are None"""
+        if job_status.get("series_id") is None:
+            job_status["series_id"] = job_status["jobid"]
+        if job_status.get("cluster") is None:
+            job_status["cluster"] = misc.cluster_name(job_status["hostname"])
+        if job_status.get("jobid_num") is None:
+            (job_status["jobid_num"], job_status["array_index"]) = \
+                misc.parse_jobid(job_status["jobid"])
+
+
+    def _insert(self, job_status):
+        """Insert the record 'job_status' (see add()). Does not commit."""
+        self._set_keys(job_status)
         (colstr, questionstr, valtuple) = sql_insert_str(job_status)
         insertstr = "INSERT INTO jobs {0} VALUES {1}".format(colstr, questionstr)
         self.curs.execute(insertstr, valtuple)
+        self._add_text(job_status)
+
+
+    def _add_text(self, job_status):
+        """Insert the job_text record for 'job_status', storing its submit script
+           only if an identical script is not already in the 'scripts' table.
+           Does not commit.
+        """
+        key = script_hash(job_status["qsubstr"])
+        if key is not None:
+            self.curs.execute("SELECT 1 FROM scripts WHERE hash=?", (key, ))
+            if self.curs.fetchone() is None:
+                self.curs.execute("INSERT INTO scripts VALUES (?, ?)",
+                                  (key, compress(job_status["qsubstr"])))
+        self.curs.execute("INSERT OR REPLACE INTO job_text VALUES (?, ?, ?)",
+                          (job_status["jobid"], key, compress(job_status["qstatstr"])))
+
+
+    def _prune_scripts(self):
+        """Delete submit scripts no longer referenced by any job, pending job or
+           workflow job. Does not commit."""
+        self.curs.execute("DELETE FROM main.scripts WHERE hash NOT IN\
+                           (SELECT script_hash FROM main.job_text WHERE script_hash IS NOT NULL)\
+                           AND hash NOT IN (SELECT script_hash FROM main.pending)\
+                           AND hash NOT IN (SELECT script_hash FROM main.workflow_nodes)")
+
+
+    @_retry_locked
+    def enqueue(self, job_status):
+        """Add jobs to the 'pending' table, to be submitted later by drain().
+
+           Accepts 'job_status', a list of dictionaries as for add(). Only
+           jobname, rundir, auto, nodes, procs, walltime and qsubstr are used.
+
+           Returns the list of pending ids.
+        """
+        now = int(time.time())
+        stored = set()
+        ids = []
+        for status in job_status:
+            key = script_hash(status["qsubstr"])
+            if key not in stored:
+                self.curs.execute("INSERT OR IGNORE INTO scripts VALUES (?, ?)",
+                                  (key, compress(status["qsubstr"])))
+                stored.add(key)
+            self.curs.execute("INSERT INTO pending (jobname, rundir, auto, nodes, procs,\
+                               walltime, script_hash, creationtime, status)\
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'Pending')",
+                              (status["jobname"], status["rundir"], int(bool(status["auto"])),
+                               status["nodes"], status["procs"], status["walltime"], key, now))
+            ids.append(self.curs.lastrowid)
+        self.conn.commit()
+        return ids
+
+
+    def select_pending(self, text=False):
+        """Return the list of sqlite3.Row of the 'pending' table, oldest first.
+           If 'text', also include the submit script as 'qsubstr'."""
+        if text:
+            self.curs.execute("SELECT pending.*, DECOMPRESS(scripts.qsubstr) AS qsubstr\
+                               FROM pending LEFT JOIN scripts ON pending.script_hash=scripts.hash\
+                               ORDER BY id")
+        else:
+            self.curs.execute("SELECT * FROM pending ORDER BY id")
+        return self.curs.fetchall()
+
+
+    def drain(self, limit=None):
+        """Submit pending jobs, oldest first, while the current user has fewer
+           than 'limit' unfinished jobs in the scheduler (default: the
+           "max_queued" config.json value; if not set, submit all pending jobs).
+
+           Jobs are submitted from their rundir, with at most misc.CONCURRENCY
+           submissions at a time, and moved to the jobs table as they would be
+           by Job.submit(). Jobs whose submission failed stay pending, with the
+           error in 'message', and are tried again by the next drain(). Jobs
+           left 'Submitting' by a drain() of this host that died or failed are
+           first looked up by jobname in the scheduler, and made pending again
+           if they are not found.
+
+           Returns the list of jobids submitted.
+        """
+        if limit is None:
+            limit = self.config.get("max_queued")
+        self._recover_pending()
+        self.curs.execute("SELECT count(*) FROM pending WHERE status='Pending'")
+        count = self.curs.fetchone()[0]
+        if count == 0:
+            return []
+        if limit is not None:
+            # counted directly, so that jobs submitted since the last snapshot are included
+            active = [s for s in misc_pbs.job_status().values() if s["jobstatus"] != "C"]
+            count = min(count, int(limit) - len(active))
+            if count <= 0:
+                return []
+
+        drainer = _claim_token()
+        try:
+            claimed = self._claim_pending(count, drainer)
+            jobids = dict()
+            errors = dict()
+            try:
+                _submit_rows(claimed, "id", lambda r: r["qsubstr"], jobids, errors)
+            finally:
+                self._finish_pending(claimed, jobids, errors)
+        finally:
+            _ACTIVE_CLAIMS.discard(drainer)
+        return [jobids[r["id"]] for r in claimed if r["id"] in jobids]
+
+
+    @_retry_locked
+    def _claim_pending(self, count, drainer):
+        """Mark the 'count' oldest pending jobs as being submitted by this process,
+           with the token 'drainer' (see _claim_token()), and return them as
+           sqlite3.Row including their 'qsubstr'. Two drain() can not claim the
+           same job."""
+        self.curs.execute("UPDATE pending SET status='Submitting', drainer=? WHERE id IN\
+                           (SELECT id FROM pending WHERE status='Pending' ORDER BY id LIMIT ?)",
+                          (drainer, count))
+        self.conn.commit()
+        self.curs.execute("SELECT pending.*, DECOMPRESS(scripts.qsubstr) AS qsubstr\
+                           FROM pending LEFT JOIN scripts ON pending.script_hash=scripts.hash\
+                           WHERE drainer=? ORDER BY id", (drainer, ))
+        return self.curs.fetchall()
+
+
+    @_retry_locked
+    def _finish_pending(self, claimed, jobids, errors):
+        """Move the claimed pending jobs that were submitted (pending id: jobid in
+           'jobids') to the jobs table, and return the others to 'Pending' (with
+           the message in 'errors', if any), in one transaction."""
+        status = [job_status_dict(jobid=jobids[r["id"]], jobname=r["jobname"], rundir=r["rundir"],
+                                  jobstatus="?", auto=r["auto"], qsubstr=r["qsubstr"],
+                                  nodes=r["nodes"], procs=r["procs"], walltime=r["walltime"])
+                  for r in claimed if r["id"] in jobids]
+        self._insert_many(status)
+        self.curs.executemany("DELETE FROM pending WHERE id=?",
+                              [(r["id"], ) for r in claimed if r["id"] in jobids])
+        self.curs.executemany("UPDATE pending SET status='Pending', drainer=NULL, message=?\
+                               WHERE id=?",
+                              [(errors.get(r["id"]), r["id"]) for r in claimed
+                               if r["id"] not in jobids])
+        self.conn.commit()
+
+
+    def _recover_pending(self):
+        """Finish the submission of the pending jobs left 'Submitting' by a
+           drain() that will not finish it (see _claim_abandoned()): a job is
+           moved to the jobs table if exactly one job with its jobname, not in
+           the jobs table, is found in the scheduler, and is 'Pending' again
+           if none is."""
+        self.curs.execute("SELECT pending.*, DECOMPRESS(scripts.qsubstr) AS qsubstr\
+                           FROM pending LEFT JOIN scripts ON pending.script_hash=scripts.hash\
+                           WHERE status='Submitting' ORDER BY id")
+        stale = [r for r in self.curs.fetchall() if _claim_abandoned(r["drainer"])]
+        if not stale:
+            return
+        jobids, ambiguous = self._adopt_by_jobname(
+            stale, "id", lambda r: "Pending job " + str(r["id"]) + " (" + r["jobname"] + ")")
+        self._finish_pending([r for r in stale if r["id"] not in ambiguous], jobids, dict())
+
+
+    @_retry_locked
+    def cancel_pending(self, ids):
+        """Remove the jobs with pending ids in the list 'ids' from the 'pending'
+           table. Jobs being submitted by drain() are not removed.
+
+           Returns the number of jobs removed.
+        """
+        self.curs.executemany("DELETE FROM pending WHERE id=? AND status='Pending'",
+                              [(i, ) for i in ids])
+        count = self.curs.rowcount
+        self._prune_scripts()
+        self.conn.commit()
+        return count
+
+
+    @_retry_locked
+    def add_workflow(self, name, job_status, edges):
+        """Add the jobs and dependencies of workflow 'name' to the
+           'workflow_nodes' and 'workflow_edges' tables, to be submitted by
+           submit_workflow().
+
+           Accepts 'job_status', a list of dictionaries as for enqueue(), each
+           with an additional "node" key naming the job in the workflow, and
+           'edges', a list of (parent node, child node): the child job waits
+           for the parent job.
+
+           Nodes and edges already in the workflow are kept unchanged, so that
+           adding the same workflow again and submitting it resumes it.
+
+           Raises JobDBError if an edge refers to an unknown node or the edges
+           form a cycle.
+        """
+        stored = set()
+        for status in job_status:
+            key = script_hash(status["qsubstr"])
+            if key not in stored:
+                self.curs.execute("INSERT OR IGNORE INTO scripts VALUES (?, ?)",
+                                  (key, compress(status["qsubstr"])))
+                stored.add(key)
+        self.curs.executemany("INSERT OR IGNORE INTO workflow_nodes (workflow, node, jobname,\
+                               rundir, auto, nodes, procs, walltime, script_hash, status)\
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'Pending')",
+                              [(name, status["node"], status["jobname"], status["rundir"],
+                                int(bool(status["auto"])), status["nodes"], status["procs"],
+                                status["walltime"], script_hash(status["qsubstr"]))
+                               for status in job_status])
+        self.curs.executemany("INSERT OR IGNORE INTO workflow_edges VALUES (?, ?, ?)",
+                              [(name, parent, child) for parent, child in edges])
+        nodes, parents = self._workflow(name)
+        try:
+            _topological_levels(nodes.keys(), parents)
+        except JobDBError:
+            self.conn.rollback()
+            raise
+        self.conn.commit()
+
+
+    def _workflow(self, name):
+        """Return (nodes, parents) of workflow 'name': an OrderedDict {node:
+           dict of 'status', 'jobid' and the 'jobstatus' and 'taskstatus' of its
+           job (None if not in the jobs table)}, in the order added, and a dict
+           {node: list of the nodes it depends on}."""
+        self.curs.execute("SELECT workflow_nodes.node, workflow_nodes.status,\
+                           workflow_nodes.jobid, " + self.table + ".jobstatus, "
+                          + self.table + ".taskstatus\
+                           FROM workflow_nodes LEFT JOIN " + self.table + "\
+                           ON " + self.table + ".jobid=workflow_nodes.jobid\
+                           WHERE workflow=? ORDER BY workflow_nodes.rowid", (name, ))
+        nodes = collections.OrderedDict((r["node"], dict(r)) for r in self.curs.fetchall())
+        self.curs.execute("SELECT parent, child FROM workflow_edges WHERE workflow=?", (name, ))
+        parents = dict((node, []) for node in nodes)
+        for r in self.curs.fetchall():  #pylint: disable=invalid-name
+            parents.setdefault(r["child"], []).append(r["parent"])
+        return nodes, parents
+
+
+    def submit_workflow(self, name, kind="afterok", concurrency=None):
+        """Submit the jobs of workflow 'name' that are not yet submitted, in
+           topological order: each job is submitted once the jobs it depends on
+           have jobids, with a scheduler dependency ('kind': "afterok" or
+           "afterany", see misc_pbs.dependency_directive()) on those not yet
+           complete. Jobs that do not depend on each other are submitted at
+           the same time, at most 'concurrency' at once (default: the
+           "concurrency" config.json value), from their rundir, and added to
+           the jobs table as they would be by Job.submit().
+
+           Jobs are marked 'Submitting' before and 'Submitted' after they are
+           submitted, so calling submit_workflow() again, for example after a
+           crash, does not submit them twice. Jobs left 'Submitting' by a
+           process of this host that died, or by a submit_workflow() of this
+           process that failed, are looked up by jobname in the scheduler, and
+           submitted again if they are not found.
+
+           With "afterok", a job whose parent job has ended (or is no longer
+           in the jobs table) without taskstatus 'Complete' is not submitted:
+           it stays 'Pending' with the reason in 'message', and is submitted by
+           a later call once the parent is marked 'Complete'.
+
+           Returns a dict {node: jobid} of the submitted jobs of the workflow.
+
+           Raises PBSError if any submission failed, or any job was not
+           submitted because of a parent that did not complete, after
+           submitting the jobs that do not depend on those. Its 'failed'
+           attribute is the list of failed nodes, which stay 'Pending' with the
+           error in 'message', and its 'results' attribute the dict of
+           submitted jobs.
+        """
+        self._recover_workflow(name)
+        nodes, parents = self._workflow(name)
+        errors = dict()
+        for level in _topological_levels(nodes.keys(), parents):
+            ready = [node for node in level if nodes[node]["status"] == "Pending"
+                     and not [p for p in parents[node] if nodes[p]["status"] != "Submitted"]]
+            if not ready:
+                continue
+            submitter = _claim_token()
+            try:
+                claimed = self._claim_workflow(name, ready, submitter)
+
+                # jobs that ended, or are no longer in the jobs table, may be
+                # unknown to the scheduler: with "afterok", they must be 'Complete'
+                for r in claimed:   #pylint: disable=invalid-name
+                    ended = [p for p in parents[r["node"]] if nodes[p]["jobstatus"] in ("C", None)
+                             and nodes[p]["taskstatus"] != "Complete"]
+                    if ended and kind == "afterok":
+                        errors[r["node"]] = "Not submitted: " + ", ".join(
+                            ["parent " + str(p) + " (job " + str(nodes[p]["jobid"])
+                             + ") ended with taskstatus " + str(nodes[p]["taskstatus"])
+                             for p in ended])
+                depend = dict((r["node"], [nodes[p]["jobid"] for p in parents[r["node"]]
+                                           if nodes[p]["jobstatus"] not in ("C", None)])
+                              for r in claimed)
+
+                def _substr(r):     #pylint: disable=invalid-name
+                    """Submit script of workflow job 'r', with its dependencies"""
+                    if not depend[r["node"]]:
+                        return r["qsubstr"]
+                    return _with_directive(r["qsubstr"],
+                                           misc_pbs.dependency_directive(depend[r["node"]], kind))
+
+                jobids = dict()
+                try:
+                    _submit_rows([r for r in claimed if r["node"] not in errors], "node",
+                                 _substr, jobids, errors, concurrency)
+                finally:
+                    self._finish_workflow(claimed, jobids, errors)
+            finally:
+                _ACTIVE_CLAIMS.discard(submitter)
+            for node, jobid in jobids.iteritems():
+                nodes[node].update(status="Submitted", jobid=jobid, jobstatus="?")
+
+        if errors:
+            failed = [node for node in nodes if node in errors]
+            err = misc.PBSError(", ".join([str(node) for node in failed]),
+                                "\n".join([str(node) + ": " + errors[node] for node in failed]))
+            err.failed = failed
+            err.results = dict((node, r["jobid"]) for node, r in nodes.iteritems()
+                               if r["status"] == "Submitted")
+            raise err
+        return dict((node, r["jobid"]) for node, r in nodes.iteritems()
+                    if r["status"] == "Submitted")
+
+
+    @_retry_locked
+    def _claim_workflow(self, name, ready, submitter):
+        """Mark the 'Pending' jobs of workflow 'name' with nodes in the list
+           'ready' as being submitted by this process, with the token
+           'submitter' (see _claim_token()), and return them as sqlite3.Row
+           including their 'qsubstr'. Two processes can not claim the same job."""
+        self.curs.executemany("UPDATE workflow_nodes SET status='Submitting', submitter=?\
+                               WHERE workflow=? AND node=? AND status='Pending'",
+                              [(submitter, name, node) for node in ready])
+        self.conn.commit()
+        self.curs.execute("SELECT workflow_nodes.*, DECOMPRESS(scripts.qsubstr) AS qsubstr\
+                           FROM workflow_nodes LEFT JOIN scripts\
+                           ON workflow_nodes.script_hash=scripts.hash\
+                           WHERE workflow=? AND status='Submitting' AND submitter=?\
+                           ORDER BY workflow_nodes.rowid", (name, submitter))
+        return self.curs.fetchall()
+
+
+    @_retry_locked
+    def _finish_workflow(self, claimed, jobids, errors):
+        """Add the claimed workflow jobs that were submitted (node: jobid in
+           'jobids') to the jobs table and mark them 'Submitted', and return the
+           others to 'Pending' (with the message in 'errors', if any), in one
+           transaction. The jobs table records their script without the
+           dependency."""
+        status = [job_status_dict(jobid=jobids[r["node"]], jobname=r["jobname"],
+                                  rundir=r["rundir"], jobstatus="?", auto=r["auto"],
+                                  qsubstr=r["qsubstr"], nodes=r["nodes"], procs=r["procs"],
+                                  walltime=r["walltime"])
+                  for r in claimed if r["node"] in jobids]
+        self._insert_many(status)
+        self.curs.executemany("UPDATE workflow_nodes SET status='Submitted', jobid=?, message=NULL\
+                               WHERE workflow=? AND node=?",
+                              [(jobids[r["node"]], r["workflow"], r["node"]) for r in claimed
+                               if r["node"] in jobids])
+        self.curs.executemany("UPDATE workflow_nodes SET status='Pending', submitter=NULL,\
+                               message=? WHERE workflow=? AND node=?",
+                              [(errors.get(r["node"]), r["workflow"], r["node"]) for r in claimed
+                               if r["node"] not in jobids])
+        self.conn.commit()
+
+
+    def _recover_workflow(self, name):
+        """Finish the submission of the jobs of workflow 'name' left 'Submitting'
+           by a submit_workflow() that will not finish it (see
+           _claim_abandoned()): a job is 'Submitted' if exactly one job with its
+           jobname, not in the jobs table, is found in the scheduler, and
+           'Pending' again if none is."""
+        self.curs.execute("SELECT workflow_nodes.*, DECOMPRESS(scripts.qsubstr) AS qsubstr\
+                           FROM workflow_nodes LEFT JOIN scripts\
+                           ON workflow_nodes.script_hash=scripts.hash\
+                           WHERE workflow=? AND status='Submitting'", (name, ))
+        stale = [r for r in self.curs.fetchall() if _claim_abandoned(r["submitter"])]
+        if not stale:
+            return
+        jobids, ambiguous = self._adopt_by_jobname(
+            stale, "node", lambda r: "Workflow " + name + " job " + str(r["node"]))
+        self._finish_workflow([r for r in stale if r["node"] not in ambiguous], jobids, dict())
+
+
+    def _adopt_by_jobname(self, stale, key, describe):
+        """Look up the jobs 'stale' (sqlite3.Row with a 'jobname'), whose
+           submission may or may not have happened, by jobname in the scheduler.
+
+           Returns (jobids, ambiguous): a dict {row[key]: jobid} of the jobs for
+           which exactly one job with their jobname, not in the jobs table, was
+           found, and the set of row[key] for which several were found. Those
+           are reported as describe(row) and should not be submitted again.
+        """
+        # queried directly, so that jobs submitted since the last snapshot are included
+        found = dict()
+        for jobid, status in misc_pbs.job_status().iteritems():
+            found.setdefault(status["jobname"], []).append(jobid)
+        jobids = dict()
+        ambiguous = set()
+        for r in stale:     #pylint: disable=invalid-name
+            untracked = []
+            for jobid in found.get(r["jobname"], []):
+                self.curs.execute("SELECT 1 FROM jobs WHERE jobid=?", (jobid, ))
+                if self.curs.fetchone() is None and jobid not in jobids.values():
+                    untracked.append(jobid)
+            if len(untracked) == 1:
+                jobids[r[key]] = untracked[0]
+            elif len(untracked) > 1:
+                print describe(r), "may have been submitted as any of:", \
+                      ", ".join(untracked), "- not submitting it again"
+                ambiguous.add(r[key])
+        return jobids, ambiguous
+
+
+    def workflow_counts(self, name):
+        """Return a dict with the number of jobs of workflow 'name': "jobs",
+           "submitted", "done" (submitted, and complete or no longer in the
+           jobs table), "ready" (not done, and the jobs they depend on are
+           done) and "blocked" (waiting for other jobs of the workflow)."""
+        nodes, parents = self._workflow(name)
+        done = set([node for node, r in nodes.iteritems()
+                    if r["status"] == "Submitted" and r["jobstatus"] in ("C", None)])
+        blocked = [node for node in nodes if node not in done
+                   and [p for p in parents[node] if p not in done]]
+        return {"jobs" : len(nodes),
+                "submitted" : len([r for r in nodes.values() if r["status"] == "Submitted"]),
+                "done" : len(done),
+                "ready" : len(nodes) - len(done) - len(blocked),
+                "blocked" : len(blocked)}
+
+
+    @_retry_locked
+    def add_tasks(self, bundles):
+        """Add tasks to the 'tasks' table, 'Queued', to be run by bundled
+           workers (see pbs.bundle).
+
+           Accepts 'bundles', a list of bundles, each a list of dictionaries
+           with "command", "rundir", "procs" and "walltime" (expected run time
+           in seconds).
+
+           Returns the list of bundle ids: the id of the first task of each
+           bundle.
+        """
+        ids = []
+        for tasks in bundles:
+            bundle = None
+            for task in tasks:
+                self.curs.execute("INSERT INTO tasks (bundle, command, rundir, procs, walltime,\
+                                   status) VALUES (?, ?, ?, ?, ?, 'Queued')",
+                                  (bundle, task["command"], task["rundir"], task["procs"],
+                                   task["walltime"]))
+                if bundle is None:
+                    bundle = self.curs.lastrowid
+                    self.curs.execute("UPDATE tasks SET bundle=? WHERE id=?", (bundle, bundle))
+            ids.append(bundle)
+        self.conn.commit()
+        return ids
+
+
+    @_retry_locked
+    def set_bundle_jobid(self, jobids):
+        """Set the jobid of the tasks of each bundle in the dict {bundle id:
+           jobid} 'jobids', unless a worker already set it."""
+        self.curs.executemany("UPDATE tasks SET jobid=? WHERE bundle=? AND jobid IS NULL",
+                              [(jobid, bundle) for bundle, jobid in jobids.iteritems()])
         self.conn.commit()
 
 
-    def update(self):
+    @_retry_locked
+    def delete_tasks(self, bundles):
+        """Delete the tasks of the bundles with ids in the list 'bundles'.
+
+           Returns the number of tasks deleted.
+        """
+        self.curs.executemany("DELETE FROM tasks WHERE bundle=?", [(b, ) for b in bundles])
+        count = self.curs.rowcount
+        self.conn.commit()
+        return count
+
+
+    @_retry_locked
+    def update_tasks(self, tasks):
+        """Record the status of several tasks in one transaction.
+
+           Accepts 'tasks', a list of dictionaries with "id", "jobid",
+           "status", "exit_status", "starttime" and "completiontime".
+        """
+        self.curs.executemany("UPDATE tasks SET jobid=?, status=?, exit_status=?, starttime=?,\
+                               completiontime=? WHERE id=?",
+                              [(t["jobid"], t["status"], t["exit_status"], t["starttime"],
+                                t["completiontime"], t["id"]) for t in tasks])
+        self.conn.commit()
+
+
+    def select_tasks(self, bundle=None, jobid=None):
+        """Return the list of sqlite3.Row of the tasks of bundle 'bundle', or
+           last run by one of the jobs in the list 'jobid', or else of all
+           tasks, by id."""
+        if bundle is not None:
+            self.curs.execute("SELECT * FROM tasks WHERE bundle=? ORDER BY id", (bundle, ))
+            return self.curs.fetchall()
+        if jobid is not None:
+            tasks = []
+            for j in set(jobid):
+                self.curs.execute("SELECT * FROM tasks WHERE jobid=?", (j, ))
+                tasks += self.curs.fetchall()
+            return sorted(tasks, key=lambda t: t["id"])
+        self.curs.execute("SELECT * FROM tasks ORDER BY id")
+        return self.curs.fetchall()
+
+
+    def job_status(self, jobid=None):
+        """Return the scheduler's job status, as misc_pbs.job_status(), for all of
+           the user's jobs or only the jobs in the list 'jobid'.
+
+           The snapshot in self.status_cache is used if it is fresh enough.
+           Jobs in 'jobid' missing from it are queried directly.
+        """
+        status = self.status_cache.get(misc_pbs.job_status)[1]
+        if jobid is None:
+            return status
+        result = dict([(j, status[j]) for j in jobid if j in status])
+        missing = [j for j in jobid if j not in status]
+        if missing:
+            result.update(misc_pbs.job_status(missing))
+        return result
+
+
+    def update(self, discover_untracked=False):
         """Update records using qstat.
 
-           Any jobs found using qstat that are not in the jobs database are
+           If discover_untracked is False, only the jobs this database still
+            considers live (not 'C') are queried, POLL_CHUNK_SIZE jobids per
+            scheduler call (one call with Slurm, which lists every job
+            anyway), and the scheduler is not called at all if there are
+            none. 'self.untracked' is set to [].
+
+           If discover_untracked is True, all of the user's jobs are listed, and
+            any jobs found using qstat that are not in the jobs database are
             saved in 'self.untracked'.
+
+           The scheduler is only called if the snapshot shared by all processes
+            (self.status_cache) is older than the "status_ttl" config value
+            (default 15 seconds). A snapshot up to "status_stale" seconds old
+            (default 120) is used while a fresh one is taken in the background.
+            Set "status_ttl" to 0 to always call the scheduler.
+
+           Returns the number of records that were changed.
         """
 
         # update jobstatus
@@ -345,77 +1670,155 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         # Parse our hostname so we can only select jobs from THIS host
         #   Otherwise, if we're on a multiple-clusters-same-home setup,
         #   we may incorrectly update jobs from one cluster onto the other
-        m = m = re.search(r"(.*?)(?=[^a-zA-Z0-9]*login.*)", self.hostname)   #pylint: disable=invalid-name
-        if m:
-            hostname_regex = m.group(1) + ".*"
+        cluster = misc.cluster_name(self.hostname)
+
+        if discover_untracked:
+            # get job_status dict for all jobs found with qstat
+            snapshot_time, active_status = self.status_cache.get(misc_pbs.job_status)
         else:
-            hostname_regex = self.hostname + ".*"
+            snapshot_time, active_status = self._live_status(cluster)
 
-        # select jobs that are not yet marked complete
-        # self.curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C'")
-        # self.curs.execute("SELECT jobid FROM jobs WHERE hostname REGEXP ")
-        self.curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C' AND hostname REGEXP ?",
-                          (hostname_regex, ))
+        untracked_id, changes = self._reconcile(active_status, cluster, snapshot_time)
 
-        # newstatus will contain the updated info
-        newstatus = dict()
+        # reset untracked
+        if discover_untracked:
+            self.untracked = [active_status[k] for k in untracked_id]
+        else:
+            self.untracked = []
 
-        # any jobs that we don't find with qstat should be marked as 'C'
-        for f in sql_iter(self.curs):   #pylint: disable=invalid-name
-            newstatus[f["jobid"]] = "C"
+        return changes
 
-        # get job_status dict for all jobs found with qstat
-        active_status = misc_pbs.job_status()
 
-        # reset untracked
-        self.untracked = []
+    def _live_status(self, cluster):
+        """Return (snapshot time, job_status dict) for the live (not 'C') jobs on
+           'cluster'. A fresh shared snapshot is used if there is one, else the
+           jobs are queried in chunks of POLL_CHUNK_SIZE jobids (the backend's
+           own POLL_CHUNK_SIZE if it has one).
+        """
+        cached = self.status_cache.fresh()
+        if cached is not None:
+            return cached
 
-        # collect job status
-        for k in active_status.keys():
-            if k in newstatus:
-                newstatus[k] = active_status[k]
-            else:
-                self.curs.execute("SELECT jobid FROM jobs WHERE jobid=?", (k,))
-                if self.curs.fetchone() is None:
-                    self.untracked.append(active_status[k])
-
-        # update database with latest job status
-        for key, jobstatus in newstatus.iteritems():
-            if jobstatus == "C":
-                self.curs.execute(
-                    "UPDATE jobs SET jobstatus=?, elapsedtime=?, modifytime=? WHERE jobid=?",
-                    ("C", None, int(time.time()), key))
-            #elif jobstatus["qstatstr"] is None:
-            #    self.curs.execute(
-            #    "UPDATE jobs SET jobstatus=?, elapsedtime=?, modifytime=? WHERE jobid=?",
-            #    (jobstatus["jobstatus"], jobstatus["elapsedtime"], int(time.time()), key))
-            else:
-                self.curs.execute(
-                    "UPDATE jobs SET jobstatus=?, elapsedtime=?, starttime=?,\
-                     completiontime=?, qstatstr=?, modifytime=? WHERE jobid=?",
-                    (
-                        jobstatus["jobstatus"], jobstatus["elapsedtime"],
-                        jobstatus["starttime"], jobstatus["completiontime"],
-                        jobstatus["qstatstr"], int(time.time()), key))
-        self.conn.commit()
+        self.curs.execute("SELECT jobid FROM jobs WHERE jobstatus!='C' AND cluster>=? AND cluster<?",
+                          _cluster_range(cluster))
+        jobid = [r["jobid"] for r in self.curs.fetchall()]
+
+        snapshot_time = time.time()
+        status = dict()
+        # backends that list every job for any jobids set their own
+        # POLL_CHUNK_SIZE to None, so they are called once
+        chunk_size = getattr(misc_pbs, "POLL_CHUNK_SIZE", POLL_CHUNK_SIZE) or max(1, len(jobid))
+        for i in range(0, len(jobid), chunk_size):
+            status.update(misc_pbs.job_status(jobid[i:i+chunk_size]))
+        return (snapshot_time, status)
+
+
+    @_retry_locked
+    def _reconcile(self, active_status, cluster, snapshot_time=None):
+        """Apply a job_status() snapshot to the jobs database in one transaction.
+
+           Tracked jobs that are not yet 'C' take their status from the
+           snapshot, or are marked 'C' if the scheduler no longer reports them.
+           Non-auto jobs that finished 'Incomplete' are marked 'Check'.
+
+           Only jobs whose cluster starts with 'cluster' are updated. As with
+           the hostname regex this replaces, that includes jobs submitted from
+           compute nodes of this cluster (e.g. continued by taskmaster).
+
+           Jobs created after 'snapshot_time' (the time the snapshot was taken)
+           are not marked 'C' if they are missing from it.
+
+           Returns (untracked jobids, number of records changed).
+        """
+        now = int(time.time())
+        if snapshot_time is None:
+            snapshot_time = now
+
+        # 'cluster' prefix as an indexed range
+        cluster_range = _cluster_range(cluster)
+
+        self.curs.execute("CREATE TEMP TABLE IF NOT EXISTS snapshot \
+                           (jobid text PRIMARY KEY, jobstatus text, elapsedtime integer, \
+                           starttime integer, completiontime integer, qstatstr blob)")
+        self.curs.execute("CREATE TEMP TABLE IF NOT EXISTS target (jobid text PRIMARY KEY)")
+        self.curs.execute("DELETE FROM snapshot")
+        self.curs.execute("DELETE FROM target")
+
+        # qstatstr is compressed the same way as in job_text, so it can be compared
+        self.curs.executemany(
+            "INSERT OR REPLACE INTO snapshot VALUES (?, ?, ?, ?, ?, ?)",
+            ((k, v.get("jobstatus"), v.get("elapsedtime"), v.get("starttime"),
+              v.get("completiontime"), compress(v.get("qstatstr")))
+             for k, v in active_status.iteritems()))
+
+        # tracked jobs on this cluster that are not yet marked complete
+        self.curs.execute("INSERT INTO target SELECT jobid FROM jobs\
+                           WHERE jobstatus!='C' AND cluster>=? AND cluster<?", cluster_range)
+
+        # jobs reported by the scheduler: copy the fields that changed
+        self.curs.execute(
+            "UPDATE jobs SET \
+             jobstatus=(SELECT jobstatus FROM snapshot WHERE snapshot.jobid=jobs.jobid), \
+             elapsedtime=(SELECT elapsedtime FROM snapshot WHERE snapshot.jobid=jobs.jobid), \
+             starttime=(SELECT starttime FROM snapshot WHERE snapshot.jobid=jobs.jobid), \
+             completiontime=(SELECT completiontime FROM snapshot WHERE snapshot.jobid=jobs.jobid), \
+             modifytime=? \
+             WHERE jobid IN target AND EXISTS (SELECT 1 FROM snapshot \
+                LEFT JOIN job_text ON job_text.jobid=snapshot.jobid \
+                WHERE snapshot.jobid=jobs.jobid AND (snapshot.jobstatus IS NOT jobs.jobstatus \
+                OR snapshot.elapsedtime IS NOT jobs.elapsedtime \
+                OR snapshot.starttime IS NOT jobs.starttime \
+                OR snapshot.completiontime IS NOT jobs.completiontime \
+                OR snapshot.qstatstr IS NOT job_text.qstatstr))",
+            (now, ))
+        changes = self.curs.rowcount
+
+        self.curs.execute(
+            "UPDATE job_text SET \
+             qstatstr=(SELECT qstatstr FROM snapshot WHERE snapshot.jobid=job_text.jobid) \
+             WHERE jobid IN target AND EXISTS (SELECT 1 FROM snapshot \
+                WHERE snapshot.jobid=job_text.jobid AND snapshot.qstatstr IS NOT job_text.qstatstr)")
+
+        # any jobs that we don't find with qstat should be marked as 'C'
+        self.curs.execute(
+            "UPDATE jobs SET jobstatus='C', elapsedtime=NULL, modifytime=? \
+             WHERE jobid IN target AND jobid NOT IN (SELECT jobid FROM snapshot) \
+             AND creationtime < ?",
+            (now, int(snapshot_time)))
+        changes += self.curs.rowcount
+
+        # jobs whose continuation was pre-submitted are continued once they end
+        self.curs.execute(
+            "UPDATE jobs SET taskstatus='Continued', modifytime=? \
+            WHERE jobstatus='C' AND taskstatus='Incomplete' AND continuation_jobid!='-'",
+            (now,))
+        changes += self.curs.rowcount
 
         # update taskstatus for non-auto jobs
         self.curs.execute(
             "UPDATE jobs SET taskstatus='Check', modifytime=? \
             WHERE jobstatus='C' AND taskstatus='Incomplete' AND auto=0",
-            (int(time.time()),))
+            (now,))
+        changes += self.curs.rowcount
+
+        self.curs.execute("SELECT jobid FROM snapshot WHERE jobid NOT IN (SELECT jobid FROM jobs)")
+        untracked_id = [r["jobid"] for r in self.curs.fetchall()]
+
         self.conn.commit()
 
+        return (untracked_id, changes)
 
 
+    def select_job(self, jobid, text=False):
+        """Return record (sqlite3.Row object) for one job with given jobid.
 
-    def select_job(self, jobid):
-        """Return record (sqlite3.Row object) for one job with given jobid."""
+           If text is True, return a dict which also contains TEXT_KEYS.
+        """
         if not isinstance(jobid, str) and not isinstance(jobid, unicode):
             print "Error in pbs.JobDB.select_job(). type(id):", type(jobid), "expected str."
             sys.exit()
 
-        self.curs.execute("SELECT * FROM jobs WHERE jobid=?", (jobid,))
+        self.curs.execute("SELECT * FROM " + self.table + " WHERE jobid=?", (jobid,))
         r = self.curs.fetchall()    #pylint: disable=invalid-name
         if len(r) == 0:
             raise JobDBError("Error in pbs.JobDB.select_job(). jobid: '"
@@ -424,21 +1827,45 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             raise JobDBError("Error in pbs.JobDB.select_job(). "
                              + str(len(r)) + " records with jobid: '"
                              + jobid + "' found.")
+        if text:
+            return self.with_text(r[0])
         return r[0]
 
 
+    def select_text(self, jobid):
+        """Return a dict with the decompressed TEXT_KEYS fields for one job."""
+        self.curs.execute("SELECT qstatstr, (SELECT qsubstr FROM " + self.scripts_table
+                          + " WHERE hash=script_hash LIMIT 1) AS qsubstr FROM "
+                          + self.text_table + " WHERE jobid=?", (jobid,))
+        r = self.curs.fetchone()    #pylint: disable=invalid-name
+        if r is None:
+            return dict([(k, None) for k in TEXT_KEYS])
+        return dict([(k, decompress(r[k])) for k in TEXT_KEYS])
+
+
+    def with_text(self, job):
+        """Return a dict copy of record 'job' with the TEXT_KEYS fields loaded.
+
+            job: a sqlite3.Row or a dict. The TEXT_KEYS fields are not loaded if
+               'job' already has a "qstatstr" (as untracked jobs do), or if its
+               jobid is not in the jobs database.
+        """
+        d = dict(job)   #pylint: disable=invalid-name
+        if "qstatstr" in d:
+            return d
+        self.curs.execute("SELECT 1 FROM " + self.table + " WHERE jobid=?", (d["jobid"],))
+        if self.curs.fetchone() is not None:
+            d.update(self.select_text(d["jobid"]))
+        return d
+
+
     def select_series(self, jobid):
         """Return records (sqlite3.Row objects) for a series of auto jobs"""
-        r = self.select_job(jobid)  #pylint: disable=invalid-name
-        series = [r]
-        parent = self.select_parent(jobid)
-        while parent is not None:
-            series.insert(0, parent)
-            parent = self.select_parent(parent["jobid"])
-        child = self.select_child(jobid)
-        while child is not None:
-            series.append(child)
-            child = self.select_child(child["jobid"])
+        self.curs.execute("SELECT * FROM " + self.table + " WHERE series_id=(SELECT series_id FROM "
+                          + self.table + " WHERE jobid=?) ORDER BY series_index", (jobid,))
+        series = self.curs.fetchall()
+        if len(series) == 0:
+            self.select_job(jobid)
         return series
 
 
@@ -451,7 +1878,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             print "Error in pbs.JobDB.select_parent(). type(id):", type(jobid), "expected str."
             sys.exit()
 
-        self.curs.execute("SELECT * FROM jobs WHERE continuation_jobid=?", (jobid,))
+        self.curs.execute("SELECT * FROM " + self.table + " WHERE continuation_jobid=?", (jobid,))
         r = self.curs.fetchall()    #pylint: disable=invalid-name
         if len(r) == 0:
             return None
@@ -474,7 +1901,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if r["continuation_jobid"] == "-":
             return None
 
-        self.curs.execute("SELECT * FROM jobs WHERE jobid=?", (r["continuation_jobid"],))
+        self.curs.execute("SELECT * FROM " + self.table + " WHERE jobid=?", (r["continuation_jobid"],))
         r = self.curs.fetchall()    #pylint: disable=invalid-name
         if len(r) == 0:
             print ("Error in pbs.JobDB.select_child(). jobid:",
@@ -493,7 +1920,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
     def select_all_id(self):
         """Return a list with all jobids."""
         job = []
-        self.curs.execute("SELECT jobid FROM jobs")
+        self.curs.execute("SELECT jobid FROM " + self.table)
         for r in sql_iter(self.curs):   #pylint: disable=invalid-name
             job.append(r["jobid"])
         return job
@@ -516,10 +1943,10 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         """ Return a list of all jobids which are between (and including)
                 min_jobid and max_jobid. """
         job = []
-        self.curs.execute("SELECT jobid FROM jobs")
+        self.curs.execute("SELECT jobid FROM " + self.table + " WHERE jobid_num BETWEEN ? AND ?\
+                           ORDER BY jobid_num, array_index", _jobid_range(min_jobid, max_jobid))
         for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if int(r["jobid"]) >= int(min_jobid) and int(r["jobid"]) <= int(max_jobid):
-                job.append(r["jobid"])
+            job.append(r["jobid"])
         return job
 
 
@@ -527,7 +1954,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         """ Return a list of all jobids which were modified in the last 'recent_time' """
         mintime = int(time.time() - misc.seconds(recent_time))
         recent_job = []
-        self.curs.execute("SELECT jobid FROM jobs WHERE modifytime>=?", (mintime, ))
+        self.curs.execute("SELECT jobid FROM " + self.table + " WHERE modifytime>=?", (mintime, ))
         for r in sql_iter(self.curs):   #pylint: disable=invalid-name
             recent_job.append(r["jobid"])
         return recent_job
@@ -538,7 +1965,8 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 regular expression 'regex' """
         job = []
         if key in job_status_dict():
-            self.curs.execute("SELECT jobid FROM jobs WHERE " + key + " REGEXP ?", (regex, ))
+            self.curs.execute("SELECT jobid FROM " + self.table + " WHERE "
+                              + self._regex_condition(key), (regex, ))
             for r in sql_iter(self.curs):   #pylint: disable=invalid-name
                 job.append(r["jobid"])
         else:
@@ -547,70 +1975,98 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         return job
 
 
+    def _regex_condition(self, key):
+        """SQL condition for jobs where column 'key' matches the regex '?'"""
+        if key == "qsubstr":
+            # test each distinct script once
+            return ("jobid IN (SELECT jobid FROM " + self.text_table + " WHERE script_hash IN"
+                    + " (SELECT hash FROM " + self.scripts_table
+                    + " WHERE DECOMPRESS(qsubstr) REGEXP ?))")
+        elif key == "qstatstr":
+            return ("jobid IN (SELECT jobid FROM " + self.text_table
+                    + " WHERE DECOMPRESS(qstatstr) REGEXP ?)")
+        return key + " REGEXP ?"
+
+
     def select_series_id(self, jobid):
         """Return a list with all jobids for a series of auto jobs."""
-        job = [jobid]
-        r = self.select_job(jobid)  #pylint: disable=invalid-name, unused-variable
-        parent = self.select_parent(jobid)
-        while parent is not None:
-            job.insert(0, parent["jobid"])
-            parent = self.select_parent(parent["jobid"])
-        child = self.select_child(jobid)
-        while child is not None:
-            job.append(child["jobid"])
-            child = self.select_child(child["jobid"])
+        self.curs.execute("SELECT jobid FROM " + self.table + " WHERE series_id=(SELECT series_id FROM "
+                          + self.table + " WHERE jobid=?) ORDER BY series_index", (jobid,))
+        job = [r["jobid"] for r in self.curs.fetchall()]
+        if len(job) == 0:
+            self.select_job(jobid)
         return job
 
 
-    def select_all_series_id(self):
-        """Return a list of lists of jobids (one list for each series)."""
+    def select_tail_series_id(self, condition="1", params=()):
+        """Return a list of lists of jobids (one list for each series), for all series
+           whose last job matches an SQL condition, using a single indexed query.
+
+           Args:
+             condition: SQL expression on the columns of the last job in a series
+             params: parameters substituted for '?' in condition
+        """
         all_series = []
-        self.curs.execute("SELECT * FROM jobs")
+        last_series = None
+        self.curs.execute("SELECT series_id, jobid FROM " + self.table + " WHERE series_id IN \
+                           (SELECT series_id FROM " + self.table
+                          + " WHERE continuation_jobid='-' AND (" + condition
+                          + ")) ORDER BY series_id, series_index", params)
         for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                all_series.append(self.select_series_id(r["jobid"]))
+            if r["series_id"] != last_series:
+                all_series.append([])
+                last_series = r["series_id"]
+            all_series[-1].append(r["jobid"])
         return all_series
 
 
+    @_retry_locked
+    def check_series(self, repair=True):
+        """Check the stored series_id and series_index of every record against the
+           continuation_jobid chains.
+
+           Args:
+             repair: If True (default), fix records that differ.
+
+           Returns:
+             a list of the jobids of records that differed
+        """
+        drift = _series_drift(self.curs)
+        if repair and drift:
+            self.curs.executemany("UPDATE jobs SET series_id=?, series_index=? WHERE jobid=?",
+                                  [(sid, index, jobid) for jobid, sid, index in drift])
+            self.conn.commit()
+        return [d[0] for d in drift]
+
+
+    def select_all_series_id(self):
+        """Return a list of lists of jobids (one list for each series)."""
+        return self.select_tail_series_id()
+
+
     def select_active_series_id(self):
         """Return a list of lists of jobids (one list for each active series).
 
            "Active" series of auto jobs are those with one job with
                 taskstatus='Incomplete' or 'Check'
         """
-        active_series = []
-        self.curs.execute("SELECT jobid, continuation_jobid FROM jobs WHERE\
-                           taskstatus!='Complete' AND taskstatus!='Aborted'\
-                           AND taskstatus!='Continued'")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                active_series.append(self.select_series_id(r["jobid"]))
-        return active_series
+        return self.select_tail_series_id("taskstatus!='Complete' AND taskstatus!='Aborted'\
+                                           AND taskstatus!='Continued'")
 
 
     def select_range_series_id(self, min_jobid, max_jobid):
         """ Return a list of lists of all jobids for series (one list for each series)
             which have the last job between (and including) min_jobid and max_jobid.
         """
-        job = []
-        self.curs.execute("SELECT jobid, continuation_jobid FROM jobs")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if int(r["jobid"]) >= int(min_jobid) and int(r["jobid"]) <= int(max_jobid):
-                if r["continuation_jobid"] == "-":
-                    job.append(self.select_series_id(r["jobid"]))
-        return job
+        return self.select_tail_series_id("jobid_num BETWEEN ? AND ?",
+                                          _jobid_range(min_jobid, max_jobid))
 
 
     def select_recent_series_id(self, recent_time):
         """ Return a list of lists of jobids (one for each series) which were
                 modified in the last 'recent_time' """
         mintime = int(time.time() - misc.seconds(recent_time))
-        recent_job = []
-        self.curs.execute("SELECT jobid FROM jobs WHERE modifytime>=?", (mintime, ))
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            if r["continuation_jobid"] == "-":
-                recent_job.append(self.select_series_id(r["jobid"]))
-        return recent_job
+        return self.select_tail_series_id("modifytime>=?", (mintime, ))
 
 
     def select_regex_series_id(self, key, regex):
@@ -618,24 +2074,20 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             'key' matches the regular expression 'regex'
         """
 
-        job = []
         if  key in job_status_dict():
-            self.curs.execute("SELECT jobid FROM jobs WHERE " + key + " REGEXP ?", (regex))
-            for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-                if r["continuation_jobid"] == "-":
-                    job.append(self.select_series_id(r["jobid"]))
+            return self.select_tail_series_id(self._regex_condition(key), (regex, ))
         else:
             raise JobDBError(key + " not a valid key")
 
-        return job
-
 
 
-    def eligible_to_continue(self, job):    #pylint: disable=no-self-use
+    def eligible_to_continue(self, job):
         """ Return True if job is eligible to be continued, else return False
 
             Job must have jobstatus="C" and taskstatus="Incomplete" and auto=1,
-                or else the job can not be continued.
+                and no continuation_jobid, or else the job can not be continued.
+                If the "presubmit" config.json value is set, jobs with
+                jobstatus="R" are also eligible.
 
             Args:
                 job: a sqlite3.Row, as obtained by self.select_job()
@@ -644,7 +2096,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 (0, jobid, None) if eligible
                 (1, jobid, msg) if not eligible
         """
-        if job["jobstatus"] != "C":
+        if job["jobstatus"] != "C" and not (self.presubmit and job["jobstatus"] == "R"):
             return (False, job["jobid"], "Job not eligible to continue. jobstatus = "
                     + job["jobstatus"])
 
@@ -652,6 +2104,10 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
             return (False, job["jobid"], "Job not eligible to continue. taskstatus = "
                     + job["taskstatus"])
 
+        if job["continuation_jobid"] != "-":
+            return (False, job["jobid"], "Job not eligible to continue. continuation_jobid = "
+                    + job["continuation_jobid"])
+
         if job["auto"] != 1:
             return (False, job["jobid"], "Job not eligible to continue. auto = "
                     + str(bool(job["auto"])))
@@ -662,6 +2118,12 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
     def continue_job(self, jobid=None, job=None):
         """ Resubmit one job with given jobid.
 
+            If the job is still running (see eligible_to_continue()), the next
+            job is pre-submitted with a dependency on it, so that it can start
+            as soon as the job ends. It is cancelled if the job is completed
+            with complete_job() first, and the job is marked 'Continued' by
+            update() once it ends.
+
             Args:
                 jobid: jobid of the job to continue
                 job: (sqlite3.Row) If this is given, jobid is not necessary and is ignored if given
@@ -680,25 +2142,53 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         wd = os.getcwd()    #pylint: disable=invalid-name
         os.chdir(job["rundir"])
 
-        new_jobid = misc_pbs.submit(qsubstr=job["qsubstr"])
+        qsubstr = self.select_text(job["jobid"])["qsubstr"]
+        if job["jobstatus"] == "C":
+            new_jobid = misc_pbs.submit(substr=qsubstr)
+        else:
+            directive = misc_pbs.dependency_directive(job["jobid"], self.presubmit)
+            new_jobid = misc_pbs.submit(substr=_with_directive(qsubstr, directive))
 
-        self.curs.execute("UPDATE jobs SET taskstatus='Continued', modifytime=?,\
-                           continuation_jobid=? WHERE jobid=?",
-                          (int(time.time()), new_jobid, job["jobid"]))
         status = job_status_dict(jobid=new_jobid, jobname=job["jobname"], rundir=os.getcwd(),
-                                 jobstatus="?", auto=job["auto"], qsubstr=job["qsubstr"],
-                                 nodes=job["nodes"], procs=job["procs"], walltime=job["walltime"])
-        self.add(status)
+                                 jobstatus="?", auto=job["auto"], qsubstr=qsubstr,
+                                 nodes=job["nodes"], procs=job["procs"], walltime=job["walltime"],
+                                 series_id=job["series_id"], series_index=job["series_index"]+1)
+        self._record_continuation(job["jobid"], status, job["jobstatus"] != "C")
 
         os.chdir(wd)
 
 
+    @_retry_locked
+    def _record_continuation(self, jobid, status, presubmitted=False):
+        """Mark job 'jobid' as 'Continued' by the new job 'status' and add the new
+           job's record, in one transaction. Used by continue_job() after submitting.
+
+           If 'presubmitted', job 'jobid' is still running: its continuation_jobid
+           is set but it stays 'Incomplete' until update() sees it end.
+        """
+        self.curs.execute("UPDATE jobs SET taskstatus=?, modifytime=?,\
+                           continuation_jobid=? WHERE jobid=?",
+                          ("Incomplete" if presubmitted else "Continued", int(time.time()),
+                           status["jobid"], jobid))
+        self._set_keys(status)
+        (colstr, questionstr, valtuple) = sql_insert_str(status)
+        insertstr = "INSERT INTO jobs {0} VALUES {1}".format(colstr, questionstr)
+        self.curs.execute(insertstr, valtuple)
+        # the new job runs the same script, so reference the stored copy
+        self.curs.execute("INSERT OR REPLACE INTO job_text SELECT ?, script_hash, ?\
+                           FROM job_text WHERE jobid=?",
+                          (status["jobid"], compress(status["qstatstr"]), jobid))
+        self.conn.commit()
+
+
     def continue_all(self):
-        """Resubmit all jobs eligible to continue"""
+        """Resubmit all jobs eligible to continue, and pre-submit the next job of
+           running auto jobs if the "presubmit" config.json value is set"""
         self.curs.execute("SELECT jobid FROM jobs WHERE auto=1 AND\
-                           taskstatus='Incomplete' AND jobstatus='C'")
-        for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-            self.continue_job(r["jobid"])
+                           taskstatus='Incomplete' AND continuation_jobid='-' AND\
+                           (jobstatus='C' OR (? AND jobstatus='R'))", (bool(self.presubmit), ))
+        for jobid in [r["jobid"] for r in self.curs.fetchall()]:
+            self.continue_job(jobid)
 
 
     def eligible_to_abort(self, job):   #pylint: disable=no-self-use
@@ -739,14 +2229,63 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
         if job is None:
             job = self.select_job(jobid)
+        self.abort_jobs([job])
 
-        eligible, id, msg = self.eligible_to_abort(job) #pylint: disable=invalid-name, redefined-builtin
-        if not eligible:
-            raise EligibilityError(id, msg)
 
-        misc_pbs.delete(job["jobid"])
-        self.curs.execute("UPDATE jobs SET taskstatus='Aborted', modifytime=?\
-                           WHERE jobid=?", (int(time.time()), job["jobid"]))
+    def abort_jobs(self, jobs):
+        """ qdel several jobs, with one qdel call per chunk of jobids (see
+            misc.run_batch), and mark them as Aborted. Continuations pre-submitted
+            by continue_job() are aborted too.
+
+            Args:
+                jobs: list of sqlite3.Row, as obtained by self.select_job()
+
+            Returns:
+                dict of jobid: error message printed by qdel, for jobs with errors
+                (for example jobs that already finished); these are still marked
+                as Aborted
+
+            Raises:
+                EligibilityError if any job is not eligible to be aborted (nothing is done)
+                PBSError listing the jobs whose qdel call could not be run or timed
+                  out; the others are still marked as Aborted
+        """
+        for job in jobs:
+            eligible, id, msg = self.eligible_to_abort(job) #pylint: disable=invalid-name, redefined-builtin
+            if not eligible:
+                raise EligibilityError(id, msg)
+
+        jobid = [job["jobid"] for job in jobs]
+        jobid += [j for j in _presubmitted(jobs) if j not in jobid]
+        (jobid, messages, error) = self._batch_delete(jobid)
+        self._mark_aborted(jobid)
+        if error is not None:
+            raise error     #pylint: disable=raising-bad-type
+        return messages
+
+
+    def _batch_delete(self, jobid):  #pylint: disable=no-self-use
+        """qdel the jobs in the list 'jobid' with misc_pbs.delete_many().
+
+           Returns (jobids whose qdel call ran, dict of jobid: qdel error message
+           for those with one, PBSError for the calls that failed or None).
+        """
+        error = None
+        try:
+            result = misc_pbs.delete_many(jobid)
+        except misc.PBSError as e:  #pylint: disable=invalid-name
+            error = e
+            result = e.results
+        messages = dict([(j, msg) for j, msg in result.iteritems() if msg is not None])
+        return ([j for j in jobid if j in result], messages, error)
+
+
+    @_retry_locked
+    def _mark_aborted(self, jobid):
+        """Set taskstatus 'Aborted' for each job in the list 'jobid', in one transaction"""
+        now = int(time.time())
+        self.curs.executemany("UPDATE jobs SET taskstatus='Aborted', modifytime=? WHERE jobid=?",
+                              [(now, j) for j in jobid])
         self.conn.commit()
 
 
@@ -775,15 +2314,52 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         """
         if job is None:
             job = self.select_job(jobid)
+        self.delete_jobs([job], series=series)
 
-        if series:
-            jobseries = self.select_series_id(job["jobid"])
-        else:
-            jobseries = [job["jobid"]]
 
-        for j in jobseries:
-            misc_pbs.delete(j)
-            self.curs.execute("DELETE from jobs WHERE jobid=?", (j, ))
+    def delete_jobs(self, jobs, series=False):
+        """ qdel several jobs, with one qdel call per chunk of jobids (see
+            misc.run_batch), and delete them from the database. Continuations
+            pre-submitted by continue_job() are deleted too.
+
+             Args:
+                jobs: list of sqlite3.Row, as obtained by self.select_job()
+                series: If 'series'=True, deletes the entire series of each job
+
+             Returns:
+                dict of jobid: error message printed by qdel, for jobs with errors
+                (for example jobs that already finished); these are still deleted
+
+             Raises:
+                PBSError listing the jobs whose qdel call could not be run or
+                  timed out; they are kept in the database, the others are still
+                  deleted
+        """
+        jobid = []
+        seen = set()
+        for job in jobs:
+            if series:
+                jobseries = self.select_series_id(job["jobid"])
+            else:
+                jobseries = [job["jobid"]] + _presubmitted([job])
+            for j in jobseries:
+                if j not in seen:
+                    seen.add(j)
+                    jobid.append(j)
+
+        (jobid, messages, error) = self._batch_delete(jobid)
+        self._delete_records(jobid)
+        if error is not None:
+            raise error     #pylint: disable=raising-bad-type
+        return messages
+
+
+    @_retry_locked
+    def _delete_records(self, jobid):
+        """Delete the records of each job in the list 'jobid', in one transaction"""
+        self.curs.executemany("DELETE FROM job_text WHERE jobid=?", [(j, ) for j in jobid])
+        self.curs.executemany("DELETE FROM jobs WHERE jobid=?", [(j, ) for j in jobid])
+        self._prune_scripts()
         self.conn.commit()
 
 
@@ -802,6 +2378,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         return (True, job["jobid"], None)
 
 
+    @_retry_locked
     def error_job(self, message, jobid=None, job=None):
         """ Mark job taskstatus as 'Error: message'
 
@@ -884,7 +2461,15 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
 
 
     def complete_job(self, jobid=None, job=None):
-        """Mark job taskstatus as 'Complete'"""
+        """Mark job taskstatus as 'Complete'
+
+           If the next job was pre-submitted (see continue_job()), it is
+           marked 'Aborted' and deleted from the scheduler, and then its
+           record is deleted. If deleting it from the scheduler fails, the
+           error is printed and its 'Aborted' record is kept, so that it is
+           still listed by 'pstat' and can be deleted with 'pstat --abort'.
+           The job is marked 'Complete' in any case.
+        """
 
         if job is None:
             job = self.select_job(jobid)
@@ -893,8 +2478,34 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         if not eligible:
             raise EligibilityError(id, msg)
 
-        self.curs.execute("UPDATE jobs SET taskstatus='Complete', modifytime=?, elapsedtime=?\
-                           WHERE jobid=?", (int(time.time()), None, job["jobid"]))
+        presubmitted = job["continuation_jobid"]
+        self._mark_complete(job["jobid"], presubmitted)
+        if presubmitted != "-":
+            try:
+                code = misc_pbs.delete(presubmitted)
+                msg = "exit status " + str(code)
+            except misc.PBSError as e:  #pylint: disable=invalid-name
+                code = None
+                msg = e.msg
+            if code == 0:
+                self._delete_records([presubmitted])
+            else:
+                print "Error in pbs.JobDB.complete_job(). Could not delete the pre-submitted", \
+                      "job", presubmitted, "of job", job["jobid"] + ":", msg + ".", \
+                      "It is kept as 'Aborted'."
+
+
+    @_retry_locked
+    def _mark_complete(self, jobid, presubmitted="-"):
+        """Mark job 'jobid' 'Complete', and its pre-submitted continuation
+           'presubmitted' 'Aborted', in one transaction."""
+        now = int(time.time())
+        if presubmitted != "-":
+            self.curs.execute("UPDATE jobs SET taskstatus='Aborted', modifytime=? WHERE jobid=?",
+                              (now, presubmitted))
+        self.curs.execute("UPDATE jobs SET taskstatus='Complete', modifytime=?, elapsedtime=?,\
+                           continuation_jobid='-' WHERE jobid=?",
+                          (now, None, jobid))
         self.conn.commit()
 
 
@@ -932,11 +2543,14 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                        d["continuation_jobid"]))
 
 
-    def print_full_record(self, r): #pylint: disable=invalid-name, no-self-use
+    def print_full_record(self, r): #pylint: disable=invalid-name
         """Print record as list of key-val pairs.
 
-            r: a dict-like object
+            r: a dict-like object. If it does not contain TEXT_KEYS, they are
+               loaded from the database.
         """
+        if "qsubstr" not in r.keys():
+            r = self.with_text(r)   #pylint: disable=invalid-name
         print "#Record:"
         for key in r.keys():
             if isinstance(r[key], (str, unicode)):
@@ -991,20 +2605,18 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
         """
         if curs is None:
             curs = self.curs
-        if full:
-            for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-                if series:
-                    if r["continuation_jobid"] == "-":
-                        self.print_job(r["jobid"], full=full, series=series)
-                else:
-                    self.print_full_record(r)
+        if series:
+            # collect the last job of each series first, because printing a
+            # series queries the database again
+            tail = [r["jobid"] for r in sql_iter(curs) if r["continuation_jobid"] == "-"]
+            for jobid in tail:
+                self.print_job(jobid, full=full, series=series)
+        elif full:
+            for r in sql_iter(curs):   #pylint: disable=invalid-name
+                self.print_full_record(r)
         else:
-            for r in sql_iter(self.curs):   #pylint: disable=invalid-name
-                if series:
-                    if r["continuation_jobid"] == "-":
-                        self.print_job(r["jobid"], full=full, series=series)
-                else:
-                    self.print_record(r)
+            for r in sql_iter(curs):   #pylint: disable=invalid-name
+                self.print_record(r)
 
 
     def print_untracked(self, full=False):
@@ -1031,6 +2643,96 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 self.print_record(tmp)
 
 
+    def print_pending(self, full=False):
+        """Print jobs in the 'pending' table, if any, with JobID "P" + pending id
+           and their status ('Pending' or 'Submitting') as task status.
+
+            Arguments:
+             full: If True, print as key:val pair list, If (default) False,
+                print single row summary in 'qstat' style.
+        """
+        pending = self.select_pending(text=full)
+        if not pending:
+            return
+        print "\n\nPending:"
+        if not full:
+            self.print_header()
+        for r in pending:  #pylint: disable=invalid-name
+            if full:
+                self.print_full_record(dict(r))
+            else:
+                tmp = dict(r)
+                tmp["jobid"] = "P" + str(r["id"])
+                tmp["jobstatus"] = "-"
+                tmp["elapsedtime"] = None
+                tmp["taskstatus"] = r["status"]
+                tmp["continuation_jobid"] = "-"
+                self.print_record(tmp)
+
+
+    def print_workflows(self):
+        """Print, for each workflow, if any, its number of jobs, and how many
+           are submitted, done, ready and blocked (see workflow_counts())."""
+        self.curs.execute("SELECT DISTINCT workflow FROM workflow_nodes ORDER BY workflow")
+        names = [r["workflow"] for r in self.curs.fetchall()]
+        if not names:
+            return
+        print "\n\nWorkflows:"
+        print ("{0:<24} {1:>8} {2:>9} {3:>8} {4:>8} {5:>8}"
+               .format("Workflow", "Jobs", "Submitted", "Done", "Ready", "Blocked"))
+        print ("{0:-^24} {1:-^8} {2:-^9} {3:-^8} {4:-^8} {5:-^8}"
+               .format("-", "-", "-", "-", "-", "-"))
+        for name in names:
+            counts = self.workflow_counts(name)
+            print ("{0:<24} {1:>8} {2:>9} {3:>8} {4:>8} {5:>8}"
+                   .format(name, counts["jobs"], counts["submitted"], counts["done"],
+                           counts["ready"], counts["blocked"]))
+
+
+    def print_bundles(self, active=True):
+        """Print the number of tasks of each bundle (see pbs.bundle) by status,
+           with the jobid of the job that last ran one of them. If 'active',
+           only bundles with tasks 'Queued' or 'Running' are printed."""
+        self.curs.execute("SELECT bundle, count(*) AS tasks,\
+                           sum(status='Queued') AS queued, sum(status='Running') AS running,\
+                           sum(status='Complete') AS complete, sum(status='Error') AS error,\
+                           (SELECT jobid FROM tasks AS last WHERE last.bundle=tasks.bundle\
+                            AND jobid IS NOT NULL ORDER BY starttime DESC LIMIT 1) AS jobid\
+                           FROM tasks GROUP BY bundle ORDER BY bundle")
+        bundles = [r for r in self.curs.fetchall() if not active or r["queued"] or r["running"]]
+        if not bundles:
+            return
+        print "\n\nTask bundles:"
+        print ("{0:<12} {1:<12} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}"
+               .format("Bundle", "JobID", "Tasks", "Queued", "Running", "Complete", "Error"))
+        print ("{0:-^12} {1:-^12} {2:-^8} {3:-^8} {4:-^8} {5:-^8} {6:-^8}"
+               .format("-", "-", "-", "-", "-", "-", "-"))
+        for r in bundles:   #pylint: disable=invalid-name
+            print ("{0:<12} {1:<12} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}"
+                   .format(r["bundle"], r["jobid"] or "-", r["tasks"], r["queued"],
+                           r["running"], r["complete"], r["error"]))
+
+
+    def print_tasks(self, jobid=None):
+        """Print the tasks last run by one of the jobs in the list 'jobid', or
+           all tasks, with TaskID "T" + task id."""
+        now = int(time.time())
+        print ("{0:<12} {1:<12} {2:^5} {3:>12} {4:>12} {5:<8} {6:>4} {7:<}"
+               .format("TaskID", "JobID", "Procs", "Walltime", "Runtime", "Status", "Exit",
+                       "Command"))
+        print ("{0:-^12} {1:-^12} {2:-^5} {3:-^12} {4:-^12} {5:-^8} {6:-^4} {7:-^24}"
+               .format("-", "-", "-", "-", "-", "-", "-", "-"))
+        for r in self.select_tasks(jobid=jobid):   #pylint: disable=invalid-name
+            runtime = "-"
+            if r["starttime"] is not None:
+                runtime = misc.strftimedelta((r["completiontime"] or now) - r["starttime"])
+            print ("{0:<12} {1:<12} {2:^5} {3:>12} {4:>12} {5:<8} {6:>4} {7:<}"
+                   .format("T" + str(r["id"]), r["jobid"] or "-", r["procs"],
+                           misc.strftimedelta(r["walltime"]), runtime, r["status"],
+                           "-" if r["exit_status"] is None else r["exit_status"],
+                           r["command"].replace("\n", "; ")[:40]))
+
+
     def print_all(self, full=False, series=False):
         """Print all jobs
 
@@ -1041,7 +2743,7 @@ class JobDB(object):    #pylint: disable=too-many-instance-attributes, too-many-
                 series. If (default) False, print in order found.
         """
         print "\n\nTracked:"
-        self.curs.execute("SELECT * FROM jobs")
+        self.curs.execute("SELECT * FROM " + self.table)
         if not full:
             self.print_header()
         self.print_selected(full=full, series=series)
@@ -1080,17 +2782,6 @@ def complete_job(jobid=None, dbpath=None,):
     """
     db = JobDB(dbpath)  #pylint: disable=invalid-name
 
-    if db.config["software"] == "torque":
-        # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-        misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
-    elif db.config["software"] == "slurm":
-        # import misc_slurm as misc
-        # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-        misc_pbs = __import__("pbs.misc_slurm", globals(), locals(), [], -1).misc_slurm
-    else:
-        # import misc_torque as misc_pbs      #pylint: disable=redefined-outer-name
-        misc_pbs = __import__("pbs.misc_torque", globals(), locals(), [], -1).misc_torque
-
     if jobid is None:
         jobid = misc_pbs.job_id()
         if jobid is None:
@@ -1109,6 +2800,22 @@ def complete_job(jobid=None, dbpath=None,):
     db.close()
 
 
+def job_status(jobid=None, dbpath=None):
+    """Return the scheduler's job status for the current user's jobs.
+
+       Arguments:
+         jobid: list of jobid str. If given, only return the status of these jobs.
+         dbpath: Path to JobDB database. If not given, use default database (see JobDB().__init__)
+
+       See JobDB.job_status(). The snapshot shared with other processes is used
+       if it is fresh enough.
+    """
+    db = JobDB(dbpath)  #pylint: disable=invalid-name
+    status = db.job_status(jobid)
+    db.close()
+    return status
+
+
 def error_job(message, jobid=None, dbpath=None):
     """Mark the job as 'Complete' if possible
 
@@ -3,11 +3,71 @@
 import subprocess
 import os
 import StringIO
-# import re
+import re
 import datetime
 # import time
 import sys
+import signal
+import threading
+import Queue
+import importlib
+import socket
+import functools
+import json
+import fcntl
+import tempfile
 from distutils.spawn import find_executable
+try:
+    import subprocess32
+except ImportError:
+    subprocess32 = None
+
+# Maximum number of scheduler commands run at the same time by fan_out().
+# Set from the "concurrency" config.json value by JobDB.
+#
+# The threads of fan_out() start commands with run(). Python 2's subprocess
+# still runs Python code in the child between fork() and exec(), so a lock
+# held by another thread at fork() time (in malloc or stdio) can, rarely,
+# hang that child until the command timeout kills it. If the subprocess32
+# package is installed, run() uses it instead: it forks and execs in C.
+CONCURRENCY = 8
+
+# Maximum total length of the jobids passed to one command by run_batch().
+# Linux limits a single argument to 128kB, and a comma-joined list of jobids
+# may be passed as one argument.
+ARGV_MAX_CHARS = 65536
+
+# Seconds before a scheduler command run by run() is killed. Set from the
+# "command_timeout" config.json value by JobDB.
+COMMAND_TIMEOUT = 60.0
+
+# Scheduler version for each "software" value, found by getversion() once per
+# process. JobDB seeds it from the config.json "version" value, so that
+# 'qstat --version' or 'squeue --version' is not run on every invocation.
+VERSION = dict()
+
+# Without subprocess32, run() starts commands through this exec wrapper, which
+# puts them in a new session and closes the inherited file descriptors.
+# preexec_fn is not safe to use from threads, and close_fds loops over every
+# possible fd (up to 'ulimit -n') rather than the open ones.
+_SETSID_EXEC = """import os, sys
+os.setsid()
+try:
+    fds = [int(fd) for fd in os.listdir('/proc/self/fd')]
+except OSError:
+    fds = range(3, os.sysconf('SC_OPEN_MAX'))
+for fd in fds:
+    if fd > 2:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+try:
+    os.execvp(sys.argv[1], sys.argv[1:])
+except OSError as e:
+    sys.stderr.write(sys.argv[1] + ': ' + e.strerror + '\\n')
+    os._exit(127)
+"""
 
 class PBSError(Exception):
     """ A custom error class for pbs errors """
@@ -19,17 +79,265 @@ class PBSError(Exception):
     def __str__(self):
         return self.jobid + ": " + self.msg
 
+def run(opt, jobid=None, timeout=None, stdin=None):
+    """Run the command 'opt' (a list), killing it if it takes longer than
+       'timeout' seconds (default COMMAND_TIMEOUT).
+
+       Returns (returncode, stdout), with stderr merged into stdout.
+       Raises PBSError(jobid, msg) if the command timed out.
+    """
+    if timeout is None:
+        timeout = COMMAND_TIMEOUT
+    # run in a new process group, so that any children of the command are
+    # killed with it and do not hold its output open, and without the fds of
+    # other commands started at the same time (see _SETSID_EXEC)
+    stdin_pipe = subprocess.PIPE if stdin is not None else None
+    if subprocess32 is not None:
+        p = subprocess32.Popen(opt, stdin=stdin_pipe, stdout=subprocess.PIPE,     #pylint: disable=invalid-name
+                               stderr=subprocess.STDOUT, close_fds=True, start_new_session=True)
+    else:
+        p = subprocess.Popen([sys.executable, "-S", "-c", _SETSID_EXEC] + list(opt),    #pylint: disable=invalid-name
+                             stdin=stdin_pipe, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    killed = []
+
+    def kill():
+        """Kill the command when the timer expires"""
+        killed.append(True)
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, kill)
+    timer.start()
+    try:
+        stdout, stderr = p.communicate(input=stdin)  #pylint: disable=unused-variable
+    finally:
+        timer.cancel()
+        timer.join()
+    if killed:
+        raise PBSError(str(jobid), "'" + " ".join(opt) + "' timed out after "
+                       + str(timeout) + " seconds")
+    return (p.returncode, stdout)
+
+def fan_out(func, args, concurrency=None):
+    """Call func(arg) for each arg in 'args' from at most 'concurrency'
+       threads at a time (default CONCURRENCY).
+
+       Returns the list of results, in the order of 'args'. If any calls
+       raised, all the other calls still complete, and then a PBSError
+       listing every failure is raised. Its 'failed' attribute is the list of
+       failed args, its 'errors' attribute the corresponding exceptions, and its
+       'results' attribute the list of results (None for failed calls).
+    """
+    if concurrency is None:
+        concurrency = CONCURRENCY
+    args = list(args)
+    results = [None]*len(args)
+    errors = []
+    todo = Queue.Queue()
+    for i in range(len(args)):
+        todo.put(i)
+
+    def worker():
+        """Run calls until there are none left"""
+        while True:
+            try:
+                i = todo.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(args[i])
+            except Exception as e:  #pylint: disable=broad-except, invalid-name
+                errors.append((i, e))
+
+    threads = [threading.Thread(target=worker) for _ in range(min(max(1, concurrency), len(args)))]
+    for t in threads:   #pylint: disable=invalid-name
+        t.daemon = True
+        t.start()
+    for t in threads:   #pylint: disable=invalid-name
+        t.join()
+
+    if errors:
+        errors.sort()
+        err = PBSError(", ".join([str(args[i]) for i, e in errors]),
+                       str(len(errors)) + " of " + str(len(args)) + " calls failed:\n"
+                       + "\n".join(["  " + str(args[i]) + ": " + (e.msg if isinstance(e, PBSError) else str(e))
+                                  for i, e in errors]))
+        # so that callers can keep the calls that succeeded
+        err.failed = [args[i] for i, e in errors]
+        err.errors = [e for i, e in errors]
+        err.results = results
+        raise err
+    return results
+
+def chunk_jobid(jobid, max_chars=None):
+    """Split the list 'jobid' into lists whose jobids have a total length,
+       including one separator each, of at most 'max_chars' (default ARGV_MAX_CHARS)"""
+    if max_chars is None:
+        max_chars = ARGV_MAX_CHARS
+    chunks = []
+    chunk = []
+    size = 0
+    for j in jobid:
+        if chunk and size + len(j) + 1 > max_chars:
+            chunks.append(chunk)
+            chunk = []
+            size = 0
+        chunk.append(j)
+        size += len(j) + 1
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+# words of scheduler output that may be a jobid, e.g. "123", "123[4]",
+# "123_4" or "123.host"
+_JOBID_FIELD_RE = re.compile(r"[^\s,;:='\"()]+")
+_HOST_SUFFIX_RE = re.compile(r"\.[A-Za-z][\w.-]*$")
+
+def run_batch(build, jobid):
+    """Run a scheduler command for many jobs, with as few calls as possible.
+
+       build: function returning the command (a list) for a list of jobids
+       jobid: list of jobid str
+
+       The jobids are split with chunk_jobid() and the commands for the chunks
+       are run with fan_out(). Output lines naming a jobid as a whole word
+       (with or without its ".host" suffix) are errors for that job. If a
+       command failed without naming any jobid, its output is an error for all
+       its jobs.
+
+       Returns a dict of jobid: error message, or None if there was no error.
+       Raises PBSError if a command could not be run or timed out; its
+       'failed' attribute is the list of jobids in those commands and its
+       'results' attribute the dict for the others.
+    """
+    def _run(chunk):
+        """Run one command and parse its output per jobid"""
+        returncode, stdout = run(build(chunk), jobid=",".join(chunk))
+        select = set(chunk)
+        errors = dict([(j, None) for j in chunk])
+        found = False
+        for line in stdout.splitlines():
+            named = set()
+            for field in _JOBID_FIELD_RE.findall(line):
+                field = field.rstrip(".")
+                # a ".host" suffix starts with a letter, unlike Slurm's "123.4" job steps
+                named.add(field if field in select else _HOST_SUFFIX_RE.sub("", field))
+            for j in named.intersection(select):
+                errors[j] = line if errors[j] is None else errors[j] + "\n" + line
+                found = True
+        if returncode != 0 and not found:
+            for j in chunk:
+                errors[j] = stdout.strip() or ("exit status " + str(returncode))
+        return errors
+
+    chunks = chunk_jobid(jobid)
+    result = dict()
+    try:
+        for errors in fan_out(_run, chunks):
+            result.update(errors)
+    except PBSError as e:   #pylint: disable=invalid-name
+        for errors in e.results:
+            if errors is not None:
+                result.update(errors)
+        failed = [j for chunk in e.failed for j in chunk]
+        err = PBSError(", ".join(failed), "\n".join([getattr(x, "msg", str(x)) for x in e.errors]))
+        err.failed = failed
+        err.results = result
+        raise err
+    return result
+
+class LockedJSON(object):
+    """Context manager loading the json file 'path' while holding an flock on
+       'path'.lock, shared unless 'write', in which case the (modified) data is
+       atomically written back on exit. 'default' is used if the file is missing
+       or unreadable. Used for the state of the fake and local backends.
+    """
+
+    def __init__(self, path, default, write=False):
+        self.path = path
+        self.default = default
+        self.write = write
+        self.lockfile = None
+        self.data = None
+
+    def __enter__(self):
+        self.lockfile = open(self.path + ".lock", "a")
+        fcntl.flock(self.lockfile, fcntl.LOCK_EX if self.write else fcntl.LOCK_SH)
+        try:
+            with open(self.path) as my_json:
+                self.data = json.load(my_json)
+        except (IOError, ValueError):
+            self.data = self.default
+        return self.data
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self.write and exc_type is None:
+                fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+                with os.fdopen(fd, "w") as my_json:
+                    json.dump(self.data, my_json)
+                os.rename(tmppath, self.path)
+        finally:
+            fcntl.flock(self.lockfile, fcntl.LOCK_UN)
+            self.lockfile.close()
+
+# Scheduler backends: "software" config.json value -> module. Unknown values
+# use "torque".
+BACKENDS = {"torque" : "pbs.misc_torque",
+            "slurm" : "pbs.misc_slurm",
+            "fake" : "pbs.misc_fake",
+            "local" : "pbs.misc_local"}
+
+# Functions every backend module must provide, with the signatures of
+# pbs.misc_torque. A backend may also provide configure(config), which is
+# called with the config.json dict when a JobDB is opened.
+BACKEND_INTERFACE = ("job_status", "submit", "delete", "hold", "release", "alter", "job_id")
+
+def register_backend(software, module):
+    """Use the module named 'module' as the backend for config.json "software" value 'software'"""
+    BACKENDS[software] = module
+
+def get_backend(software):
+    """Return the backend module for the "software" value 'software'.
+
+       Raises PBSError if the module does not provide BACKEND_INTERFACE.
+    """
+    module = importlib.import_module(BACKENDS.get(software, BACKENDS["torque"]))
+    missing = [f for f in BACKEND_INTERFACE if not hasattr(module, f)]
+    if missing:
+        raise PBSError(None, "Error in pbs.misc.get_backend(). Backend '" + module.__name__
+                       + "' is missing: " + ", ".join(missing))
+    return module
+
+def _memoize(func):
+    """Decorate a function of hashable arguments so that it is evaluated once
+       per set of arguments"""
+    memo = dict()
+    @functools.wraps(func)
+    def wrapper(*args):     #pylint: disable=missing-docstring
+        if args not in memo:
+            memo[args] = func(*args)
+        return memo[args]
+    return wrapper
+
+@_memoize
 def getsoftware():
-    """Tries to find qsub, then sbatch. Returns "torque" if qsub
+    """Returns the PBS_SOFTWARE environment variable if it is set (for
+    example "fake"). Else tries to find qsub, then sbatch. Returns "torque" if qsub
     is found, else returns "slurm" if sbatch is found, else returns
     "other" if neither is found. """
-    if find_executable("qsub") is not None:
+    if "PBS_SOFTWARE" in os.environ:
+        return os.environ["PBS_SOFTWARE"]
+    elif find_executable("qsub") is not None:
         return "torque"
     elif find_executable("sbatch") is not None:
         return "slurm"
     else:
         return "other"
 
+@_memoize
 def getlogin():
     """Returns os.getlogin(), else os.environ["LOGNAME"], else "?" """
     try:
@@ -39,11 +347,50 @@ def getlogin():
     else:
         return "?"
 
+@_memoize
+def gethostname():
+    """Returns socket.gethostname()"""
+    return socket.gethostname()
+
+def cluster_name(hostname):
+    """Return the cluster part of a login node 'hostname'.
+
+       The first "login" and any non-alphanumeric characters before it are
+       stripped, along with everything after it: "flux-login1.arc" -> "flux".
+       Returns 'hostname' unchanged if it does not contain "login".
+    """
+    m = re.search(r"(.*?)(?=[^a-zA-Z0-9]*login.*)", hostname)  #pylint: disable=invalid-name
+    if m:
+        return m.group(1)
+    return hostname
+
+def parse_jobid(jobid):
+    """Split a jobid string into its numeric id and array index.
+
+       Accepts plain ("123"), Torque ("123.host", "123[4].host") and Slurm
+       array ("123_4") forms. Returns (123, None) or (123, 4), or (None, None)
+       if 'jobid' is not in one of these forms.
+    """
+    m = re.match(r"\s*([0-9]+)(?:\[([0-9]*)\]|_([0-9]+))?(?:\..*)?\s*$", str(jobid)) #pylint: disable=invalid-name
+    if m is None:
+        return (None, None)
+    index = m.group(2) or m.group(3)
+    if index:
+        return (int(m.group(1)), int(index))
+    return (int(m.group(1)), None)
+
 def getversion(software=None):
-    """Returns the software version """
+    """Returns the software version, querying the scheduler once per process
+    unless it is in VERSION """
     if software is None:
         software = getsoftware()
-    if software is "torque":
+    if software not in VERSION:
+        VERSION[software] = _queryversion(software)
+    return VERSION[software]
+
+def _queryversion(software):
+    """Returns the software version reported by the scheduler """
+    if software == "torque":
         opt = ["qstat", "--version"]
 
         # call 'qstat' using subprocess
@@ -53,7 +400,7 @@ def getversion(software=None):
 
         # return the version number
         return sout.read().rstrip("\n").lower().lstrip("version: ")
-    elif software is "slurm":
+    elif software == "slurm":
         opt = ["squeue", "--version"]
 
         # call 'squeue' using subprocess
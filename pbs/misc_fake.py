@@ -0,0 +1,283 @@
+""" A fake scheduler backend, simulating a queue in a local state file
+
+Select it with "software": "fake" in config.json, and set the environment
+variable PBS_SOFTWARE=fake so that pbs.Job also submits to it. Submitted jobs are never
+run: each job is queued for QUEUE_TIME seconds, then running for RUN_TIME
+seconds, then complete, and is forgotten KEEP_COMPLETED seconds later, like
+Torque's keep_completed. Every command sleeps LATENCY seconds first, to
+mimic a loaded scheduler. Jobs submitted with a dependency are held until
+the jobs they depend on complete. This allows exercising JobDB.update(),
+continue_all() and pstat with many jobs without a cluster.
+
+config.json settings (see configure()):
+  "fake_state": state file (default "$PBS_FAKE_STATE", or "$HOME/.pbs/fake_scheduler.json")
+  "fake_latency", "fake_queue_time", "fake_run_time", "fake_keep_completed"
+"""
+
+import os
+import re
+import time
+import misc
+from misc import getlogin, seconds, PBSError
+
+STATE_PATH = os.environ.get("PBS_FAKE_STATE",
+                            os.path.join(os.environ.get("HOME", "."), ".pbs", "fake_scheduler.json"))
+LATENCY = 0.0
+QUEUE_TIME = 0.0
+RUN_TIME = 60.0
+KEEP_COMPLETED = 300.0
+
+# environment variable holding the array element index in a running job
+ARRAY_INDEX_VAR = "PBS_ARRAYID"
+
+def configure(config):
+    """Apply config.json settings"""
+    global STATE_PATH, LATENCY, QUEUE_TIME, RUN_TIME, KEEP_COMPLETED   #pylint: disable=global-statement
+    STATE_PATH = config.get("fake_state", STATE_PATH)
+    LATENCY = float(config.get("fake_latency", LATENCY))
+    QUEUE_TIME = float(config.get("fake_queue_time", QUEUE_TIME))
+    RUN_TIME = float(config.get("fake_run_time", RUN_TIME))
+    KEEP_COMPLETED = float(config.get("fake_keep_completed", KEEP_COMPLETED))
+
+class _State(misc.LockedJSON):
+    """Context manager holding the locked scheduler state, a dict
+       {"next_id": int, "jobs": {jobid: job dict}}, written back on exit if 'write'"""
+
+    def __init__(self, write=False):
+        super(_State, self).__init__(STATE_PATH, {"next_id" : 1, "jobs" : dict()}, write)
+
+    def __enter__(self):
+        time.sleep(LATENCY)
+        state = super(_State, self).__enter__()
+        _expire(state)
+        return state
+
+def _queuetimes(state):
+    """Return a dict {jobid: time the job is queued}: its submit time, or if it
+       depends on other jobs, the time the last of them completes. The time is
+       None if not known yet."""
+    times = dict()
+    for jobid in state["jobs"]:
+        # depth first, so that each job is visited once however many depend on it
+        stack = [jobid]
+        while stack:
+            j = stack[-1]
+            if j in times:
+                stack.pop()
+                continue
+            job = state["jobs"][j]
+            parents = [p for p in (job.get("depend") or [None])[1:] if p in state["jobs"]]
+            todo = [p for p in parents if p not in times]
+            if todo:
+                stack.extend(todo)
+                continue
+            stack.pop()
+            start = job["submittime"]
+            for p in parents:   #pylint: disable=invalid-name
+                done = _completiontime(state["jobs"][p], times[p])
+                if done is None:
+                    start = None
+                    break
+                start = max(start, done)
+            times[j] = start
+    return times
+
+def _jobstatus(job, start, now):
+    """Return the simulated job_state of 'job', queued at time 'start', at time 'now'"""
+    if job["deleted"] is not None:
+        return "C"
+    if job["held"] or start is None or now < start:
+        return "H"
+    age = now - start
+    if age < QUEUE_TIME:
+        return "Q"
+    elif age < QUEUE_TIME + RUN_TIME:
+        return "R"
+    return "C"
+
+def _completiontime(job, start):
+    """Return the simulated completion time of 'job', queued at time 'start',
+       or None if not known yet"""
+    if job["deleted"] is not None:
+        return job["deleted"]
+    if job["held"] or start is None:
+        return None
+    return start + QUEUE_TIME + RUN_TIME
+
+def _expire(state):
+    """Forget jobs completed more than KEEP_COMPLETED seconds ago"""
+    now = time.time()
+    times = _queuetimes(state)
+    done = [j for j, job in state["jobs"].iteritems()
+            if _jobstatus(job, times[j], now) == "C"
+            and now - _completiontime(job, times[j]) > KEEP_COMPLETED]
+    for jobid in done:
+        del state["jobs"][jobid]
+
+def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
+    """If 'name' given, returns a list of all jobs with a particular name.
+       Else, if all=True, returns a list of all job ids.
+       Else, returns this job id from environment variable PBS_JOBID (split to get just the number).
+
+       Else, returns None
+    """
+    if all or name is not None:
+        with _State() as state:
+            return sorted([j for j, job in state["jobs"].iteritems()
+                           if name is None or job["jobname"] == name])
+    elif 'PBS_JOBID' in os.environ:
+        return os.environ['PBS_JOBID'].split(".")[0]
+    return None
+
+def job_status(jobid=None):
+    """Return job status, as pbs.misc_torque.job_status()
+
+       'jobid' is a jobid or a list of jobids, all jobs if None.
+    """
+    if jobid is not None and not isinstance(jobid, list):
+        jobid = [jobid]
+    now = time.time()
+    status = dict()
+    with _State() as state:
+        times = _queuetimes(state)
+        for j in (jobid if jobid is not None else state["jobs"].keys()):
+            if j not in state["jobs"]:
+                continue
+            job = state["jobs"][j]
+            jobstatus = _jobstatus(job, times[j], now)
+            starttime = None
+            if jobstatus in ("R", "C") and times[j] is not None:
+                start = times[j] + QUEUE_TIME
+                if job["deleted"] is None or job["deleted"] > start:
+                    starttime = int(start)
+            status[j] = {"jobid" : j,
+                         "jobname" : job["jobname"],
+                         "nodes" : job["nodes"],
+                         "procs" : job["procs"],
+                         "walltime" : job["walltime"],
+                         "jobstatus" : jobstatus,
+                         "qstatstr" : "Job Id: " + j + "\n    job_state = " + jobstatus + "\n",
+                         "starttime" : starttime,
+                         "elapsedtime" : (int(now) - starttime if jobstatus == "R" else None),
+                         "completiontime" : (int(_completiontime(job, times[j]))
+                                             if jobstatus == "C" else None)}
+    return status
+
+def submit(substr, cwd=None):     #pylint: disable=unused-argument
+    """Submit a job to the fake scheduler. Accepts Torque scripts, including
+       '#PBS -t' arrays, and returns the jobid ("123", or "123[]" for arrays).
+       Jobs do not run, so 'cwd' (the directory to submit from) is not used."""
+    m = re.search(r"-N\s+(.*)\s", substr)       #pylint: disable=invalid-name
+    if not m:
+        raise PBSError(
+            None,
+            r"Error in pbs.misc_fake.submit(). Jobname (\"-N\s+(.*)\s\") not found in submit string.")
+    jobname = m.group(1)
+
+    nodes, procs, walltime = None, None, None
+    m = re.search(r"nodes=([0-9]+):ppn=([0-9]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        nodes, procs = int(m.group(1)), int(m.group(1))*int(m.group(2))
+    m = re.search(r"walltime=([0-9:]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        walltime = int(seconds(m.group(1)))
+
+    indices = [None]
+    m = re.search(r"#PBS\s+-t\s+([0-9]+)-([0-9]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        indices = range(int(m.group(1)), int(m.group(2)) + 1)
+
+    depend = None
+    m = re.search(r"#PBS\s+-W\s+depend=(\w+):(\S+)", substr)       #pylint: disable=invalid-name
+    if m:
+        depend = [m.group(1)] + m.group(2).split(":")
+
+    with _State(write=True) as state:
+        jobid = str(state["next_id"])
+        state["next_id"] += 1
+        for i in indices:
+            j = jobid if i is None else array_jobid(jobid, i)
+            state["jobs"][j] = {"jobname" : jobname, "owner" : getlogin(), "nodes" : nodes,
+                                "procs" : procs, "walltime" : walltime,
+                                "submittime" : time.time(), "held" : False, "deleted" : None,
+                                "depend" : depend}
+    return jobid if indices == [None] else jobid + "[]"
+
+def _modify_many(jobid, action):
+    """Apply 'action' to each job in the list 'jobid' in the state.
+
+       Returns a dict of jobid: error message, or None if there was no error.
+    """
+    errors = dict()
+    with _State(write=True) as state:
+        for j in jobid:
+            if j in state["jobs"]:
+                action(state["jobs"][j])
+                errors[j] = None
+            else:
+                errors[j] = "qdel: Unknown Job Id " + j
+    return errors
+
+def _delete(job):
+    """Delete a job: it completes now"""
+    if job["deleted"] is None:
+        job["deleted"] = time.time()
+
+def _hold(job):
+    """Hold a job"""
+    job["held"] = True
+
+def _release(job):
+    """Release a held job; it is queued again from now"""
+    if job["held"]:
+        job["held"] = False
+        job["submittime"] = time.time()
+
+def delete_many(jobid):
+    """Delete a list of jobs. Returns a dict of jobid: error message or None"""
+    return _modify_many(jobid, _delete)
+
+def hold_many(jobid):
+    """Hold a list of jobs, see delete_many()"""
+    return _modify_many(jobid, _hold)
+
+def release_many(jobid):
+    """Release a list of jobs, see delete_many()"""
+    return _modify_many(jobid, _release)
+
+def alter_many(jobid, arg):     #pylint: disable=unused-argument
+    """Alter a list of jobs, see delete_many(). 'arg' is ignored."""
+    return _modify_many(jobid, lambda job: None)
+
+def delete(jobid):
+    """Delete a job. Returns 0 on success, 1 if the job is unknown."""
+    return 0 if delete_many([jobid])[jobid] is None else 1
+
+def hold(jobid):
+    """Hold a job, see delete()"""
+    return 0 if hold_many([jobid])[jobid] is None else 1
+
+def release(jobid):
+    """Release a job, see delete()"""
+    return 0 if release_many([jobid])[jobid] is None else 1
+
+def alter(jobid, arg):
+    """Alter a job, see delete(). 'arg' is ignored."""
+    return 0 if alter_many([jobid], arg)[jobid] is None else 1
+
+def array_jobid(jobid, index):
+    """Return the jobid of element 'index' of the array job 'jobid' returned by
+       submit(): "123[]" -> "123[4]" """
+    return jobid.split("[")[0] + "[" + str(index) + "]"
+
+def dependency_directive(jobid, kind="afterany"):
+    """Return the submit script line making a job wait for job 'jobid' (or each
+       job in the list 'jobid') to end. Simulated jobs always succeed, so 'kind' "afterok" acts as "afterany"."""
+    if isinstance(jobid, list):
+        jobid = ":".join(jobid)
+    return "#PBS -W depend={0}:{1}\n".format(kind, jobid)
+
+def array_directive(indices):
+    """Return the submit script line requesting array elements 'indices' (a
+       string such as "0-9")"""
+    return "#PBS -t {0}\n".format(indices)
@@ -0,0 +1,406 @@
+""" Misc functions for running jobs on the local machine, without a scheduler
+
+Select it with "software": "local" in config.json, and set the environment
+variable PBS_SOFTWARE=local so that pbs.Job also submits to it.
+
+Submitted scripts (Torque style, as written by pbs.Job) are queued in a
+state file and run with bash, oldest first, as long as the sum of
+nodes*ppn of the running jobs fits in CORES. There is no daemon: each job
+is watched by a detached runner process, which records its completion and
+starts the queued jobs that now fit. Jobs submitted with a dependency
+('#PBS -W depend=afterany:<jobid>[:<jobid>...]', or afterok) wait for
+those jobs. Like Torque, output goes to 'jobname.o<jobid>' in the submit
+directory, the environment provides PBS_JOBID, PBS_O_WORKDIR and, for
+array jobs, PBS_ARRAYID, and jobs deleted or over their walltime get
+SIGTERM, then SIGKILL KILL_DELAY seconds later.
+
+config.json settings (see configure()):
+  "local_cores": core budget (default: number of cores)
+  "local_dir": state and script directory (default "$HOME/.pbs/local")
+  "local_keep_completed": seconds completed jobs are reported (default 300)
+  "local_kill_delay": seconds between SIGTERM and SIGKILL (default 2)
+"""
+
+import os
+import re
+import sys
+import time
+import errno
+import signal
+import threading
+import subprocess
+import multiprocessing
+import misc
+from misc import getlogin, seconds, PBSError
+
+CORES = multiprocessing.cpu_count()
+LOCAL_DIR = os.path.join(os.environ.get("HOME", "."), ".pbs", "local")
+KEEP_COMPLETED = 300.0
+KILL_DELAY = 2.0
+
+# environment variable holding the array element index in a running job
+ARRAY_INDEX_VAR = "PBS_ARRAYID"
+
+def configure(config):
+    """Apply config.json settings"""
+    global CORES, LOCAL_DIR, KEEP_COMPLETED, KILL_DELAY   #pylint: disable=global-statement
+    CORES = int(config.get("local_cores", CORES))
+    LOCAL_DIR = config.get("local_dir", LOCAL_DIR)
+    KEEP_COMPLETED = float(config.get("local_keep_completed", KEEP_COMPLETED))
+    KILL_DELAY = float(config.get("local_kill_delay", KILL_DELAY))
+
+class _State(misc.LockedJSON):
+    """Context manager holding the locked pool state, a dict
+       {"next_id": int, "jobs": {jobid: job dict}}, written back on exit if 'write'.
+
+       Each job dict contains: jobname, owner, nodes, procs, walltime, workdir,
+       script, arrayid, jobstatus ("Q", "H", "R" or "C"), submittime,
+       starttime, completiontime, exit_status, runner (pid of the runner
+       process), pgid (process group of the running script) and depend
+       ([kind, jobid, ...] of a dependency, or None).
+    """
+
+    def __init__(self, write=False):
+        if not os.path.isdir(LOCAL_DIR):
+            os.makedirs(LOCAL_DIR)
+        super(_State, self).__init__(os.path.join(LOCAL_DIR, "state.json"),
+                                     {"next_id" : 1, "jobs" : dict()}, write)
+
+    def __enter__(self):
+        state = super(_State, self).__enter__()
+        _check_runners(state)
+        return state
+
+def _alive(pid):
+    """Return True if process 'pid' exists"""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:    #pylint: disable=invalid-name
+        return e.errno != errno.ESRCH
+    return True
+
+def _complete(job, exit_status):
+    """Mark 'job' completed now"""
+    job["jobstatus"] = "C"
+    job["completiontime"] = int(time.time())
+    job["exit_status"] = exit_status
+
+def _check_runners(state):
+    """Mark completed the running jobs whose runner died (for example on reboot),
+       and forget jobs completed more than KEEP_COMPLETED seconds ago"""
+    now = time.time()
+    for jobid in list(state["jobs"]):
+        job = state["jobs"][jobid]
+        if job["jobstatus"] == "R" and job["runner"] is not None and not _alive(job["runner"]):
+            _complete(job, None)
+        elif job["jobstatus"] == "C" and now - job["completiontime"] > KEEP_COMPLETED:
+            del state["jobs"][jobid]
+
+def _schedule(state):
+    """Start the queued jobs, oldest first, while they fit in the core budget.
+       A job larger than the budget runs when nothing else is running."""
+    running = [job for job in state["jobs"].values() if job["jobstatus"] == "R"]
+    used = sum([job["procs"] for job in running])
+    queued = sorted([(job["submittime"], _jobid_key(j), j) for j, job in state["jobs"].iteritems()
+                     if job["jobstatus"] == "Q"])
+    for _, _, jobid in queued:
+        job = state["jobs"][jobid]
+        if job.get("depend") is not None:
+            parents = [state["jobs"][j] for j in job["depend"][1:] if j in state["jobs"]]
+            if [p for p in parents if p["jobstatus"] != "C"]:
+                continue
+            if job["depend"][0] == "afterok" and [p for p in parents if p["exit_status"] != 0]:
+                _complete(job, None)
+                continue
+        if used + job["procs"] > CORES and used > 0:
+            break
+        used += job["procs"]
+        job["jobstatus"] = "R"
+        job["starttime"] = int(time.time())
+        job["runner"] = None
+        _start(jobid, job)
+
+def _jobid_key(jobid):
+    """Sort key of 'jobid', so that "2[10]" follows "2[9]" """
+    return [int(x) for x in re.findall(r"[0-9]+", jobid)]
+
+def _start(jobid, job):
+    """Fork a detached runner process for 'job'"""
+    pid = os.fork()
+    if pid == 0:
+        # double fork, so the runner is not left a zombie of the submitting process
+        try:
+            if os.fork() == 0:
+                _runner(jobid, job)
+        finally:
+            os._exit(0) #pylint: disable=protected-access
+    os.waitpid(pid, 0)
+
+def _runner(jobid, job):
+    """Run 'job' in its own process group, and record its completion"""
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):    #pylint: disable=invalid-name
+            os.dup2(devnull, fd)
+        os.closerange(3, subprocess.MAXFD)
+
+        env = dict(os.environ)
+        env["PBS_JOBID"] = jobid
+        env["PBS_JOBNAME"] = job["jobname"]
+        env["PBS_O_WORKDIR"] = job["workdir"]
+        if job["arrayid"] is not None:
+            env[ARRAY_INDEX_VAR] = str(job["arrayid"])
+        output = os.path.join(job["workdir"], job["jobname"] + ".o" + jobid)
+        with open(output, "w") as stdout:
+            proc = subprocess.Popen(["bash", job["script"]], cwd=job["workdir"], env=env,
+                                    stdin=open(os.devnull), stdout=stdout,
+                                    stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+
+        # SIGTERM from _delete(), or the walltime timer, terminate the job
+        killer = []
+        def _terminate(signum=None, frame=None):     #pylint: disable=unused-argument
+            """Send SIGTERM to the job, and SIGKILL KILL_DELAY seconds later"""
+            if not killer:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                killer.append(threading.Timer(KILL_DELAY, _kill, [proc.pid]))
+                killer[0].start()
+        signal.signal(signal.SIGTERM, _terminate)
+
+        with _State(write=True) as state:
+            if jobid not in state["jobs"] or state["jobs"][jobid]["jobstatus"] != "R":
+                # deleted before it started
+                os.killpg(proc.pid, signal.SIGKILL)
+            else:
+                state["jobs"][jobid]["runner"] = os.getpid()
+                state["jobs"][jobid]["pgid"] = proc.pid
+
+        timer = None
+        if job["walltime"] is not None:
+            timer = threading.Timer(job["walltime"], _terminate)
+            timer.start()
+        exit_status = proc.wait()
+        if timer is not None:
+            timer.cancel()
+        if killer:
+            # also kill what is left of the job once it exited
+            killer[0].join()
+
+        with _State(write=True) as state:
+            if jobid in state["jobs"] and state["jobs"][jobid]["jobstatus"] == "R":
+                _complete(state["jobs"][jobid], exit_status)
+            _schedule(state)
+    except Exception:   #pylint: disable=broad-except
+        # nothing can be reported from a detached process; _check_runners()
+        # marks the job completed once this runner is gone
+        pass
+    os._exit(0) #pylint: disable=protected-access
+
+def _kill(pgid):
+    """Kill the process group 'pgid', ignoring it if already gone"""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        pass
+
+def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
+    """If 'name' given, returns a list of all jobs with a particular name.
+       Else, if all=True, returns a list of all job ids.
+       Else, returns this job id from environment variable PBS_JOBID (split to get just the number).
+
+       Else, returns None
+    """
+    if all or name is not None:
+        with _State() as state:
+            return sorted([j for j, job in state["jobs"].iteritems()
+                           if name is None or job["jobname"] == name])
+    elif 'PBS_JOBID' in os.environ:
+        return os.environ['PBS_JOBID'].split(".")[0]
+    return None
+
+def job_rundir(jobid):
+    """Return the directory job "id" was run in using the local state file.
+
+       Returns a dict, with keys jobid and values rundir
+    """
+    if not isinstance(jobid, list):
+        jobid = [jobid]
+    with _State() as state:
+        return dict([(j, state["jobs"][j]["workdir"]) for j in jobid if j in state["jobs"]])
+
+def job_status(jobid=None):
+    """Return job status, as pbs.misc_torque.job_status()
+
+       'jobid' is a jobid or a list of jobids, all jobs if None.
+    """
+    if jobid is not None and not isinstance(jobid, list):
+        jobid = [jobid]
+    now = int(time.time())
+    status = dict()
+    with _State() as state:
+        for j in (jobid if jobid is not None else state["jobs"].keys()):
+            if j not in state["jobs"]:
+                continue
+            job = state["jobs"][j]
+            status[j] = {"jobid" : j,
+                         "jobname" : job["jobname"],
+                         "nodes" : job["nodes"],
+                         "procs" : job["procs"],
+                         "walltime" : job["walltime"],
+                         "jobstatus" : job["jobstatus"],
+                         "qstatstr" : ("Job Id: " + j + "\n    job_state = " + job["jobstatus"]
+                                       + "\n    exit_status = " + str(job["exit_status"]) + "\n"),
+                         "starttime" : job["starttime"],
+                         "elapsedtime" : (now - job["starttime"] if job["jobstatus"] == "R"
+                                          else None),
+                         "completiontime" : job["completiontime"]}
+    return status
+
+def submit(substr, cwd=None):
+    """Queue a job on the local machine, and start it if cores are available.
+       Accepts Torque scripts, including '#PBS -t' arrays, and returns the
+       jobid ("123", or "123[]" for arrays). The job runs in 'cwd' (default:
+       the current directory)."""
+    m = re.search(r"-N\s+(.*)\s", substr)       #pylint: disable=invalid-name
+    if not m:
+        raise PBSError(
+            None,
+            r"Error in pbs.misc_local.submit(). Jobname (\"-N\s+(.*)\s\") not found in submit string.")
+    jobname = m.group(1)
+    workdir = os.path.abspath(cwd or ".")
+    if not os.path.isdir(workdir):
+        raise PBSError(None, "Error in pbs.misc_local.submit(). No such directory: '"
+                       + workdir + "'")
+
+    nodes, procs, walltime = 1, 1, None
+    m = re.search(r"nodes=([0-9]+):ppn=([0-9]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        nodes, procs = int(m.group(1)), int(m.group(1))*int(m.group(2))
+    m = re.search(r"walltime=([0-9:]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        walltime = int(seconds(m.group(1)))
+
+    indices = [None]
+    m = re.search(r"#PBS\s+-t\s+([0-9]+)-([0-9]+)", substr)       #pylint: disable=invalid-name
+    if m:
+        indices = range(int(m.group(1)), int(m.group(2)) + 1)
+
+    depend = None
+    m = re.search(r"#PBS\s+-W\s+depend=(\w+):(\S+)", substr)       #pylint: disable=invalid-name
+    if m:
+        depend = [m.group(1)] + m.group(2).split(":")
+
+    sys.stdout.flush()
+    with _State(write=True) as state:
+        jobid = str(state["next_id"])
+        state["next_id"] += 1
+        script = os.path.join(LOCAL_DIR, jobid + ".sh")
+        with open(script, "w") as f:    #pylint: disable=invalid-name
+            f.write(substr)
+        for i in indices:
+            j = jobid if i is None else array_jobid(jobid, i)
+            state["jobs"][j] = {"jobname" : jobname, "owner" : getlogin(), "nodes" : nodes,
+                                "procs" : procs, "walltime" : walltime, "workdir" : workdir,
+                                "script" : script, "arrayid" : i, "jobstatus" : "Q",
+                                "submittime" : time.time(), "starttime" : None,
+                                "completiontime" : None, "exit_status" : None,
+                                "runner" : None, "pgid" : None, "depend" : depend}
+        _schedule(state)
+    return jobid if indices == [None] else jobid + "[]"
+
+def _modify_many(jobid, action):
+    """Apply 'action' to each job in the list 'jobid' in the state, then start
+       queued jobs that fit.
+
+       Returns a dict of jobid: error message, or None if there was no error.
+    """
+    errors = dict()
+    sys.stdout.flush()
+    with _State(write=True) as state:
+        for j in jobid:
+            if j in state["jobs"]:
+                errors[j] = action(state["jobs"][j])
+            else:
+                errors[j] = "Unknown Job Id " + j
+        _schedule(state)
+    return errors
+
+def _delete(job):
+    """Delete a job: terminate it if running (see _runner()), and mark it completed"""
+    if job["jobstatus"] == "C":
+        return "Request invalid for state of job"
+    if job["jobstatus"] == "R" and job["runner"] is not None:
+        try:
+            os.kill(job["runner"], signal.SIGTERM)
+        except OSError:
+            _kill(job["pgid"])
+    elif job["jobstatus"] == "R" and job["pgid"] is not None:
+        _kill(job["pgid"])
+    _complete(job, None)
+    return None
+
+def _hold(job):
+    """Hold a queued job"""
+    if job["jobstatus"] not in ("Q", "H"):
+        return "Request invalid for state of job"
+    job["jobstatus"] = "H"
+    return None
+
+def _release(job):
+    """Release a held job"""
+    if job["jobstatus"] == "H":
+        job["jobstatus"] = "Q"
+    return None
+
+def delete_many(jobid):
+    """Delete a list of jobs. Returns a dict of jobid: error message or None"""
+    return _modify_many(jobid, _delete)
+
+def hold_many(jobid):
+    """Hold a list of jobs, see delete_many()"""
+    return _modify_many(jobid, _hold)
+
+def release_many(jobid):
+    """Release a list of jobs, see delete_many()"""
+    return _modify_many(jobid, _release)
+
+def alter_many(jobid, arg):     #pylint: disable=unused-argument
+    """Alter a list of jobs, see delete_many(). Not supported locally: 'arg' is ignored."""
+    return _modify_many(jobid, lambda job: None)
+
+def delete(jobid):
+    """Delete a job. Returns 0 on success, 1 on error."""
+    return 0 if delete_many([jobid])[jobid] is None else 1
+
+def hold(jobid):
+    """Hold a job, see delete()"""
+    return 0 if hold_many([jobid])[jobid] is None else 1
+
+def release(jobid):
+    """Release a job, see delete()"""
+    return 0 if release_many([jobid])[jobid] is None else 1
+
+def alter(jobid, arg):
+    """Alter a job, see delete(). 'arg' is ignored."""
+    return 0 if alter_many([jobid], arg)[jobid] is None else 1
+
+def array_jobid(jobid, index):
+    """Return the jobid of element 'index' of the array job 'jobid' returned by
+       submit(): "123[]" -> "123[4]" """
+    return jobid.split("[")[0] + "[" + str(index) + "]"
+
+def dependency_directive(jobid, kind="afterany"):
+    """Return the submit script line making a job wait for job 'jobid' (or each
+       job in the list 'jobid') to end ('kind' "afterany") or to end with exit status 0 ("afterok"; if it does
+       not, the waiting job is completed without running)"""
+    if isinstance(jobid, list):
+        jobid = ":".join(jobid)
+    return "#PBS -W depend={0}:{1}\n".format(kind, jobid)
+
+def array_directive(indices):
+    """Return the submit script line requesting array elements 'indices' (a
+       string such as "0-9")"""
+    return "#PBS -t {0}\n".format(indices)
@@ -12,9 +12,100 @@ import time
 # import sys
 
 ### Internal ###
-from pbs.misc import getversion, getlogin, seconds, PBSError
-
-def _squeue(jobid=None, username=getlogin(), full=False, version=getversion(), sformat=None):    #pylint: disable=unused-argument
+from pbs.misc import getversion, getlogin, seconds, cluster_name, run, run_batch, PBSError
+
+# JobDB.update() passes any number of jobids to one job_status() call: one
+# 'scontrol show job -o' call lists every job, and is filtered here
+POLL_CHUNK_SIZE = None
+
+# Maximum number of elements in one array job submitted by pbs.submit_array().
+# Slurm refuses array indices from MaxArraySize on (1001 by default). Set from
+# the "max_array_size" config.json value by configure().
+MAX_ARRAY_SIZE = 1000
+
+def configure(config):
+    """Apply config.json settings: "max_array_size" sets MAX_ARRAY_SIZE"""
+    global MAX_ARRAY_SIZE   #pylint: disable=global-statement
+    MAX_ARRAY_SIZE = int(config.get("max_array_size", MAX_ARRAY_SIZE))
+
+# 'scontrol show job -o' prints one "Key=Value Key=Value ..." record per line.
+# A value extends up to the next " Key=", whether or not the key is known, so
+# keys added by newer Slurm versions do not end up in other values. The free
+# text values of _FREE_TEXT_KEYS may contain spaces and "=" ("scan T=300 K"),
+# so they extend up to the next " Key=" of a known scontrol key in _KEYS.
+_KEYS = ("JobId", "ArrayJobId", "ArrayTaskId", "ArrayTaskThrottle", "HetJobId", "HetJobOffset",
+         "HetJobIdSet", "JobName", "Name", "UserId", "GroupId", "MCS_label", "Priority", "Nice",
+         "Account", "QOS", "WCKey", "JobState", "Reason", "FailedNode", "Dependency", "Requeue",
+         "Restarts", "BatchFlag", "Reboot", "ExitCode", "DerivedExitCode", "RunTime", "TimeLimit",
+         "TimeMin", "SubmitTime", "EligibleTime", "AccrueTime", "ResizeTime", "StartTime", "EndTime",
+         "Deadline", "PreemptEligibleTime", "PreemptTime", "SuspendTime", "SecsPreSuspend",
+         "LastSchedEval", "Scheduler", "Partition", "AllocNode:Sid", "ReqNodeList", "ExcNodeList",
+         "NodeList", "SchedNodeList", "BatchHost", "NumNodes", "NumCPUs", "NumTasks", "CPUs/Task",
+         "ReqB:S:C:T", "ReqTRES", "AllocTRES", "TRES", "Socks/Node", "NtasksPerN:B:S:C", "CoreSpec",
+         "ThreadSpec", "MinCPUsNode", "MinMemoryNode", "MinMemoryCPU", "MinTmpDiskNode", "Features",
+         "ClusterFeatures", "Prefer", "DelayBoot", "Reservation", "OverSubscribe", "Shared",
+         "Contiguous", "Licenses", "LicensesAlloc", "Network", "Command", "WorkDir", "AdminComment",
+         "SystemComment", "Comment", "StdErr", "StdIn", "StdOut", "Switches", "Wait-for-Switch",
+         "BurstBuffer", "BurstBufferState", "CpuFreqMin", "CpuFreqMax", "CpuFreqGov", "Power",
+         "Gres", "TresPerJob", "TresPerNode", "TresPerSocket", "TresPerTask", "CpusPerTres",
+         "MemPerTres", "TresBind", "TresFreq", "MailUser", "MailType", "NtasksPerTRES",
+         "KillOInInvalidDependent", "Container", "ContainerID", "SiblingsActive", "SiblingsViable",
+         "Cluster", "ResvPort", "CronJob", "CrontabSpec")
+_FREE_TEXT_KEYS = ("JobName", "Name", "Command", "WorkDir", "StdErr", "StdIn", "StdOut",
+                   "Comment", "AdminComment", "SystemComment")
+_KEY = r"[A-Za-z][\w:/-]*"
+_FIELD_RE = re.compile(r"(?:(" + "|".join(_FREE_TEXT_KEYS) + r")=(.*?)(?=\s+(?:"
+                       + "|".join([re.escape(k) for k in _KEYS]) + r")=|\s*$)"
+                       + r"|(" + _KEY + r")=(.*?)(?=\s+" + _KEY + r"=|\s*$))")
+_JOBID_RE = re.compile(r"^JobId=(\S+)")
+_USERID_RE = re.compile(r"\sUserId=([^(\s]+)")
+_TIME_RE = re.compile(r"^(?:([0-9]+)-)?(?:([0-9]+):)?([0-9]+):([0-9]+)$")
+
+# JobState -> jobstatus
+_JOBSTATE = {"RUNNING": "R", "CONFIGURING": "R",
+             "BOOT_FAIL": "C", "FAILED": "C", "NODE_FAIL": "C", "CANCELLED": "C",
+             "COMPLETED": "C", "PREEMPTED": "C", "TIMEOUT": "C",
+             "COMPLETING": "E", "STOPPED": "E",
+             "PENDING": "Q", "SPECIAL_EXIT": "Q",
+             "SUSPENDED": "S"}
+
+def _array_tasks(spec):
+    """Expand an ArrayTaskId value such as "3", "3-9", "1,3,5-7" or "0-99%10"
+       into a list of index strings"""
+    tasks = []
+    for part in spec.split("%")[0].split(","):
+        m = re.match(r"([0-9]+)(?:-([0-9]+)(?::([0-9]+))?)?$", part)    #pylint: disable=invalid-name
+        if not m:
+            continue
+        if m.group(2) is None:
+            tasks.append(m.group(1))
+        else:
+            tasks += [str(i) for i in range(int(m.group(1)), int(m.group(2)) + 1,
+                                            int(m.group(3) or 1))]
+    return tasks
+
+def _record_ids(fields):
+    """Return the jobids of one 'scontrol show job -o' record: its JobId, or
+       "ArrayJobId_ArrayTaskId" for each element of an array job record (pending
+       elements are listed in one record, e.g. "ArrayTaskId=3-9")"""
+    if "ArrayJobId" in fields and "ArrayTaskId" in fields:
+        return [fields["ArrayJobId"] + "_" + i for i in _array_tasks(fields["ArrayTaskId"])]
+    return [fields["JobId"]]
+
+def _fields(line):
+    """Return a dict of the Key=Value fields of one 'scontrol show job -o' record"""
+    return dict([(m[0], m[1]) if m[0] else (m[2], m[3]) for m in _FIELD_RE.findall(line)])
+
+def _seconds(value):
+    """Convert a Slurm [DD-[HH:]]MM:SS time to int seconds, or None if not a time
+       (e.g. "UNLIMITED", "Unknown")"""
+    m = _TIME_RE.match(value)    #pylint: disable=invalid-name
+    if not m:
+        return None
+    days, hrs, mns, scs = [int(x) if x else 0 for x in m.groups()]
+    return ((days*24 + hrs)*60 + mns)*60 + scs
+
+def _squeue(jobid=None, username=None, full=False, version=None, sformat=None):    #pylint: disable=unused-argument
     """Return the stdout of squeue minus the header lines.
 
        By default, 'username' is set to the current user.
@@ -26,54 +117,36 @@ def _squeue(jobid=None, username=getlogin(), full=False, version=getversion(), s
 
        Returns the text of squeue, minus the header lines
     """
+    if username is None:
+        username = getlogin()
 
-    # If Full is true, we need to use scontrol:
+    # If Full is true, we need to use scontrol. All records are requested with
+    # one call, one record per line ('-o'), and filtered here
     if full is True:
-        if jobid is None:
-            if username is None:
-                # Clearly we want ALL THE JOBS
-                sopt = ["scontrol", "show", "job"]
-
-                # Submit the command
-                p = subprocess.Popen(sopt, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
-                stdout, stderr = p.communicate()        #pylint: disable=unused-variable
-
-                sout = StringIO.StringIO(stdout)
-
-                # Nothing to strip, as scontrol provides no headers
-                return sout.read()
-
-            else:
-                # First, get jobids that belong to that username using
-                # squeue (-h strips the header)
-                sopt = ["squeue", "-h", "-u", username]
+        sopt = ["scontrol", "show", "job", "-o"]
+        if jobid is not None and not isinstance(jobid, list):
+            sopt += [str(jobid)]
 
-                q = subprocess.Popen(sopt, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
-                stdout, stderr = q.communicate()    #pylint: disable=unused-variable
+        p = subprocess.Popen(sopt, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
+        stdout, stderr = p.communicate()        #pylint: disable=unused-variable
 
-                qsout = StringIO.StringIO(stdout)
-
-                # Get the jobids
-                jobid = []
-                for line in qsout:
-                    jobid += [line.rstrip("\n")]
-                # Great, now we have some jobids to pass along
-
-        # Ensure the jobids are a list, even if they're a list of 1...
-        if not isinstance(jobid, list) and jobid is not None:
-            jobid = [jobid]
+        sreturn = []
         if isinstance(jobid, list):
-            opt = ["scontrol", "show", "job"]
-            sreturn = ""
-            for my_id in jobid:
-                sopt = opt + [str(my_id)]
-
-                q = subprocess.Popen(sopt, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
-                stdout, stderr = q.communicate()    #pylint: disable=unused-variable
-
-                sreturn = sreturn + stdout + "\n"
-
-            return sreturn
+            # array elements are selected by "123_4" or by the array's "123"
+            select = set([str(i) for i in jobid])
+            for line in StringIO.StringIO(stdout):
+                m = _JOBID_RE.search(line)  #pylint: disable=invalid-name
+                if m and (m.group(1) in select or "ArrayTaskId=" in line and
+                          select.intersection(_record_ids(_fields(line)))):
+                    sreturn.append(line)
+        elif jobid is None and username is not None:
+            for line in StringIO.StringIO(stdout):
+                m = _USERID_RE.search(line)  #pylint: disable=invalid-name
+                if m and m.group(1) == username:
+                    sreturn.append(line)
+        else:
+            return stdout
+        return "".join(sreturn)
 
     else:
         sopt = ["squeue", "-h"]
@@ -104,7 +177,8 @@ def _squeue(jobid=None, username=getlogin(), full=False, version=getversion(), s
 def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
     """If 'name' given, returns a list of all jobs with a particular name using squeue.
        Else, if all=True, returns a list of all job ids by current user.
-       Else, returns this job id from environment variable PBS_JOBID (split to get just the number).
+       Else, returns this job id from environment variable SLURM_JOBID (split to get just the number),
+        or "<SLURM_ARRAY_JOB_ID>_<SLURM_ARRAY_TASK_ID>" in an array job element.
 
        Else, returns None
 
@@ -121,7 +195,9 @@ def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
                 jobid.append((line.split()[0]).split(".")[0])
         return jobid
     else:
-        if 'SLURM_JOBID' in os.environ:
+        if 'SLURM_ARRAY_JOB_ID' in os.environ and 'SLURM_ARRAY_TASK_ID' in os.environ:
+            return os.environ['SLURM_ARRAY_JOB_ID'] + "_" + os.environ['SLURM_ARRAY_TASK_ID']
+        elif 'SLURM_JOBID' in os.environ:
             return os.environ['SLURM_JOBID'].split(".")[0]
         else:
             return None
@@ -131,31 +207,25 @@ def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
             #    + str(os.environ))
 
 def job_rundir(jobid):
-    """Return the directory job "id" was run in using squeue.
+    """Return the directory job "id" was run in using scontrol.
 
        Returns a dict, with id as key and rundir and value.
     """
     rundir = dict()
-
-    if isinstance(jobid, (list)):
-        for i in jobid:
-            stdout = _squeue(jobid=i, full=True)
-            match = re.search("WorkDir=(.*),", stdout)
-            rundir[i] = match.group(1)
-    else:
-        stdout = _squeue(jobid=jobid, full=True)
-        match = re.search("WorkDir=(.*),", stdout)
-        rundir[i] = match.group(1)
+    for line in StringIO.StringIO(_squeue(jobid=jobid, full=True)):
+        fields = _fields(line)
+        if "JobId" in fields:
+            rundir[fields["JobId"]] = fields.get("WorkDir")
     return rundir
 
 def job_status(jobid=None):
-    """Return job status using squeue
+    """Return job status using scontrol
 
        Returns a dict of dict, with jobid as key in outer dict.
        Inner dict contains:
        "name", "nodes", "procs", "walltime",
        "jobstatus": status ("Q","C","R", etc.)
-       "qstatstr": result of squeue -f jobid, None if not found
+       "qstatstr": the job's 'scontrol show job -o' record, None if not found
        "elapsedtime": None if not started, else seconds as int
        "starttime": None if not started, else seconds since epoch as int
        "completiontime": None if not completed, else seconds since epoch as int
@@ -164,107 +234,48 @@ def job_status(jobid=None):
     """
     status = dict()
 
-    stdout = _squeue(jobid=jobid, full=True)
-    sout = StringIO.StringIO(stdout)
-
-### TODO: figure out why jobstatus is being initialized as a None vs as a dict() and then checked for content ### pylint: disable=fixme
-    # jobstatus = None
-    jobstatus = {"jobid" : None, "name" : None, "nodes" : None, "procs" : None, "walltime" : None, "qstatstr" : None, "elapsedtime" : None, "starttime" : None, "completiontime" : None, "jobstatus" : None, "cluster": None}
-
-    for line in sout:
-        # Check for if we're at a new job header line
-        m = re.search(r"JobId=\s*(\S*)\s*", line)      #pylint: disable=invalid-name
-        if m:
-            if jobstatus["jobstatus"] is not None:
-                status[jobstatus["jobid"]] = jobstatus
-            jobstatus = {"jobid" : None, "name" : None, "nodes" : None, "procs" : None, "walltime" : None, "qstatstr" : None, "elapsedtime" : None, "starttime" : None, "completiontime" : None, "jobstatus" : None, "cluster" : None}
-            jobstatus["jobid"] = m.group(1)
-
-            # Grab the job name
-            m = re.match(r"\S*\s*Name=\s*(.*)\s?", line)       #pylint: disable=invalid-name
-            if m:
-                jobstatus["jobname"] = m.group(1)
-
-            # Save the full output
-            jobstatus["qstatstr"] = line
+    for line in StringIO.StringIO(_squeue(jobid=jobid, full=True)):
+        fields = _fields(line)
+        if "JobId" not in fields or "JobState" not in fields:
             continue
 
-        jobstatus["qstatstr"] += line
+        jobstatus = {"jobid" : fields["JobId"], "name" : fields.get("JobName", fields.get("Name")),
+                     "jobname" : fields.get("JobName", fields.get("Name")), "nodes" : None, "procs" : None,
+                     "walltime" : None, "qstatstr" : line, "elapsedtime" : None,
+                     "starttime" : None, "completiontime" : None, "jobstatus" : None,
+                     "cluster" : None}
 
-        # Look for the Nodes/PPN Info
-        m = re.search(r"NumNodes=\s*([0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            jobstatus["nodes"] = int(m.group(1))
-            m = re.match(r"\S*\s*NumCPUs=\s*([0-9]*)\s", line) #pylint: disable=invalid-name
-            if m:
-                jobstatus["procs"] = int(m.group(1))
-            continue
-
-
-        # Look for timing info
-        m = re.search(r"RunTime=\s*([0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            if m.group(1) == "Unknown":
-                continue
-            hrs, mns, scs = m.group(1).split(":")
-            runtime = datetime.timedelta(hours=int(hrs), minutes=int(mns), seconds=int(scs))
-            jobstatus["elapsedtime"] = runtime.seconds
-
-            m = re.match(r"\S*\s*TimeLimit=\s*([0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-            if m:
-                walltime = datetime.timedelta(hours=int(hrs), minutes=int(mns), seconds=int(scs))
-                jobstatus["walltime"] = walltime.seconds
-            continue
+        if fields.get("NumNodes", "").isdigit():
+            jobstatus["nodes"] = int(fields["NumNodes"])
+        if fields.get("NumCPUs", "").isdigit():
+            jobstatus["procs"] = int(fields["NumCPUs"])
 
-        # Grab the job start time
-        m = re.search(r"StartTime=\s*([0-9]*\-[0-9]*\-[0-9]*T[0-9]*:[0-9]*:[0-9]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            if m.group(1) == "Unknown":
-                continue
-            year, month, day = m.group(1).split("T")[0].split("-")
-            hrs, mns, scs = m.group(1).split("T")[1].split(":")
-            starttime = datetime.datetime(year=int(year), month=int(month), day=int(day), hour=int(hrs), minute=int(mns), second=int(scs))
-            jobstatus["starttime"] = time.mktime(starttime.timetuple())
-            continue
+        jobstatus["elapsedtime"] = _seconds(fields.get("RunTime", ""))
+        jobstatus["walltime"] = _seconds(fields.get("TimeLimit", ""))
 
-        # Grab the job status
-        m = re.search(r"JobState=\s*([a-zA-Z]*)\s", line) #pylint: disable=invalid-name
-        if m:
-            my_status = m.group(1)
-            if my_status == "RUNNING" or my_status == "CONFIGURING":
-                jobstatus["jobstatus"] = "R"
-            elif my_status == "BOOT_FAIL" or my_status == "FAILED" or my_status == "NODE_FAIL" or my_status == "CANCELLED" or my_status == "COMPLETED" or my_status == "PREEMPTED" or my_status == "TIMEOUT":
-                jobstatus["jobstatus"] = "C"
-            elif my_status == "COMPLETING" or my_status == "STOPPED":
-                jobstatus["jobstatus"] = "E"
-            elif my_status == "PENDING" or my_status == "SPECIAL_EXIT":
-                jobstatus["jobstatus"] = "Q"
-            elif my_status == "SUSPENDED":
-                jobstatus["jobstatus"] = "S"
-            else:
-                jobstatus["jobstatus"] = "?"
-            continue
+        try:
+            starttime = datetime.datetime.strptime(fields.get("StartTime", ""), "%Y-%m-%dT%H:%M:%S")
+            jobstatus["starttime"] = int(time.mktime(starttime.timetuple()))
+        except ValueError:
+            pass
 
-        # Grab the cluster/allocating node:
-        m = re.search(r"AllocNode:\s*.*=(.*):.*", line) #pylint: disable=invalid-name
-        if m:
-            raw_str = m.group(1)
-            m = re.search(r"(.*?)(?=[^a-zA-Z0-9]*login.*)", raw_str)    #pylint: disable=invalid-name
-            if m:
-                jobstatus["cluster"] = m.group(1)
-            else:
-                jobstatus["cluster"] = raw_str
+        jobstatus["jobstatus"] = _JOBSTATE.get(fields["JobState"], "?")
 
+        # Grab the cluster from the allocating node, "AllocNode:Sid=host:sid"
+        if "AllocNode:Sid" in fields:
+            jobstatus["cluster"] = cluster_name(fields["AllocNode:Sid"].split(":")[0])
 
-    if jobstatus["jobstatus"] is not None:
-        status[jobstatus["jobid"]] = jobstatus
+        # array elements are reported as "123_4"
+        for i in _record_ids(fields):
+            status[i] = dict(jobstatus, jobid=i)
 
     return status
 
-def submit(substr):
+def submit(substr, cwd=None):
     """Submit a PBS job using sbatch.
 
        substr: The submit script string
+       cwd: The directory to submit from (default: the current directory)
     """
     m = re.search(r"-J\s+(.*)\s", substr)       #pylint: disable=invalid-name
     if m:
@@ -275,7 +286,7 @@ def submit(substr):
             r"Error in pbs.misc.submit(). Jobname (\"-N\s+(.*)\s\") not found in submit string.")
     
     p = subprocess.Popen(   #pylint: disable=invalid-name
-        "sbatch", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        "sbatch", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
     stdout, stderr = p.communicate(input=substr)       #pylint: disable=unused-variable
     print stdout[:-1]
     if re.search("error", stdout):
@@ -286,31 +297,61 @@ def submit(substr):
 
 def delete(jobid):
     """scancel a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["scancel", jobid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()        #pylint: disable=unused-variable
-    return p.returncode
+    return run(["scancel", jobid], jobid=jobid)[0]
 
 def hold(jobid):
     """scontrol delay a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["scontrol", "update", "JobId=", jobid, "StartTime=", "now+30days"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["scontrol", "update", "JobId=" + jobid, "StartTime=now+30days"], jobid=jobid)[0]
 
 def release(jobid):
     """scontrol un-delay a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["scontrol", "update", "JobId=", jobid, "StartTime=", "now"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["scontrol", "update", "JobId=" + jobid, "StartTime=now"], jobid=jobid)[0]
 
 def alter(jobid, arg):
     """scontrol update PBS job.
 
         'arg' is a pbs command option string. For instance, "-a 201403152300.19"
     """
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["scontrol", "update", "JobId=", jobid] + arg.split(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["scontrol", "update", "JobId=" + jobid] + arg.split(), jobid=jobid)[0]
+
+def delete_many(jobid):
+    """scancel a list of PBS jobs, with as few scancel calls as possible.
+
+       Returns a dict of jobid: error message, or None if there was no error.
+    """
+    return run_batch(lambda chunk: ["scancel"] + chunk, jobid)
+
+def hold_many(jobid):
+    """scontrol delay a list of PBS jobs, see delete_many()"""
+    return run_batch(lambda chunk: ["scontrol", "update", "JobId=" + ",".join(chunk),
+                                    "StartTime=now+30days"], jobid)
+
+def release_many(jobid):
+    """scontrol un-delay a list of PBS jobs, see delete_many()"""
+    return run_batch(lambda chunk: ["scontrol", "update", "JobId=" + ",".join(chunk),
+                                    "StartTime=now"], jobid)
+
+def alter_many(jobid, arg):
+    """scontrol update a list of PBS jobs, see delete_many() and alter()"""
+    return run_batch(lambda chunk: ["scontrol", "update", "JobId=" + ",".join(chunk)]
+                     + arg.split(), jobid)
+
+def array_jobid(jobid, index):
+    """Return the jobid of element 'index' of the array job 'jobid' returned by
+       submit(): "123" -> "123_4" """
+    return jobid.split("_")[0] + "_" + str(index)
+
+def array_directive(indices):
+    """Return the submit script line requesting array elements 'indices' (a
+       string such as "0-9")"""
+    return "#SBATCH --array={0}\n".format(indices)
+
+def dependency_directive(jobid, kind="afterany"):
+    """Return the submit script line making a job wait for job 'jobid' (or each
+       job in the list 'jobid') to end ('kind' "afterany") or to end successfully ("afterok")"""
+    if isinstance(jobid, list):
+        jobid = ":".join(jobid)
+    return "#SBATCH --dependency={0}:{1}\n".format(kind, jobid)
+
+# environment variable holding the array element index in a running job
+ARRAY_INDEX_VAR = "SLURM_ARRAY_TASK_ID"
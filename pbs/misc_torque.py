@@ -4,12 +4,33 @@ import subprocess
 import os
 import StringIO
 import re
+import tempfile
 import datetime
 import time
 import sys
-from misc import getversion, getlogin, seconds, PBSError
-
-def _qstat(jobid=None, username=getlogin(), full=False, version=getversion()):
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+from misc import getversion, getlogin, seconds, run, run_batch, fan_out, PBSError
+
+# job_status() parser: "text" parses 'qstat -f', "xml" parses 'qstat -x'
+# incrementally. Set from the "qstat_parser" config.json value by configure().
+QSTAT_PARSER = "text"
+
+# Maximum number of elements in one array job submitted by pbs.submit_array().
+# Torque refuses larger arrays if the server sets max_job_array_size. Set from
+# the "max_array_size" config.json value by configure().
+MAX_ARRAY_SIZE = 1000
+
+def configure(config):
+    """Apply config.json settings: "qstat_parser" sets QSTAT_PARSER, and
+       "max_array_size" sets MAX_ARRAY_SIZE"""
+    global QSTAT_PARSER, MAX_ARRAY_SIZE     #pylint: disable=global-statement
+    QSTAT_PARSER = config.get("qstat_parser", QSTAT_PARSER)
+    MAX_ARRAY_SIZE = int(config.get("max_array_size", MAX_ARRAY_SIZE))
+
+def _qstat(jobid=None, username=None, full=False, version=None):
     """Return the stdout of qstat minus the header lines.
 
        By default, 'username' is set to the current user.
@@ -18,23 +39,15 @@ def _qstat(jobid=None, username=getlogin(), full=False, version=getversion()):
 
        Returns the text of qstat, minus the header lines
     """
+    if username is None:
+        username = getlogin()
+    if version is None:
+        version = getversion("torque")
 
     # -u and -f contradict in earlier versions of Torque
     if full and username is not None and int(version.split('.')[0]) < 5 and jobid is None:
         # First get all jobs by the user
-        qopt = ["qselect"]
-        qopt += ["-u", username]
-
-        # Call 'qselect' using subprocess
-        q = subprocess.Popen(qopt, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
-        stdout, stderr = q.communicate()    #pylint: disable=unused-variable
-
-        qsout = StringIO.StringIO(stdout)
-
-        # Get the jobids
-        jobid = []
-        for line in qsout:
-            jobid += [line.rstrip("\n")]
+        jobid = _qselect(username)
 
     opt = ["qstat"]
     # If there are jobid(s), you don't need a username
@@ -44,8 +57,9 @@ def _qstat(jobid=None, username=getlogin(), full=False, version=getversion()):
     elif username is not None and jobid is not None and not full:
         opt += ["-a"]
     # By this point we're guaranteed torque ver >= 5.0, so -u and -f are safe together
+    # -t lists each element of array jobs ("123[4]")
     if full:
-        opt += ["-f"]
+        opt += ["-f", "-t"]
     if jobid is not None:
         if isinstance(jobid, str) or isinstance(jobid, unicode):
             jobid = [jobid]
@@ -72,6 +86,21 @@ def _qstat(jobid=None, username=getlogin(), full=False, version=getversion()):
     # return the remaining text
     return sout.read()
 
+def _qselect(username):
+    """Return the list of job ids of the jobs owned by 'username', using qselect"""
+    # Call 'qselect' using subprocess
+    q = subprocess.Popen(["qselect", "-u", username], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)     #pylint: disable=invalid-name
+    stdout, stderr = q.communicate()    #pylint: disable=unused-variable
+
+    qsout = StringIO.StringIO(stdout)
+
+    # Get the jobids
+    jobid = []
+    for line in qsout:
+        if line.strip():
+            jobid += [line.rstrip("\n")]
+    return jobid
+
 def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
     """If 'name' given, returns a list of all jobs with a particular name using qstat.
        Else, if all=True, returns a list of all job ids by current user.
@@ -104,24 +133,26 @@ def job_id(all=False, name=None):       #pylint: disable=redefined-builtin
 def job_rundir(jobid):
     """Return the directory job "id" was run in using qstat.
 
+       'jobid' is a jobid string or a list of them, queried concurrently
+       (see misc.fan_out).
+
        Returns a dict, with id as key and rundir and value.
     """
-    rundir = dict()
+    if not isinstance(jobid, list):
+        jobid = [jobid]
 
-    if isinstance(id, (list)):
-        for i in jobid:
-            stdout = _qstat(jobid=i, full=True)
-            match = re.search(",PWD=(.*),", stdout)
-            rundir[i] = match.group(1)
-    else:
-        stdout = _qstat(jobid=jobid, full=True)
-        match = re.search(",PWD=(.*),", stdout)
-        rundir[i] = match.group(1)
-    return rundir
+    def _rundir(i):
+        """rundir of one job"""
+        match = re.search(",PWD=(.*?),", _qstat(jobid=i, full=True))
+        return match.group(1) if match else None
+
+    return dict(zip(jobid, fan_out(_rundir, jobid)))
 
-def job_status(jobid=None):
+def job_status(jobid=None, parser=None):
     """Return job status using qstat
 
+       'parser' is "text" or "xml", see QSTAT_PARSER (the default).
+
        Returns a dict of dict, with jobid as key in outer dict.
        Inner dict contains:
        "name", "nodes", "procs", "walltime",
@@ -133,6 +164,14 @@ def job_status(jobid=None):
 
        *This should be edited to return job_status_dict()'s*
     """
+    if parser is None:
+        parser = QSTAT_PARSER
+    if parser == "xml":
+        return _job_status_xml(jobid=jobid)
+    elif parser != "text":
+        raise PBSError(None, "Error in pbs.misc_torque.job_status(). Unknown parser: '"
+                       + str(parser) + "'. Expected 'text' or 'xml'.")
+
     status = dict()
 
     stdout = _qstat(jobid=jobid, full=True)
@@ -143,21 +182,28 @@ def job_status(jobid=None):
 
     for line in sout:
 
+        # jobs that are no longer known print "qstat: Unknown Job Id ..."
+        if line.startswith("qstat:"):
+            continue
+
         m = re.search(r"Job Id:\s*(.*)\s", line)      #pylint: disable=invalid-name
         if m:
             if jobstatus is not None:
                 if jobstatus["jobstatus"] == "R":           #pylint: disable=unsubscriptable-object
                     jobstatus["elapsedtime"] = int(time.time()) - jobstatus["starttime"]    #pylint: disable=unsubscriptable-object
+                jobstatus["qstatstr"] = "".join(jobstatus["qstatstr"])  #pylint: disable=unsubscriptable-object
                 status[jobstatus["jobid"]] = jobstatus #pylint: disable=unsubscriptable-object
             jobstatus = dict()
             jobstatus["jobid"] = m.group(1).split(".")[0]
-            jobstatus["qstatstr"] = line
+            jobstatus["qstatstr"] = [line]
             jobstatus["elapsedtime"] = None
             jobstatus["starttime"] = None
             jobstatus["completiontime"] = None
             continue
 
-        jobstatus["qstatstr"] += line
+        if jobstatus is None:
+            continue
+        jobstatus["qstatstr"].append(line)
 
         #results = line.split()
         #jobid = results[0].split(".")[0]
@@ -223,14 +269,134 @@ def job_status(jobid=None):
     if jobstatus is not None:
         if jobstatus["jobstatus"] == "R":
             jobstatus["elapsedtime"] = int(time.time()) - jobstatus["starttime"]
+        jobstatus["qstatstr"] = "".join(jobstatus["qstatstr"])
         status[jobstatus["jobid"]] = jobstatus
 
     return status
 
-def submit(substr):
+def _job_status_xml(jobid=None, username=None, version=None):
+    """Return job status as job_status() does, by parsing 'qstat -x'.
+
+       Each <Job> element is converted and then cleared, so memory does not
+       grow with the number of jobs. Times are read directly from the epoch
+       seconds given by 'qstat -x', and "qstatstr" is given in the form of
+       'qstat -f'. If 'jobid' is None, only jobs owned by 'username'
+       (default: the current user) are queried.
+
+       Raises PBSError if qstat fails, other than for unknown job ids.
+    """
+    if username is None:
+        username = getlogin()
+    if version is None:
+        version = getversion("torque")
+    opt = ["qstat", "-x", "-t"]
+    if jobid is None and username is not None:
+        # -u and -x contradict in earlier versions of Torque, as -u and -f do
+        if int(version.split('.')[0]) < 5:
+            jobid = _qselect(username)
+            if not jobid:
+                return dict()
+        else:
+            opt += ["-u", username]
+    if jobid is not None:
+        if isinstance(jobid, (str, unicode)):
+            jobid = [jobid]
+        opt += list(jobid)
+
+    # stderr goes to a file, so that qstat cannot block on a full stderr pipe
+    # while stdout is parsed as it is read
+    errfile = tempfile.TemporaryFile()
+    p = subprocess.Popen(opt, stdout=subprocess.PIPE, stderr=errfile)     #pylint: disable=invalid-name
+
+    status = dict()
+    root = None
+    parse_error = None
+    try:
+        for event, elem in ElementTree.iterparse(p.stdout, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != "Job":
+                continue
+
+            owner = elem.findtext("Job_Owner", "").split("@")[0]
+            if jobid is not None or username is None or owner == username:
+                jobstatus = _xml_job(elem)
+                status[jobstatus["jobid"]] = jobstatus
+            elem.clear()
+            root.clear()
+    except SyntaxError as e:    #pylint: disable=invalid-name
+        # iterparse raises a SyntaxError subclass for empty output (no jobs)
+        if root is not None:
+            parse_error = e
+    finally:
+        p.stdout.close()
+        p.wait()
+        errfile.seek(0)
+        stderr = errfile.read()
+        errfile.close()
+
+    # jobs that are no longer known print "qstat: Unknown Job Id ..."
+    if p.returncode != 0 and [line for line in stderr.splitlines()
+                              if line.strip() and not re.match(r"qstat: Unknown Job Id", line)]:
+        raise PBSError(None, "Error in pbs.misc_torque.job_status(). '" + " ".join(opt)
+                       + "' failed:\n" + stderr)
+    if parse_error is not None:
+        raise parse_error     #pylint: disable=raising-bad-type
+    return status
+
+# 'qstat -x' tags given in epoch seconds, which 'qstat -f' prints as dates
+_XML_TIME_TAGS = ("ctime", "etime", "mtime", "qtime", "start_time", "comp_time")
+
+def _xml_text(elem, prefix=""):
+    """Return the lines of 'qstat -f' for the children of the 'qstat -x'
+       element 'elem', e.g. "    Resource_List.walltime = 24:00:00\n" """
+    lines = []
+    for child in elem:
+        if len(child):
+            lines += _xml_text(child, prefix + child.tag + ".")
+            continue
+        if child.tag == "Job_Id":
+            continue
+        value = child.text or ""
+        if child.tag in _XML_TIME_TAGS and value.isdigit():
+            value = time.ctime(int(value))
+        lines.append("    " + prefix + child.tag + " = " + value + "\n")
+    return lines
+
+def _xml_job(elem):
+    """Convert one 'qstat -x' <Job> element to a job_status() dict"""
+    jobstatus = dict()
+    jobstatus["jobid"] = elem.findtext("Job_Id", "").split(".")[0]
+    jobstatus["jobname"] = elem.findtext("Job_Name")
+    jobstatus["jobstatus"] = elem.findtext("job_state")
+    jobstatus["qstatstr"] = "".join(["Job Id: " + elem.findtext("Job_Id", "") + "\n"]
+                                    + _xml_text(elem))
+
+    m = re.match(r"([0-9]+)(?::ppn=([0-9]+))?", elem.findtext("Resource_List/nodes", ""))  #pylint: disable=invalid-name
+    if m:
+        jobstatus["nodes"] = int(m.group(1))
+        jobstatus["procs"] = int(m.group(1))*int(m.group(2) or 1)
+
+    walltime = elem.findtext("Resource_List/walltime")
+    if walltime is not None:
+        jobstatus["walltime"] = int(seconds(walltime))
+
+    for key, tag in [("starttime", "start_time"), ("completiontime", "comp_time")]:
+        value = elem.findtext(tag)
+        jobstatus[key] = int(value) if value else None
+
+    jobstatus["elapsedtime"] = None
+    if jobstatus["jobstatus"] == "R" and jobstatus["starttime"] is not None:
+        jobstatus["elapsedtime"] = int(time.time()) - jobstatus["starttime"]
+    return jobstatus
+
+def submit(substr, cwd=None):
     """Submit a PBS job using qsub.
 
        substr: The submit script string
+       cwd: The directory to submit from (default: the current directory)
     """
     m = re.search(r"-N\s+(.*)\s", substr)       #pylint: disable=invalid-name
     if m:
@@ -241,7 +407,7 @@ def submit(substr):
             r"Error in pbs.misc.submit(). Jobname (\"-N\s+(.*)\s\") not found in submit string.")
 
     p = subprocess.Popen(   #pylint: disable=invalid-name
-        "qsub", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        "qsub", stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd)
     stdout, stderr = p.communicate(input=substr)       #pylint: disable=unused-variable
     print stdout[:-1]
     if re.search("error", stdout):
@@ -252,32 +418,58 @@ def submit(substr):
 
 def delete(jobid):
     """qdel a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["qdel", jobid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()        #pylint: disable=unused-variable
-    return p.returncode
+    return run(["qdel", jobid], jobid=jobid)[0]
 
 def hold(jobid):
     """qhold a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["qhold", jobid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["qhold", jobid], jobid=jobid)[0]
 
 def release(jobid):
     """qrls a PBS job."""
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["qrls", jobid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["qrls", jobid], jobid=jobid)[0]
 
 def alter(jobid, arg):
     """qalter a PBS job.
 
         'arg' is a pbs command option string. For instance, "-a 201403152300.19"
     """
-    p = subprocess.Popen(   #pylint: disable=invalid-name
-        ["qalter"] + arg.split() + [jobid], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    stdout, stderr = p.communicate()    #pylint: disable=unused-variable
-    return p.returncode
+    return run(["qalter"] + arg.split() + [jobid], jobid=jobid)[0]
 
+def delete_many(jobid):
+    """qdel a list of PBS jobs, with as few qdel calls as possible.
+
+       Returns a dict of jobid: error message, or None if there was no error.
+    """
+    return run_batch(lambda chunk: ["qdel"] + chunk, jobid)
+
+def hold_many(jobid):
+    """qhold a list of PBS jobs, see delete_many()"""
+    return run_batch(lambda chunk: ["qhold"] + chunk, jobid)
+
+def release_many(jobid):
+    """qrls a list of PBS jobs, see delete_many()"""
+    return run_batch(lambda chunk: ["qrls"] + chunk, jobid)
+
+def alter_many(jobid, arg):
+    """qalter a list of PBS jobs, see delete_many() and alter()"""
+    return run_batch(lambda chunk: ["qalter"] + arg.split() + chunk, jobid)
+
+def array_jobid(jobid, index):
+    """Return the jobid of element 'index' of the array job 'jobid' returned by
+       submit(): "123[]" -> "123[4]" """
+    return jobid.split("[")[0] + "[" + str(index) + "]"
+
+def array_directive(indices):
+    """Return the submit script line requesting array elements 'indices' (a
+       string such as "0-9")"""
+    return "#PBS -t {0}\n".format(indices)
+
+def dependency_directive(jobid, kind="afterany"):
+    """Return the submit script line making a job wait for job 'jobid' (or each
+       job in the list 'jobid') to end ('kind' "afterany") or to end successfully ("afterok")"""
+    if isinstance(jobid, list):
+        jobid = ":".join(jobid)
+    return "#PBS -W depend={0}:{1}\n".format(kind, jobid)
+
+# environment variable holding the array element index in a running job
+ARRAY_INDEX_VAR = "PBS_ARRAYID"
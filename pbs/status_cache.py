@@ -0,0 +1,126 @@
+""" StatusCache class, a job_status() snapshot shared between processes """
+
+import os
+import time
+import json
+import fcntl
+import tempfile
+
+class StatusCache(object):
+    """An on-disk snapshot of the scheduler's job status, shared by every process
+       of one user on one cluster (pstat, taskmaster, complete_job, ...), so
+       that they do not each call qstat/squeue. JobDB keeps one file per
+       cluster, as clusters may share $HOME.
+
+       Contains variables:
+         path: the snapshot file, a json dict {"time": float, "status": dict}
+         lockpath: lock file held while the snapshot is refreshed
+         ttl: a snapshot younger than 'ttl' seconds is used as is; 0 disables the cache
+         stale: a snapshot younger than 'stale' seconds is used as is while it is
+           refreshed in the background (stale-while-revalidate); older snapshots
+           are refreshed before returning
+    """
+
+    def __init__(self, path, ttl=15.0, stale=120.0):
+        self.path = path
+        self.lockpath = path + ".lock"
+        self.ttl = float(ttl)
+        self.stale = max(float(stale), self.ttl)
+
+
+    def get(self, job_status):
+        """Return (snapshot time, status) for the current user's jobs.
+
+           job_status: function returning the scheduler's job status, called
+             without arguments when the snapshot must be refreshed (for example
+             misc_torque.job_status)
+        """
+        if self.ttl <= 0.0:
+            return (time.time(), job_status())
+
+        cached = self._read()
+        if cached is not None:
+            age = time.time() - cached[0]
+            if age < self.ttl:
+                return cached
+            elif age < self.stale:
+                self._refresh_background(job_status)
+                return cached
+
+        return self._refresh(job_status)
+
+
+    def fresh(self):
+        """Return (snapshot time, status) if the snapshot is younger than 'ttl', else None"""
+        if self.ttl <= 0.0:
+            return None
+        cached = self._read()
+        if cached is not None and time.time() - cached[0] < self.ttl:
+            return cached
+        return None
+
+
+    def _read(self):
+        """Return (snapshot time, status) from the snapshot file, or None"""
+        try:
+            with open(self.path) as my_json:
+                data = json.load(my_json)
+            return (data["time"], data["status"])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+
+    def _write(self, snapshot_time, status):
+        """Atomically replace the snapshot file"""
+        fd, tmppath = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".")
+        try:
+            with os.fdopen(fd, "w") as my_json:
+                json.dump({"time" : snapshot_time, "status" : status}, my_json)
+            os.rename(tmppath, self.path)
+        except:
+            os.remove(tmppath)
+            raise
+
+
+    def _refresh(self, job_status, blocking=True):
+        """Refresh the snapshot while holding the lock, and return it.
+
+           If another process refreshed it while waiting for the lock, that
+           snapshot is returned instead. If not 'blocking' and the lock is
+           held by another process, return None.
+        """
+        with open(self.lockpath, "a") as lockfile:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except IOError:
+                return None
+            try:
+                cached = self._read()
+                if cached is not None and time.time() - cached[0] < self.ttl:
+                    return cached
+                snapshot_time = time.time()
+                status = job_status()
+                self._write(snapshot_time, status)
+                return (snapshot_time, status)
+            finally:
+                fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+
+    def _refresh_background(self, job_status):
+        """Refresh the snapshot in a detached process, unless one is already refreshing"""
+        pid = os.fork()
+        if pid == 0:
+            # double fork, so the refreshing process is not left a zombie
+            try:
+                if os.fork() == 0:
+                    # close the files inherited from the parent, such as its
+                    # sqlite database, which must not be used from a forked
+                    # process; the parent keeps using them
+                    os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+                    try:
+                        self._refresh(job_status, blocking=False)
+                    except Exception:   #pylint: disable=broad-except
+                        pass
+            finally:
+                os._exit(0) #pylint: disable=protected-access
+        os.waitpid(pid, 0)
@@ -0,0 +1,89 @@
+""" Class for workflows of Job objects with dependencies """
+### External ###
+import collections
+
+### Local ###
+import jobdb
+import misc
+
+class Workflow(object):
+    """A named set of Job objects, some depending on others.
+
+    Jobs are added with add(), then submit() submits all of them at once, in
+    topological order, each with a scheduler dependency on the jobs it
+    depends on. The jobs and dependencies are stored in the JobDB database
+    (see JobDB.add_workflow()), and 'pstat' lists how many jobs of each
+    workflow are done, ready to run, or blocked.
+
+    Submitting a workflow with the same name again, for example after a
+    crash, only submits the jobs that were not submitted yet.
+
+    A job waits for the jobs it depends on, not for their continuations, so
+    only let 'auto' jobs that complete without being continued be depended on.
+
+    Example:
+        wf = pbs.Workflow("bands")
+        wf.add("relax", pbs.Job(name="relax", command="relax.sh", ...))
+        wf.add("band", pbs.Job(name="band", command="band.sh", ...), after=["relax"])
+        wf.add("dos", pbs.Job(name="dos", command="dos.sh", ...), after=["relax"])
+        wf.submit()
+    """
+
+    def __init__(self, name, kind="afterok"):
+        """'name' identifies the workflow in the JobDB database. With 'kind'
+           "afterok" a job only runs if the jobs it depends on succeed, with
+           "afterany" it runs once they end."""
+        self.name = name
+        self.kind = kind
+        self.jobs = collections.OrderedDict()
+        self.edges = []
+
+    def add(self, node, job, after=None):
+        """Add Job 'job' to the workflow as 'node', a name unique in the
+           workflow, depending on the jobs named in the list 'after'.
+
+           Returns 'node'.
+        """
+        if node in self.jobs:
+            raise jobdb.JobDBError("Workflow " + self.name + " already has a job " + str(node))
+        self.jobs[node] = job
+        for parent in (after or []):
+            self.edges.append((parent, node))
+        return node
+
+    def submit(self, concurrency=None, dbpath=None, configpath=None):
+        """Submit the jobs of this workflow not yet submitted, from the current
+           directory, with at most 'concurrency' submissions at a time (see
+           JobDB.submit_workflow()). Each Job's jobID is set.
+
+           Returns a dict {node: jobid} of the submitted jobs.
+
+           Raises JobDBError if a dependency is on an unknown job or the
+           dependencies form a cycle, and PBSError if any submission failed,
+           or, with "afterok", a job was not submitted because a job it
+           depends on ended without being marked 'Complete'. Its 'failed'
+           attribute is the list of failed nodes, and its
+           'results' attribute the dict of submitted jobs.
+        """
+        status = []
+        for node, job in self.jobs.iteritems():
+            status.append(job.status_dict())
+            status[-1]["node"] = node
+
+        db = jobdb.JobDB(dbpath=dbpath, configpath=configpath) #pylint: disable=invalid-name
+        try:
+            db.add_workflow(self.name, status, self.edges)
+            jobids = db.submit_workflow(self.name, self.kind, concurrency)
+        except misc.PBSError as e:  #pylint: disable=invalid-name
+            self._set_jobids(e.results)
+            raise
+        finally:
+            db.close()
+        self._set_jobids(jobids)
+        return jobids
+
+    def _set_jobids(self, jobids):
+        """Set the jobID of the Job of each node in the dict 'jobids'"""
+        for node, jobid in jobids.iteritems():
+            if node in self.jobs:
+                self.jobs[node].jobID = jobid